@@ -1,192 +1,1047 @@
 import os
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, Response, g, render_template, request, jsonify, session
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from config import Config
-from models import db, User, Order, UserRole, OrderStatus
+from database import (READ_BIND, READ_ONLY_KEY, RecentWriters, configure_sqlite, drop_indexes, engine_options,
+                      ensure_indexes, ensure_order_ids, is_replica, read_bind)
+from models import db, User, Order, ArchivedOrder, UserRole, OrderStatus, DriverTrackPoint, OBSOLETE_ORDER_INDEXES
+from queue_state import DriverQueue, QueueDeltaTracker, OrderBacklog
+from scheduler import DeadlineScheduler
+from dispatcher import Dispatcher, DispatcherBusy
+from coordination import LockTimeout, create_coordination
+from geo import GridIndex
+from matching import haversine_matrix, solve_assignment
+from presence import PresenceTracker
+from demand import DemandHeatmap
+from tracking import LocationTracker
+from metrics import Registry, SQL_BUCKETS, track_sql
+from profiling import RequestProfiler
+from geocode import GeocodeUnavailable, create_geocoder
+from fares import create_fare_engine
+from longpoll import VersionBoard, WaitSlots
+import archive
+import outbox
+from auth import current_user, current_user_facts, login_required, monitoring_required, user_facts, user_facts_for
+from sqlalchemy import event as sa_event, exists, insert, or_, select, update
 from datetime import datetime, timedelta
+from functools import wraps
+import numpy as np
+import calendar
+import logging
+import secrets
 import threading
 import time
 
+logger = logging.getLogger(__name__)
+
+# Метрики для GET /metrics (Prometheus); гейджи состояния регистрируются ниже, рядом с объектами
+metrics = Registry()
+HTTP_REQUESTS = metrics.counter('http_requests_total', 'HTTP requests by route and status', ('method', 'route', 'status'))
+HTTP_LATENCY = metrics.histogram('http_request_duration_seconds', 'HTTP request latency by route', ('method', 'route'))
+SQL_LATENCY = metrics.histogram('db_query_duration_seconds', 'SQL statement execution time', buckets=SQL_BUCKETS)
+DISPATCH_LATENCY = metrics.histogram('dispatch_duration_seconds', 'assign_order_to_next_driver duration by outcome', ('outcome',))
+ORDER_TIMEOUTS = metrics.counter('order_timeouts_total', 'Orders taken back from a driver after the acceptance timeout')
+ORDER_REJECTIONS = metrics.counter('order_rejections_total', 'Orders rejected by drivers')
+SOCKET_EMITS = metrics.counter('socketio_emits_total', 'Socket.IO events emitted by event name', ('event',))
+SOCKET_CONNECTIONS = metrics.gauge('socketio_connections', 'Connected Socket.IO clients by role', ('role',))
+DRIVER_LOCATION_FIXES = metrics.counter('driver_location_fixes_total', 'Driver location fixes received')
+GEOCODE_LOOKUPS = metrics.counter('geocode_lookups_total', 'Reverse geocoding lookups by source', ('source',))
+ORDER_EVENTS_PUBLISHED = metrics.counter('order_events_published_total', 'Order events delivered from the outbox')
+ORDER_EVENT_DELAY = metrics.histogram('order_event_publish_delay_seconds', 'Time from the outbox commit to the Socket.IO emit')
+ORDERS_ARCHIVED = metrics.counter('orders_archived_total', 'Completed and cancelled orders moved to orders_archive')
+DISPATCH_REJECTED = metrics.counter('dispatch_commands_rejected_total', 'Dispatch commands rejected because the queue was full', ('command',))
+
+# Профилировщик запросов — только при PROFILE_REQUESTS=1, иначе None и никаких накладных расходов
+profiler = RequestProfiler(
+    slow_ms=Config.PROFILE_SLOW_MS,
+    sample_interval_ms=Config.PROFILE_SAMPLE_INTERVAL_MS,
+    log_path=Config.PROFILE_LOG or None,
+) if Config.PROFILE_REQUESTS else None
+
+
+class InstrumentedSocketIO(SocketIO):
+    """SocketIO, считающий исходящие события и (при профилировании) трассирующий обработчики."""
+
+    def emit(self, event, *args, **kwargs):
+        # flask_socketio.emit тоже идет через этот метод
+        SOCKET_EMITS.inc(event)
+        return super().emit(event, *args, **kwargs)
+
+    def on(self, message, namespace=None):
+        register = super().on(message, namespace)
+        if profiler is None:
+            return register
+
+        def decorator(handler):
+            register(profiler.wrap(f'socket {message}', handler))
+            return handler
+        return decorator
+
+
 app = Flask(__name__)
 app.config.from_object(Config)
+app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+if read_bind(app.config) is not None:
+    app.config.setdefault('SQLALCHEMY_BINDS', {READ_BIND: read_bind(app.config)})
 db.init_app(app)
+with app.app_context():
+    configure_sqlite(db.engine, app.config)
+    track_sql(db.engine, SQL_LATENCY)
+    if profiler is not None:
+        profiler.install(db.engine)
+    read_engine = db.engines.get(READ_BIND)
+    if read_engine is not None:
+        configure_sqlite(read_engine, app.config, read_only=True)
+        track_sql(read_engine, SQL_LATENCY)
+        if profiler is not None:
+            profiler.install(read_engine)
 # Для HTTPS в dev: eventlet не принимает ssl_context, поэтому используем threading/Werkzeug
 _async_mode = "threading" if os.environ.get("USE_HTTPS") == "1" else None
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode=_async_mode)
-
-# Глобальная очередь водителей (ID водителей в порядке очереди)
-driver_queue = []
-# Внутри очереди местами вызываются функции, которые тоже берут lock (например get_queue_snapshot()).
-# Поэтому используем RLock, чтобы избежать взаимной блокировки.
-queue_lock = threading.RLock()
+# Несколько процессов (COORDINATION_URL): общая очередь, блокировка диспетчеров и рассылка Socket.IO
+# через Redis; без него — один процесс и все в памяти (см. coordination.py)
+coordination = create_coordination(app.config)
+socketio = InstrumentedSocketIO(app, cors_allowed_origins="*", async_mode=_async_mode,
+                                client_manager=coordination.socketio_manager())
+
+# Глобальная очередь водителей (в памяти процесса, с версией; БД — только отражение).
+# С координатором порядок хранится в нем, а здесь — копия, которую подтягивает sync()
+driver_queue = coordination.driver_queue()
+# Рассылка изменений очереди дельтами с порядковым номером (полный снимок — по запросу/при подключении)
+QUEUE_BROADCAST_KEY = 'queue-broadcast'
+queue_deltas = QueueDeltaTracker()
+# Последние координаты водителей онлайн: driver_id -> (lat, lng, ts)
+driver_locations = {}
+# Пространственный индекс свободных водителей онлайн (для политики 'nearest')
+free_drivers_index = GridIndex(cell_km=Config.SPATIAL_CELL_KM)
+# Заказы, которым пока не нашлось водителя; разбираются при освобождении любого водителя
+order_backlog = OrderBacklog(decline_ttl=Config.ORDER_DECLINE_TTL_SECONDS)
+# Истечение отказов: заказ, от которого отказались все водители, предлагается им снова
+DECLINE_EXPIRY_KEY = 'decline-expiry'
+# Пакетное назначение: новые заказы копятся DISPATCH_BATCH_WINDOW_SECONDS и распределяются разом
+BATCH_DISPATCH_KEY = 'batch-dispatch'
+batch_orders = set()
+# Живые Socket.IO-соединения водителей; недоступных снимает с линии периодическая проверка
+presence = PresenceTracker()
+PRESENCE_SWEEP_KEY = 'presence-sweep'
+# Поток координат водителей: буферы в памяти, пересылка пассажиру и трек в БД пачками
+location_tracker = LocationTracker(
+    buffer_size=Config.LOCATION_BUFFER_SIZE,
+    track_interval=Config.LOCATION_TRACK_INTERVAL_SECONDS,
+    track_min_distance_m=Config.LOCATION_TRACK_MIN_DISTANCE_M,
+    max_pending=Config.LOCATION_TRACK_MAX_PENDING,
+)
+LOCATION_FORWARD_KEY = 'location-forward'
+LOCATION_TRACK_KEY = 'location-track'
+# Карта спроса (ячейки geohash): меняется вместе с заказами, водителям рассылается не чаще интервала
+demand_heatmap = DemandHeatmap(precision=Config.DEMAND_GEOHASH_PRECISION, half_life=Config.DEMAND_HALF_LIFE_SECONDS,
+                               on_change=lambda: _schedule_demand_broadcast())
+DEMAND_BROADCAST_KEY = 'demand-broadcast'
+# Таймеры пропавших воркеров (только с координатором)
+ORDER_TIMER_ADOPT_KEY = 'order-timer-adopt'
+# Outbox событий заказа: публикатор запускается после commit с событиями (см. outbox.py)
+OUTBOX_PUBLISH_KEY = 'outbox-publish'
+# Перенос старых заказов в архив (раз в ORDER_ARCHIVE_INTERVAL_SECONDS, см. archive.py)
+ORDER_ARCHIVE_KEY = 'order-archive'
+# Версии заказов в памяти: ETag/304 и long-poll без БД (версия меняется после каждого commit заказа)
+order_versions = VersionBoard(max_keys=Config.LONGPOLL_MAX_ORDERS)
+long_poll_slots = WaitSlots(Config.LONGPOLL_MAX_WAITERS)
+# Часть ETag: после перезапуска версии в памяти начинаются заново, старые ETag не должны совпасть
+BOOT_TAG = secrets.token_hex(4)
+# Тарифы: цена заказа при создании и оценка маршрутов для UI
+fare_engine = create_fare_engine(app.config)
+# Обратный геокодинг для клиентов: кэш и общий лимит запросов к провайдеру (см. geocode.py)
+geocoder = create_geocoder(app.config)
+# Позиции в очереди, ждущие записи в БД: пишутся одним commit в конце пачки команд диспетчера
+pending_queue_positions = {}
+# Изменения кэшей в памяти, которые должны увидеть и остальные воркеры (без координатора — обычные вызовы)
+bump_order_version = coordination.replicated('order_version', order_versions.bump)
+decline_order = coordination.replicated('order_declined', order_backlog.decline)
+forget_declines = coordination.replicated('order_settled', order_backlog.forget)
+# Точки водителя приходят в воркер, где его соединение, — там и нужно знать его пассажира
+assign_trip = coordination.replicated('trip_assign', location_tracker.assign)
+start_trip_forwarding = coordination.replicated('trip_forward', location_tracker.start_forwarding)
+release_trip = coordination.replicated('trip_release', location_tracker.release)
+invalidate_user_facts = coordination.replicated('user_facts', user_facts.invalidate)
+record_demand = coordination.replicated('demand_add', demand_heatmap.add)
+set_demand_waiting = coordination.replicated('demand_waiting', demand_heatmap.set_waiting)
+forget_demand = coordination.replicated('demand_forget', demand_heatmap.forget)
+# Чтение с реплики: кто недавно писал (или чьи заказы менялись), читает из основной БД
+recent_writers = RecentWriters(Config.DB_READ_MAX_STALENESS_SECONDS if is_replica(app.config) else 0)
+mark_recent_write = coordination.replicated('recent_write', recent_writers.mark)
+
+
+def _run_in_app_context(fn, *args):
+    # Колбэки, меняющие назначения (таймаут, пакет, проверка присутствия), идут через диспетчер
+    if fn in DISPATCH_TIMER_CALLBACKS:
+        dispatcher.submit(fn.__name__, fn, *args, block=True)
+        return
+    with app.app_context():
+        if profiler is not None:
+            fn = profiler.wrap(f'timer {fn.__name__}', fn)
+        fn(*args)
+
+
+# Дедлайны принятия заказов (ключ — order_id); один поток на все таймеры
+order_timers = DeadlineScheduler(runner=_run_in_app_context, name='order-timers')
+# Архивация — в своем потоке: пачка INSERT … SELECT / DELETE не задерживает таймеры заказов,
+# рассылку событий outbox и координаты водителей в order_timers
+archive_timers = DeadlineScheduler(runner=_run_in_app_context, name='order-archive')
+
+
+def _pending_order_deadlines():
+    """Дедлайны принятия заказов; служебные таймеры (ключи-строки) в том же планировщике не считаются."""
+    return order_timers.count(lambda key: isinstance(key, int))
+
+
+def _flush_queue_positions():
+    _persist_queue_positions(pending_queue_positions.copy())
+    pending_queue_positions.clear()
+
+
+# Единственный поток, меняющий очередь, backlog и статусы назначений (см. dispatcher.py);
+# с координатором пачки команд всех воркеров идут по одной под общей блокировкой
+dispatcher = Dispatcher(
+    context=app.app_context,
+    wrap=profiler.wrap if profiler is not None else None,
+    on_batch_end=_flush_queue_positions,
+    guard=coordination.dispatch_lock,
+    maxsize=Config.DISPATCH_QUEUE_SIZE,
+    batch_size=Config.DISPATCH_COMMAND_BATCH_SIZE,
+)
+
+metrics.gauge('driver_queue_length', 'Drivers in the queue', fn=lambda: len(driver_queue))
+metrics.gauge('dispatch_queue_depth', 'Commands waiting for the dispatcher thread', fn=lambda: len(dispatcher))
+metrics.gauge('order_deadlines_pending', 'Order acceptance deadlines waiting in the scheduler', fn=_pending_order_deadlines)
+metrics.gauge('order_backlog_depth', 'Orders waiting for a free driver', fn=lambda: len(order_backlog))
+metrics.gauge('demand_heatmap_cells', 'Geohash cells in the demand heatmap', fn=lambda: len(demand_heatmap))
+metrics.gauge('driver_connections_live', 'Live Socket.IO connections of drivers', fn=lambda: len(presence))
+metrics.gauge('drivers_unreachable', 'Drivers without a live connection', fn=lambda: len(presence.unreachable()))
+metrics.gauge('driver_location_buffers', 'Drivers with buffered location fixes', fn=lambda: len(location_tracker))
+metrics.gauge('driver_track_points_pending', 'Track points waiting for the batched DB write', fn=location_tracker.pending_track_points)
+metrics.gauge('geocode_cache_hit_ratio', 'Share of geocode lookups served without the provider', fn=geocoder.hit_rate)
+metrics.gauge('long_poll_waiters', 'Requests parked in long-poll', fn=lambda: len(long_poll_slots))
+metrics.gauge('process_threads', 'Threads in this process', fn=threading.active_count)
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+    if profiler is not None:
+        rule = request.url_rule.rule if request.url_rule is not None else request.path
+        profiler.start(f'{request.method} {rule}')
+
+
+@app.after_request
+def _record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_LATENCY.observe(time.perf_counter() - started, request.method, route)
+        HTTP_REQUESTS.inc(request.method, route, str(response.status_code))
+    if profiler is not None and profiler.current() is not None:
+        profiler.current().status = response.status_code
+    if recent_writers.window and request.method != 'GET' and session.get('user_id'):
+        mark_recent_write(session.get('user_id'))
+    return response
+
+
+def read_only_db(view):
+    """Декоратор GET-обработчика: SELECT идут через движок чтения (см. database.RoutingSession)."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if read_engine is not None and not recent_writers.recent(session.get('user_id')):
+            db.session.info[READ_ONLY_KEY] = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@app.teardown_request
+def _finish_request_trace(exc):
+    if profiler is not None:
+        profiler.finish()
 
-# Активные таймеры для заказов
-order_timers = {}
 
 def get_queue_snapshot():
-    """Единый источник правды по очереди: берём из БД (is_online + queue_position)."""
-    drivers = User.query.filter(User.role == UserRole.DRIVER, User.is_online == True).all()
-    drivers.sort(key=lambda u: (u.queue_position is None, u.queue_position or 0, u.id))
-    q = [u.id for u in drivers]
-
-    # Нормализуем queue_position в БД (1..N) — чтобы не было дублей/пропусков между процессами
-    changed = False
-    for idx, u in enumerate(drivers, 1):
-        if u.queue_position != idx:
-            u.queue_position = idx
-            changed = True
-    if changed:
-        db.session.commit()
+    """Снимок очереди из памяти: {'queue', 'count', 'positions', 'version'} — без запросов к БД."""
+    return driver_queue.snapshot()
+
+
+def _persist_queue_positions(changed):
+    """Записать в БД queue_position только тех водителей, чья позиция изменилась."""
+    if not changed:
+        return
+    db.session.execute(
+        update(User),
+        [{'id': driver_id, 'queue_position': pos} for driver_id, pos in changed.items()]
+    )
+    db.session.commit()
+
+
+def emit_queue_updated():
+    """Запланировать рассылку изменений очереди.
+
+    Изменения копятся QUEUE_BROADCAST_INTERVAL_SECONDS и уходят одной рассылкой,
+    так что 30 водителей, вышедших на линию разом, дают одну рассылку, а не 30.
+    """
+    order_timers.schedule_if_absent(QUEUE_BROADCAST_KEY, Config.QUEUE_BROADCAST_INTERVAL_SECONDS, _flush_queue_broadcast)
+
+
+def _flush_queue_broadcast():
+    """Адресная рассылка: счетчик — в комнаты drivers/passengers, позиция — только самому водителю.
+
+    Только своим клиентам (ignore_queue): каждый воркер рассылает изменения из своей копии очереди.
+    """
+    delta = queue_deltas.delta(get_queue_snapshot())
+    if not delta:
+        return
+    if delta['count_changed']:
+        socketio.emit('drivers_count', {'count': delta['count'], 'seq': delta['seq']}, room=['drivers', 'passengers'],
+                      ignore_queue=True)
+    for driver_id, position in delta['positions'].items():
+        socketio.emit('queue_position', {
+            'position': position,
+            'count': delta['count'],
+            'seq': delta['seq']
+        }, room=f'driver_{driver_id}', ignore_queue=True)
+
+
+def _schedule_demand_broadcast():
+    order_timers.schedule_if_absent(DEMAND_BROADCAST_KEY, Config.DEMAND_BROADCAST_INTERVAL_SECONDS, _broadcast_demand)
 
-    # Синхронизируем локальную копию (может жить в нескольких процессах)
-    with queue_lock:
-        driver_queue.clear()
-        driver_queue.extend(q)
 
-    positions = {str(driver_id): idx for idx, driver_id in enumerate(q, 1)}
-    return {'queue': q, 'count': len(q), 'positions': positions}
+def demand_snapshot():
+    """Карта спроса для клиента: [[geohash, вес, ждущих заказов]], самые горячие первыми."""
+    cells = demand_heatmap.snapshot(Config.DEMAND_MIN_WEIGHT, Config.DEMAND_MAX_CELLS)
+    return {
+        'precision': demand_heatmap.precision,
+        'half_life': demand_heatmap.half_life,
+        'cells': [[key, round(weight, 2), waiting] for key, weight, waiting in cells],
+        'version': demand_heatmap.version,
+    }
 
 
-def emit_queue_updated(snapshot=None):
-    """Рассылка актуальной очереди/счетчиков всем клиентам."""
-    if snapshot is None:
-        snapshot = get_queue_snapshot()
-    socketio.emit('queue_updated', snapshot)
+def _broadcast_demand():
+    """Карта спроса водителям; только своим клиентам (ignore_queue) — изменения карты есть у каждого воркера."""
+    socketio.emit('demand_heatmap', demand_snapshot(), room='drivers', ignore_queue=True)
+
+
+def _on_shared_queue_change(version):
+    """Очередь изменил другой воркер: подтянуть копию и разослать изменения своим клиентам."""
+    if driver_queue.sync(version):
+        emit_queue_updated()
+
+
+coordination.on('queue', _on_shared_queue_change)
+
+
+def record_order_event(order_id, event, room, payload):
+    """Событие заказа в текущую транзакцию: разошлет publish_order_events после commit."""
+    outbox.record(db.session, order_id, event, room, payload)
+
+
+@sa_event.listens_for(db.session, 'after_commit')
+def _publish_order_events_after_commit(session):
+    rooms = session.info.pop(outbox.ROOMS_KEY, None)
+    if rooms and recent_writers.window:
+        # Получатели событий увидят изменение в ответах GET только из основной БД (пока реплика догоняет)
+        mark_recent_write(*{int(room.rsplit('_', 1)[1]) for room in rooms})
+    if session.info.pop(outbox.PENDING_KEY, False):
+        order_timers.schedule_if_absent(OUTBOX_PUBLISH_KEY, 0, publish_order_events)
+
+
+def publish_order_events():
+    """Разослать события из outbox пачкой (в потоке order-timers, вне пути запроса)."""
+    try:
+        token = coordination.try_lock('outbox', Config.COORDINATION_LOCK_TTL_SECONDS)
+        if not token:
+            # Рассылает другой воркер; наши строки он мог уже не увидеть — проверим чуть позже
+            order_timers.schedule_if_absent(OUTBOX_PUBLISH_KEY, Config.COORDINATION_LOCK_RETRY_SECONDS,
+                                            publish_order_events)
+            return
+        try:
+            sent = outbox.publish_pending(db.session, socketio.emit, Config.OUTBOX_BATCH_SIZE)
+        finally:
+            coordination.unlock('outbox', token)
+    except Exception:
+        # Неразосланные строки остаются в outbox — повторим позже
+        logger.exception('Order events publish failed, retrying in %s s', Config.OUTBOX_RETRY_SECONDS)
+        order_timers.schedule_if_absent(OUTBOX_PUBLISH_KEY, Config.OUTBOX_RETRY_SECONDS, publish_order_events)
+        return
+    now = datetime.utcnow()
+    for _, created_at in sent:
+        ORDER_EVENT_DELAY.observe((now - created_at).total_seconds())
+    if sent:
+        ORDER_EVENTS_PUBLISHED.inc(amount=len(sent))
+    if len(sent) == Config.OUTBOX_BATCH_SIZE:
+        order_timers.schedule_if_absent(OUTBOX_PUBLISH_KEY, 0, publish_order_events)
+
+
+def resume_order_events():
+    """После перезапуска: разослать события, закоммиченные, но не отправленные прошлым процессом."""
+    order_timers.schedule_if_absent(OUTBOX_PUBLISH_KEY, 0, publish_order_events)
+
+
+def archive_orders():
+    """Перенести пачку старых завершенных/отмененных заказов в архив (в потоке order-archive)."""
+    moved = 0
+    try:
+        token = coordination.try_lock('archive', Config.COORDINATION_LOCK_TTL_SECONDS)
+        if token:
+            try:
+                before = datetime.utcnow() - timedelta(days=Config.ORDER_ARCHIVE_AFTER_DAYS)
+                moved = archive.archive_batch(db.session, before, Config.ORDER_ARCHIVE_BATCH_SIZE)
+            finally:
+                coordination.unlock('archive', token)
+    except Exception:
+        db.session.rollback()
+        logger.exception('Order archiving failed')
+    if moved:
+        ORDERS_ARCHIVED.inc(amount=moved)
+    # Полная пачка — наверняка есть еще: следующую сразу, но отдельной транзакцией (писатели не ждут долго)
+    delay = 0 if moved == Config.ORDER_ARCHIVE_BATCH_SIZE else Config.ORDER_ARCHIVE_INTERVAL_SECONDS
+    archive_timers.schedule(ORDER_ARCHIVE_KEY, delay, archive_orders)
+
+
+def start_order_archive():
+    """Запустить периодический перенос заказов в архив (ORDER_ARCHIVE_AFTER_DAYS=0 — выключен)."""
+    if Config.ORDER_ARCHIVE_AFTER_DAYS > 0:
+        archive_timers.schedule_if_absent(ORDER_ARCHIVE_KEY, 0, archive_orders)
 
 
 def init_db():
     """Инициализация базы данных"""
     with app.app_context():
         db.create_all()
+        ensure_order_ids(db.engine, Order.__table__, ArchivedOrder.__table__)
+        drop_indexes(db.engine, Order.__table__, OBSOLETE_ORDER_INDEXES)
+        ensure_indexes(db.engine, db.metadata)
 
 
 def add_driver_to_queue(driver_id):
-    """Добавить водителя в очередь"""
-    # Всегда нормализуем и рассылаем обновление, даже если водитель уже "виден" в очереди по is_online.
+    """Добавить водителя в конец очереди (позиции в БД запишутся в конце пачки команд)"""
+    pending_queue_positions.update(driver_queue.add(driver_id))
+    # Всегда рассылаем обновление, даже если водитель уже был в очереди.
     # Иначе другие клиенты могут не получить событие и увидят обновления только после перезагрузки/поллинга.
-    with queue_lock:
-        snap = get_queue_snapshot()
-        driver = User.query.get(driver_id)
-        if driver and driver.is_online and driver.role == UserRole.DRIVER:
-            # Если по какой-то причине водитель не попал в snapshot — ставим в конец очереди
-            if driver_id not in snap['queue']:
-                driver.queue_position = len(snap['queue']) + 1
-                db.session.commit()
-                snap = get_queue_snapshot()
-    emit_queue_updated(snap)
+    emit_queue_updated()
 
 
 def remove_driver_from_queue(driver_id):
     """Удалить водителя из очереди"""
-    with queue_lock:
-        d = User.query.get(driver_id)
-        if d:
-            d.queue_position = None
-            db.session.commit()
-        # Нормализуем позиции для оставшихся
-        get_queue_snapshot()
+    pending_queue_positions.update(driver_queue.remove(driver_id))
     emit_queue_updated()
 
 
-def update_queue_positions():
-    """Обновить позиции водителей в очереди в БД"""
-    # Устарело: позиции нормализуются через get_queue_snapshot()
-    get_queue_snapshot()
+def take_driver_offline(user):
+    """Снять водителя с линии; неподтвержденный заказ передается следующему водителю."""
+    user_id = user.id
+    user.is_online = False
+    
+    # Если есть текущий заказ, который еще не принят, вернуть его в очередь
+    returned_order_id = None
+    if user.current_order_id:
+        order = Order.query.get(user.current_order_id)
+        if order:
+            if order.status == OrderStatus.ASSIGNED:
+                # Остановить таймер
+                cancel_order_timer(order.id)
+                
+                # Вернуть заказ в очередь и освободить водителя
+                order.status = OrderStatus.PENDING
+                order.driver_id = None
+                order.assigned_at = None
+                user.current_order_id = None
+                returned_order_id = order.id
+                release_trip(user_id)
+            elif order.status == OrderStatus.ACCEPTED:
+                # Если заказ принят, оставить его у водителя
+                # Водитель может завершить заказ даже будучи офлайн
+                pass
+    
+    db.session.commit()
+    
+    # Попробовать назначить следующему водителю (уже после commit: водитель офлайн)
+    if returned_order_id:
+        bump_order_version(returned_order_id)
+        set_demand_waiting(returned_order_id, True)
+        assign_order_to_next_driver(returned_order_id)
+    
+    remove_driver_from_queue(user_id)
+    forget_driver_location(user_id)
+    presence.forget(user_id)
+
+
+def update_driver_location(driver_id, lat, lng, free, accuracy=None):
+    """Запомнить координаты водителя; свободный водитель попадает в пространственный индекс.
+
+    Только память: пересылка пассажиру и запись трека идут фоновыми задачами.
+    """
+    ts = time.time()
+    driver_locations[driver_id] = (lat, lng, ts)
+    if free:
+        free_drivers_index.update(driver_id, lat, lng, ts)
+    else:
+        free_drivers_index.remove(driver_id)
+    DRIVER_LOCATION_FIXES.inc()
+    if location_tracker.record(driver_id, lat, lng, accuracy, ts):
+        order_timers.schedule_if_absent(LOCATION_FORWARD_KEY, Config.LOCATION_FORWARD_INTERVAL_SECONDS,
+                                        _forward_driver_locations)
+    if location_tracker.pending_track_points():
+        order_timers.schedule_if_absent(LOCATION_TRACK_KEY, Config.LOCATION_TRACK_FLUSH_SECONDS,
+                                        _persist_track_points)
+
+
+def _forward_driver_locations():
+    """Последняя точка каждого водителя с принятым заказом — его пассажиру (одно событие за интервал)."""
+    for passenger_id, payload in location_tracker.take_updates():
+        socketio.emit('driver_location', payload, room=f'passenger_{passenger_id}')
+        # driver_location входит в GET заказа — его ETag тоже меняется
+        bump_order_version(payload['order_id'])
+
+
+def _persist_track_points():
+    """Записать накопленные точки трека одним INSERT."""
+    points = location_tracker.take_track_points()
+    if not points:
+        return
+    db.session.execute(insert(DriverTrackPoint), [{
+        'driver_id': driver_id,
+        'order_id': order_id,
+        'lat': fix.lat,
+        'lng': fix.lng,
+        'accuracy': fix.accuracy,
+        'recorded_at': datetime.utcfromtimestamp(fix.ts),
+    } for driver_id, order_id, fix in points])
+    db.session.commit()
+
+
+def mark_driver_free(driver_id):
+    """Водитель освободился — вернуть его в индекс по последним известным координатам."""
+    release_trip(driver_id)
+    fix = driver_locations.get(driver_id)
+    if fix:
+        free_drivers_index.update(driver_id, *fix)
+
+
+def forget_driver_location(driver_id):
+    """Водитель ушел с линии."""
+    driver_locations.pop(driver_id, None)
+    free_drivers_index.remove(driver_id)
+    location_tracker.forget(driver_id)
 
 
 def rebuild_driver_queue():
-    """Восстановить очередь водителей из БД (после перезапуска сервера)"""
-    with app.app_context():
-        get_queue_snapshot()
+    """Восстановить очередь водителей из БД (после перезапуска сервера).
+
+    С координатором очередь, которую уже ведут другие воркеры, берется из него, а не из БД.
+    """
+    with app.app_context(), coordination.dispatch_lock():
+        drivers = User.query.filter(User.role == UserRole.DRIVER, User.is_online == True).all()
+        drivers.sort(key=lambda u: (u.queue_position is None, u.queue_position or 0, u.id))
+        driver_queue.load([u.id for u in drivers])
+        # Нормализуем queue_position в БД (1..N), старые "висячие" позиции сбрасываем
+        stale = User.query.filter(User.queue_position.isnot(None)).all()
+        changed = {u.id: None for u in stale if u.id not in driver_queue}
+        changed.update({u.id: driver_queue.position(u.id) for u in drivers if u.queue_position != driver_queue.position(u.id)})
+        _persist_queue_positions(changed)
         emit_queue_updated()
+        # После перезапуска соединений еще нет: кто не переподключится за PRESENCE_GRACE_SECONDS — уйдет с линии
+        for u in drivers:
+            expect_driver_presence(u.id)
+
+
+def expect_driver_presence(driver_id):
+    """Водитель на линии — следить, чтобы у него было живое соединение."""
+    if Config.PRESENCE_TRACKING:
+        presence.expect(driver_id)
+        _schedule_presence_sweep()
+
+
+def _schedule_presence_sweep():
+    order_timers.schedule_if_absent(PRESENCE_SWEEP_KEY, Config.PRESENCE_SWEEP_INTERVAL_SECONDS, sweep_presence)
+
+
+def sweep_presence():
+    """Закрыть соединения без heartbeat и снять с линии водителей, недоступных дольше PRESENCE_GRACE_SECONDS."""
+    presence.expire(Config.PRESENCE_HEARTBEAT_TIMEOUT_SECONDS)
+    gone = presence.gone(Config.PRESENCE_GRACE_SECONDS)
+    elsewhere = _connected_elsewhere(gone)
+    for driver_id in gone:
+        presence.forget(driver_id)
+        if driver_id in elsewhere:
+            # Водитель подключен к другому воркеру — за ним следит тот
+            continue
+        user = User.query.get(driver_id)
+        if user and user.role == UserRole.DRIVER and user.is_online:
+            take_driver_offline(user)
+            socketio.emit('driver_status', {'is_online': False}, room=f'driver_{driver_id}')
+    if len(presence) or presence.unreachable():
+        _schedule_presence_sweep()
+
+
+def _unreachable_drivers():
+    """Водители без живого соединения: заказ им не дойдет, назначать не нужно."""
+    if not Config.PRESENCE_TRACKING:
+        return frozenset()
+    away = presence.unreachable()
+    return away - _connected_elsewhere(away) if away else away
+
+
+def _presence_key(driver_id):
+    return f'presence:{driver_id}'
+
+
+def _connected_elsewhere(driver_ids):
+    """Водители, у которых есть соединение в другом воркере (без координатора — никто)."""
+    held = coordination.held([_presence_key(driver_id) for driver_id in driver_ids])
+    return {driver_id for driver_id in driver_ids if _presence_key(driver_id) in held}
+
+
+def _next_free_driver_id(exclude=()):
+    """Первый свободный водитель по очереди — один запрос по индексу ix_users_dispatch."""
+    if pending_queue_positions:
+        # Позиции этой пачки команд еще не в БД (например, водитель только что вышел на линию)
+        _flush_queue_positions()
+    q = db.session.query(User.id).filter(
+        User.role == UserRole.DRIVER,
+        User.is_online == True,
+        User.queue_position.isnot(None),
+        User.is_active == True,
+        User.current_order_id.is_(None),
+    )
+    if exclude:
+        q = q.filter(User.id.notin_(exclude))
+    return q.order_by(User.queue_position, User.id).limit(1).scalar()
+
+
+def _nearest_free_driver_ids(lat, lng, exclude=()):
+    """Ближайшие свободные водители в радиусе DISPATCH_RADIUS_KM (по индексу в памяти)."""
+    found = free_drivers_index.nearest(
+        lat, lng,
+        k=Config.DISPATCH_NEAREST_CANDIDATES,
+        max_km=Config.DISPATCH_RADIUS_KM,
+        newer_than=time.time() - Config.DRIVER_LOCATION_MAX_AGE_SECONDS,
+    )
+    return [driver_id for _, driver_id in found if driver_id not in exclude]
+
+
+def _try_claim(order_id, driver_id, assigned_at):
+    """Закрепить заказ за водителем внутри текущей транзакции (compare-and-set).
+
+    Водитель захватывается условием current_order_id IS NULL, заказ — условием status = PENDING,
+    поэтому это безопасно между процессами. Возвращает 'ok', 'driver_taken' (водителя
+    перехватили — пробуем следующего) или 'order_taken' (заказ уже назначен/отменен).
+    При неудаче изменений в транзакции не остается.
+    """
+    claimed = db.session.execute(
+        update(User)
+        .where(User.id == driver_id, User.current_order_id.is_(None), User.is_online == True, User.is_active == True)
+        .values(current_order_id=order_id)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if claimed != 1:
+        return 'driver_taken'
+    claimed = db.session.execute(
+        update(Order)
+        .where(Order.id == order_id, Order.status == OrderStatus.PENDING)
+        .values(status=OrderStatus.ASSIGNED, driver_id=driver_id, assigned_at=assigned_at)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if claimed != 1:
+        # Возвращаем водителя: строка уже заблокирована нашей транзакцией
+        db.session.execute(
+            update(User)
+            .where(User.id == driver_id, User.current_order_id == order_id)
+            .values(current_order_id=None)
+            .execution_options(synchronize_session=False)
+        )
+        return 'order_taken'
+    return 'ok'
+
+
+def _claim_order_for_driver(order_id, driver_id, assigned_at, payload, passenger_id):
+    """_try_claim в отдельной транзакции: при успехе — события назначения и commit, иначе rollback."""
+    result = _try_claim(order_id, driver_id, assigned_at)
+    if result == 'ok':
+        _record_assigned(payload, passenger_id, driver_id, assigned_at)
+        db.session.commit()
+    else:
+        db.session.rollback()
+    return result
 
 
-def assign_order_to_next_driver(order_id):
-    """Назначить заказ следующему водителю в очереди"""
-    with queue_lock:
-        snap = get_queue_snapshot()
-        if not snap['queue']:
-            return None
-        
-        order = Order.query.get(order_id)
-        if not order or order.status != OrderStatus.PENDING:
-            return None
-        
-        # Найти первого доступного водителя
-        assigned_driver_id = None
-        for driver_id in snap['queue']:
-            driver = User.query.get(driver_id)
-            if driver and driver.is_online and driver.is_active and not driver.current_order_id:
-                assigned_driver_id = driver_id
-                break
-        
-        if assigned_driver_id:
-            order.driver_id = assigned_driver_id
-            order.status = OrderStatus.ASSIGNED
-            order.assigned_at = datetime.utcnow()
-            
-            driver = User.query.get(assigned_driver_id)
-            driver.current_order_id = order_id
-            
-            db.session.commit()
-            
-            # Уведомить водителя через WebSocket
-            socketio.emit('new_order', {
-                'order_id': order_id,
-                'pickup_address': order.pickup_address,
-                'destination_address': order.destination_address,
-                'pickup_lat': order.pickup_lat,
-                'pickup_lng': order.pickup_lng,
-                'destination_lat': order.destination_lat,
-                'destination_lng': order.destination_lng,
-                'assigned_at': order.assigned_at.isoformat()
-            }, room=f'driver_{assigned_driver_id}')
-            
-            # Уведомить пассажира
-            socketio.emit('order_assigned', {
-                'order_id': order_id,
-                'driver_id': assigned_driver_id
-            }, room=f'passenger_{order.passenger_id}')
-            
-            # Запустить таймер
-            start_order_timer(order_id, assigned_driver_id)
-            
-            return assigned_driver_id
+def _order_payload(order):
+    """Данные заказа для события new_order (берем до CAS: после commit объект будет expired)."""
+    return {
+        'order_id': order.id,
+        'pickup_address': order.pickup_address,
+        'destination_address': order.destination_address,
+        'pickup_lat': order.pickup_lat,
+        'pickup_lng': order.pickup_lng,
+        'destination_lat': order.destination_lat,
+        'destination_lng': order.destination_lng,
+        'price': order.price,
+    }
+
+
+def _record_assigned(payload, passenger_id, driver_id, assigned_at):
+    """В транзакции назначения: события водителю (new_order) и пассажиру (order_assigned)."""
+    order_id = payload['order_id']
+    record_order_event(order_id, 'new_order', f'driver_{driver_id}', dict(payload, assigned_at=assigned_at.isoformat()))
+    record_order_event(order_id, 'order_assigned', f'passenger_{passenger_id}', {
+        'order_id': order_id,
+        'driver_id': driver_id
+    })
+
+
+def _notify_assigned(payload, passenger_id, driver_id, assigned_at):
+    """После commit назначения: индексы в памяти и таймер принятия (уведомления уже в outbox)."""
+    order_id = payload['order_id']
+    bump_order_version(order_id)
+    free_drivers_index.remove(driver_id)
+    assign_trip(driver_id, order_id, passenger_id)
+    order_backlog.discard(order_id, dispatched_at=assigned_at)
+    set_demand_waiting(order_id, False)
     
+    # Запустить таймер
+    start_order_timer(order_id, driver_id, assigned_at)
+
+
+def assign_order_to_next_driver(order_id, policy=None):
+    """Назначить заказ следующему водителю в очереди.
+
+    policy — 'queue' или 'nearest' (по умолчанию Config.DISPATCH_POLICY): при 'nearest' сначала
+    пробуем ближайших свободных водителей у точки подачи, затем — по очереди.
+    Работает в собственной транзакции: вызывающий код должен закоммитить свои изменения заранее.
+    """
+    started = time.perf_counter()
+    driver_id, outcome = _assign_order(order_id, policy)
+    DISPATCH_LATENCY.observe(time.perf_counter() - started, outcome)
+    return driver_id
+
+
+def _assign_order(order_id, policy):
+    """Тело assign_order_to_next_driver: возвращает (driver_id или None, исход для метрик)."""
+    order = Order.query.get(order_id)
+    if not order or order.status != OrderStatus.PENDING:
+        order_backlog.discard(order_id)
+        return None, 'order_gone'
+    payload = _order_payload(order)
+    passenger_id = order.passenger_id
+    created_at = order.created_at
+    
+    # Водителям, которые недавно отказались от заказа (reject/таймаут), повторно его не предлагаем;
+    # водителей без живого соединения пропускаем — иначе заказ зря ждал бы ORDER_TIMEOUT_SECONDS
+    skip = order_backlog.declined(order_id) | _unreachable_drivers()
+    nearby = []
+    if (policy or Config.DISPATCH_POLICY) == 'nearest' and order.pickup_lat is not None and order.pickup_lng is not None:
+        nearby = _nearest_free_driver_ids(order.pickup_lat, order.pickup_lng, exclude=skip)
+    
+    tried = list(skip)
+    assigned_at = datetime.utcnow()
+    while True:
+        driver_id = nearby.pop(0) if nearby else _next_free_driver_id(exclude=tried)
+        if driver_id is None:
+            # Свободных водителей нет — ждем в backlog, назначим при освобождении водителя
+            order_backlog.add(order_id, created_at)
+            return None, 'no_driver'
+        result = _claim_order_for_driver(order_id, driver_id, assigned_at, payload, passenger_id)
+        if result == 'ok':
+            break
+        if result == 'order_taken':
+            order_backlog.discard(order_id)
+            return None, 'order_taken'
+        tried.append(driver_id)
+    
+    _notify_assigned(payload, passenger_id, driver_id, assigned_at)
+    return driver_id, 'assigned'
+
+
+def drain_order_backlog():
+    """Водитель освободился — назначить ожидающие заказы (старые первыми), пока есть кому."""
+    if coordination.shared:
+        # Заказ мог ждать в backlog другого воркера — ожидающие берем из БД (индекс по status, created_at)
+        _load_pending_orders()
+    if not len(order_backlog):
+        return
+    for order_id in order_backlog.ordered():
+        if assign_order_to_next_driver(order_id) is None and order_id in order_backlog:
+            # Заказу никто не подошел; если свободных водителей нет вовсе — дальше смотреть нечего
+            if _next_free_driver_id(exclude=_unreachable_drivers()) is None:
+                break
+
+
+def _schedule_decline_expiry():
+    delay = order_backlog.next_decline_expiry()
+    if delay is not None:
+        order_timers.schedule_if_absent(DECLINE_EXPIRY_KEY, delay, expire_declines)
+
+
+def expire_declines():
+    """Истек самый старый отказ — заказы из backlog снова можно предложить этому водителю."""
+    drain_order_backlog()
+    _schedule_decline_expiry()
+
+
+def _load_pending_orders():
+    pending = (db.session.query(Order.id, Order.created_at)
+               .filter(Order.status == OrderStatus.PENDING)
+               .order_by(Order.created_at, Order.id))
+    for order_id, created_at in pending:
+        order_backlog.add(order_id, created_at)
+
+
+def rebuild_order_backlog():
+    """Восстановить ожидающие заказы из БД (после перезапуска сервера) и попробовать их назначить"""
+    with app.app_context(), coordination.dispatch_lock():
+        _load_pending_orders()
+        _load_demand()
+        drain_order_backlog()
+
+
+def _load_demand():
+    """Карта спроса после перезапуска: незакрытые заказы и закрытые за несколько периодов полураспада."""
+    since = datetime.utcnow() - timedelta(seconds=4 * Config.DEMAND_HALF_LIFE_SECONDS)
+    open_statuses = (OrderStatus.PENDING, OrderStatus.ASSIGNED, OrderStatus.ACCEPTED, OrderStatus.IN_PROGRESS)
+    rows = (db.session.query(Order.id, Order.pickup_lat, Order.pickup_lng, Order.created_at, Order.status)
+            .filter(Order.pickup_lat.isnot(None), Order.pickup_lng.isnot(None))
+            .filter(or_(Order.created_at >= since, Order.status.in_(open_statuses))))
+    for order_id, lat, lng, created_at, status in rows:
+        demand_heatmap.add(order_id, lat, lng, ts=calendar.timegm(created_at.utctimetuple()),
+                           waiting=status == OrderStatus.PENDING)
+        if status not in open_statuses:
+            demand_heatmap.forget(order_id)
+
+
+def dispatch_new_order(order_id):
+    """Назначить новый заказ: сразу или в пакете (если включено DISPATCH_BATCH_WINDOW_SECONDS)."""
+    if Config.DISPATCH_BATCH_WINDOW_SECONDS <= 0:
+        return assign_order_to_next_driver(order_id)
+    batch_orders.add(order_id)
+    order_timers.schedule_if_absent(BATCH_DISPATCH_KEY, Config.DISPATCH_BATCH_WINDOW_SECONDS, run_batch_dispatch)
     return None
 
 
-def start_order_timer(order_id, driver_id):
-    """Запустить таймер для заказа (1 минута на принятие)"""
-    def timer_callback():
-        time.sleep(Config.ORDER_TIMEOUT_SECONDS)
+def run_batch_dispatch():
+    """Распределить накопленные заказы глобально — минимум суммарного расстояния подачи.
+
+    Матрица расстояний «заказ × свободный водитель» решается как задача о назначениях,
+    все назначения фиксируются одной транзакцией. Заказы без координат и те, кому
+    никого не нашлось в радиусе DISPATCH_RADIUS_KM, назначаются обычным путем.
+    """
+    order_ids = list(batch_orders)
+    batch_orders.clear()
+    if not order_ids:
+        return
+    
+    orders = (Order.query
+              .filter(Order.id.in_(order_ids), Order.status == OrderStatus.PENDING)
+              .order_by(Order.created_at, Order.id).all())
+    pending_ids = [o.id for o in orders]
+    located = [o for o in orders if o.pickup_lat is not None and o.pickup_lng is not None]
+    fixes = free_drivers_index.points(newer_than=time.time() - Config.DRIVER_LOCATION_MAX_AGE_SECONDS)
+    if located and fixes:
+        free_ids = {driver_id for (driver_id,) in db.session.query(User.id).filter(
+            User.id.in_([f[0] for f in fixes]),
+            User.is_online == True,
+            User.is_active == True,
+            User.current_order_id.is_(None),
+        )}
+        free_ids -= _unreachable_drivers()
+        fixes = [f for f in fixes if f[0] in free_ids]
+    
+    assigned = {}
+    if located and fixes:
+        cost = haversine_matrix(
+            [o.pickup_lat for o in located], [o.pickup_lng for o in located],
+            [f[1] for f in fixes], [f[2] for f in fixes],
+        )
+        cost[cost > Config.DISPATCH_RADIUS_KM] = np.inf
+        notify = {o.id: (_order_payload(o), o.passenger_id) for o in located}
+        assigned_at = datetime.utcnow()
+        for row, col in solve_assignment(cost):
+            if not np.isfinite(cost[row, col]):
+                continue
+            order_id, driver_id = located[row].id, fixes[col][0]
+            if _try_claim(order_id, driver_id, assigned_at) == 'ok':
+                assigned[order_id] = driver_id
+                _record_assigned(*notify[order_id], driver_id, assigned_at)
+        db.session.commit()
+        for order_id, driver_id in assigned.items():
+            _notify_assigned(*notify[order_id], driver_id, assigned_at)
+    
+    for order_id in pending_ids:
+        if order_id not in assigned:
+            assign_order_to_next_driver(order_id)
+
+
+def start_order_timer(order_id, driver_id, assigned_at):
+    """Запустить таймер для заказа: ORDER_TIMEOUT_SECONDS от assigned_at (1 минута на принятие).
+
+    С координатором — только если аренда таймера этого назначения свободна (иначе он уже идет в другом воркере).
+    """
+    remaining = Config.ORDER_TIMEOUT_SECONDS - (datetime.utcnow() - assigned_at).total_seconds()
+    lease = max(remaining, 0) + Config.COORDINATION_TIMER_GRACE_SECONDS
+    if not coordination.claim(_order_timer_key(order_id, driver_id, assigned_at), lease):
+        return
+    order_timers.schedule(order_id, remaining, _on_order_timeout, order_id, driver_id, assigned_at)
+
+
+def _order_timer_key(order_id, driver_id, assigned_at):
+    return f'order-timer:{order_id}:{driver_id}:{assigned_at.isoformat()}'
+
+
+def adopt_order_timers():
+    """Несколько воркеров: завести таймеры назначений, чей воркер пропал (его аренда истекла)."""
+    rows = (db.session.query(Order.id, Order.driver_id, Order.assigned_at)
+            .filter(Order.status == OrderStatus.ASSIGNED, Order.driver_id.isnot(None), Order.assigned_at.isnot(None))
+            .all())
+    for order_id, driver_id, assigned_at in rows:
+        if order_id not in order_timers:
+            start_order_timer(order_id, driver_id, assigned_at)
+    order_timers.schedule(ORDER_TIMER_ADOPT_KEY, Config.COORDINATION_TIMER_ADOPT_SECONDS, adopt_order_timers)
+
+
+def cancel_order_timer(order_id):
+    """Остановить таймер заказа (принят/отклонен/отменен/водитель ушел с линии)"""
+    order_timers.cancel(order_id)
+
+
+def _release_assignment(order_id, driver_id, assigned_at):
+    """Вернуть неподтвержденный заказ в PENDING и освободить водителя (compare-and-set).
+
+    Срабатывает, только если заказ все еще ASSIGNED этому водителю с тем же assigned_at, поэтому
+    повторный или устаревший таймер (другой процесс, перезапуск) ничего не сломает. Возвращает
+    True при успехе; событие order_timeout водителю пишется в той же транзакции.
+    """
+    released = db.session.execute(
+        update(Order)
+        .where(Order.id == order_id, Order.status == OrderStatus.ASSIGNED, Order.driver_id == driver_id,
+               Order.assigned_at == assigned_at)
+        .values(status=OrderStatus.PENDING, driver_id=None, assigned_at=None)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if released != 1:
+        db.session.rollback()
+        return False
+    db.session.execute(
+        update(User)
+        .where(User.id == driver_id, User.current_order_id == order_id)
+        .values(current_order_id=None)
+        .execution_options(synchronize_session=False)
+    )
+    record_order_event(order_id, 'order_timeout', f'driver_{driver_id}', {'order_id': order_id})
+    db.session.commit()
+    return True
+
+
+def _on_order_timeout(order_id, driver_id, assigned_at):
+    """Водитель не принял заказ вовремя — снимаем с него заказ и передаем следующему"""
+    released = _release_assignment(order_id, driver_id, assigned_at)
+    coordination.release(_order_timer_key(order_id, driver_id, assigned_at))
+    if not released:
+        return
+    bump_order_version(order_id)
+    ORDER_TIMEOUTS.inc()
+    mark_driver_free(driver_id)
+    
+    # Попробовать назначить следующему водителю; освободившийся водитель берет заказы из backlog
+    decline_order(order_id, driver_id)
+    _schedule_decline_expiry()
+    set_demand_waiting(order_id, True)
+    assign_order_to_next_driver(order_id)
+    drain_order_backlog()
+
+
+# Колбэки таймеров, которые выполняются в потоке диспетчера, а не в потоке order-timers
+DISPATCH_TIMER_CALLBACKS = frozenset((_on_order_timeout, run_batch_dispatch, sweep_presence, expire_declines))
+
+
+def _dispatch(command, fn, *args):
+    """Выполнить команду в потоке диспетчера и вернуть ее ответ; очередь полна — 503 с Retry-After.
+
+    Ограничен только прием в очередь: принятую команду ждем до конца. Ответ по таймауту, пока команда
+    еще в очереди, клиент принял бы за неудачу и повторил — и, например, создал бы второй заказ.
+    """
+    try:
+        return dispatcher.call(command, fn, *args)
+    except (DispatcherBusy, LockTimeout):
+        DISPATCH_REJECTED.inc(command)
+        response = jsonify({'error': 'Dispatcher is busy, retry later'})
+        response.headers['Retry-After'] = str(Config.DISPATCH_RETRY_AFTER_SECONDS)
+        return response, 503
+
+
+def reconcile_assignments():
+    """Привести назначения в порядок после перезапуска: таймеры в памяти пропали вместе с процессом.
+
+    Один запрос по индексу ix_orders_status_assigned_at находит все ASSIGNED-заказы.
+    Просроченные (assigned_at + ORDER_TIMEOUT_SECONDS уже прошло) и осиротевшие (водителя нет,
+    он офлайн или его current_order_id указывает на другой заказ) возвращаются в PENDING
+    одним UPDATE; у водителей сбрасывается current_order_id, не указывающий на их активный заказ.
+    Остальным заказам таймер заводится заново на оставшееся время.
+    Вызывать до rebuild_order_backlog(): возвращенные заказы назначит он.
+    С координатором таймер заводит только воркер, взявший его аренду, а таймеры пропавших
+    воркеров подбирает adopt_order_timers.
+    """
+    with app.app_context(), coordination.dispatch_lock():
+        now = datetime.utcnow()
+        timeout = timedelta(seconds=Config.ORDER_TIMEOUT_SECONDS)
+        rows = (db.session.query(Order.id, Order.driver_id, Order.passenger_id, Order.assigned_at,
+                                 User.current_order_id, User.is_online)
+                .outerjoin(User, User.id == Order.driver_id)
+                .filter(Order.status == OrderStatus.ASSIGNED)
+                .order_by(Order.assigned_at)
+                .all())
+        expired, orphaned, rearm = [], [], []
+        for order_id, driver_id, passenger_id, assigned_at, driver_order_id, driver_online in rows:
+            if driver_id is None or driver_order_id != order_id or not driver_online:
+                orphaned.append(order_id)
+            elif assigned_at is None or assigned_at + timeout <= now:
+                expired.append((order_id, driver_id))
+            else:
+                rearm.append((order_id, driver_id, passenger_id, assigned_at))
         
-        with app.app_context():
-            order = Order.query.get(order_id)
-            if order and order.status == OrderStatus.ASSIGNED and order.driver_id == driver_id:
-                # Водитель не принял заказ, переходим к следующему
-                driver = User.query.get(driver_id)
-                if driver:
-                    driver.current_order_id = None
-                
-                order.driver_id = None
-                order.status = OrderStatus.PENDING
-                order.assigned_at = None
-                db.session.commit()
-                
-                # Уведомить водителя об отмене
-                socketio.emit('order_timeout', {'order_id': order_id}, room=f'driver_{driver_id}')
-                
-                # Попробовать назначить следующему водителю
-                assign_order_to_next_driver(order_id)
+        released = orphaned + [order_id for order_id, _ in expired]
+        if released:
+            db.session.execute(
+                update(Order)
+                .where(Order.id.in_(released), Order.status == OrderStatus.ASSIGNED)
+                .values(status=OrderStatus.PENDING, driver_id=None, assigned_at=None)
+                .execution_options(synchronize_session=False)
+            )
+        active = (OrderStatus.ASSIGNED, OrderStatus.ACCEPTED, OrderStatus.IN_PROGRESS)
+        cleared = db.session.execute(
+            update(User)
+            .where(User.current_order_id.isnot(None), ~exists(
+                select(Order.id).where(Order.id == User.current_order_id,
+                                       Order.driver_id == User.id,
+                                       Order.status.in_(active))))
+            .values(current_order_id=None)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
         
-        # Удалить таймер
-        if order_id in order_timers:
-            del order_timers[order_id]
-    
-    timer_thread = threading.Thread(target=timer_callback, daemon=True)
-    timer_thread.start()
-    order_timers[order_id] = timer_thread
+        # Водитель, не успевший принять заказ до перезапуска, не получит его снова до ORDER_DECLINE_TTL_SECONDS
+        for order_id, driver_id in expired:
+            order_backlog.decline(order_id, driver_id)
+        _schedule_decline_expiry()
+        for order_id, driver_id, passenger_id, assigned_at in rearm:
+            start_order_timer(order_id, driver_id, assigned_at)
+            location_tracker.assign(driver_id, order_id, passenger_id)
+        # Принятые заказы: координаты водителя снова идут пассажиру
+        trips = (db.session.query(Order.id, Order.driver_id, Order.passenger_id)
+                 .filter(Order.status.in_((OrderStatus.ACCEPTED, OrderStatus.IN_PROGRESS)), Order.driver_id.isnot(None))
+                 .all())
+        for order_id, driver_id, passenger_id in trips:
+            location_tracker.assign(driver_id, order_id, passenger_id, forward=True)
+        
+        if coordination.shared:
+            order_timers.schedule_if_absent(ORDER_TIMER_ADOPT_KEY, Config.COORDINATION_TIMER_ADOPT_SECONDS,
+                                            adopt_order_timers)
+        summary = {'expired': len(expired), 'orphaned': len(orphaned), 'drivers_cleared': cleared, 'rearmed': len(rearm)}
+        if released or cleared:
+            logger.warning('Reconciled assignments after restart: %s', summary)
+        return summary
 
 
 @app.route('/')
@@ -262,19 +1117,19 @@ def login():
 
 
 @app.route('/api/driver/online', methods=['POST'])
+@login_required(UserRole.DRIVER)
 def driver_online():
-    user_id = session.get('user_id')
-    if not user_id:
-        return jsonify({'error': 'Not authenticated'}), 401
-    
+    return _dispatch('driver_online', _driver_online, session.get('user_id'))
+
+
+def _driver_online(user_id):
     user = User.query.get(user_id)
-    if not user or user.role != UserRole.DRIVER:
-        return jsonify({'error': 'Not a driver'}), 403
-    
     user.is_online = True
     db.session.commit()
     
     add_driver_to_queue(user_id)
+    expect_driver_presence(user_id)
+    drain_order_backlog()
     
     # Позицию/счетчик берем из общего снимка очереди (единый источник правды)
     snap = get_queue_snapshot()
@@ -283,54 +1138,88 @@ def driver_online():
 
 
 @app.route('/api/driver/offline', methods=['POST'])
+@login_required(UserRole.DRIVER)
 def driver_offline():
-    user_id = session.get('user_id')
-    if not user_id:
-        return jsonify({'error': 'Not authenticated'}), 401
-    
-    user = User.query.get(user_id)
-    if not user or user.role != UserRole.DRIVER:
-        return jsonify({'error': 'Not a driver'}), 403
-    
-    user.is_online = False
-    
-    # Если есть текущий заказ, который еще не принят, вернуть его в очередь
-    if user.current_order_id:
-        order = Order.query.get(user.current_order_id)
-        if order:
-            if order.status == OrderStatus.ASSIGNED:
-                # Остановить таймер
-                if order.id in order_timers:
-                    del order_timers[order.id]
-                
-                # Вернуть заказ в очередь
-                order.status = OrderStatus.PENDING
-                order.driver_id = None
-                order.assigned_at = None
-                
-                # Попробовать назначить следующему водителю
-                assign_order_to_next_driver(order.id)
-            elif order.status == OrderStatus.ACCEPTED:
-                # Если заказ принят, оставить его у водителя
-                # Водитель может завершить заказ даже будучи офлайн
-                pass
-    
-    db.session.commit()
-    
-    remove_driver_from_queue(user_id)
-    
+    return _dispatch('driver_offline', _driver_offline, session.get('user_id'))
+
+
+def _driver_offline(user_id):
+    take_driver_offline(User.query.get(user_id))
     return jsonify({'status': 'offline'}), 200
 
 
+@app.route('/api/driver/location', methods=['POST'])
+@login_required(UserRole.DRIVER)
+def driver_location():
+    """Текущие координаты водителя (для назначения ближайшего водителя)."""
+    user = current_user()
+    user_id = user.id
+    
+    data = request.json or {}
+    try:
+        lat = float(data.get('lat'))
+        lng = float(data.get('lng'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'lat/lng required'}), 400
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return jsonify({'error': 'Invalid coordinates'}), 400
+    
+    if not user.is_online:
+        return jsonify({'status': 'ignored'}), 200
+    update_driver_location(user_id, lat, lng, free=not user.current_order_id, accuracy=_accuracy(data))
+    return jsonify({'status': 'ok'}), 200
+
+
+def _accuracy(data):
+    value = data.get('accuracy')
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def _long_poll_wait():
+    """?wait=N — сколько секунд можно держать запрос (0 — ответить сразу)."""
+    wait = request.args.get('wait', 0, type=float)
+    return max(0.0, min(wait, Config.LONGPOLL_MAX_SECONDS))
+
+
+def _park(wait):
+    """Long-poll: подождать изменения, если есть свободный слот (иначе ответить сразу)."""
+    if not long_poll_slots.acquire():
+        return
+    try:
+        wait()
+    finally:
+        long_poll_slots.release()
+
+
+def _etag(*parts):
+    return '.'.join(str(p) for p in (BOOT_TAG,) + parts)
+
+
+def _revalidate(response, etag):
+    """ETag и требование перепроверять его при каждом запросе (браузер сам пришлет If-None-Match)."""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _not_modified(etag):
+    """304 без тела, если у клиента уже эта версия, иначе None."""
+    if not request.if_none_match.contains(etag):
+        return None
+    return _revalidate(Response(status=304), etag)
+
+
 @app.route('/api/user/current', methods=['GET'])
+@login_required()
+@read_only_db
 def get_current_user():
-    user_id = session.get('user_id')
-    if not user_id:
-        return jsonify({'error': 'Not authenticated'}), 401
-    
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'error': 'User not found'}), 404
+    # is_online водителя и его позиция меняются только вместе с версией очереди
+    facts = current_user_facts()
+    etag = _etag('u', facts.id, facts.role.value, driver_queue.version)
+    not_modified = _not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+    user = current_user()
     
     drivers_online = None
     queue_position = None
@@ -339,14 +1228,14 @@ def get_current_user():
         drivers_online = snap.get('count', 0)
         queue_position = snap.get('positions', {}).get(str(user.id))
 
-    return jsonify({
+    return _revalidate(jsonify({
         'user_id': user.id,
         'username': user.username,
         'role': user.role.value,
         'is_online': user.is_online if user.role == UserRole.DRIVER else None,
         'queue_position': queue_position,
         'drivers_online': drivers_online
-    }), 200
+    }), etag), 200
 
 
 @app.route('/api/drivers/online_count', methods=['GET'])
@@ -358,8 +1247,119 @@ def drivers_online_count():
 
 @app.route('/api/queue', methods=['GET'])
 def queue_snapshot():
-    """Снимок очереди (count + positions) — для поллинга на клиентах."""
-    return jsonify(get_queue_snapshot()), 200
+    """Состояние очереди для поллинга: счетчик и (для водителя) его позиция, без списка водителей.
+
+    ETag — версия очереди (304 при совпадении); ?wait=N&since=<version> ждет изменения очереди.
+    """
+    user_id = session.get('user_id')
+    since = request.args.get('since', type=int)
+    wait = _long_poll_wait()
+    if wait and since == driver_queue.version:
+        _park(lambda: driver_queue.wait_for_change(since, wait))
+    snap = get_queue_snapshot()
+    etag = _etag('q', user_id, snap['version'])
+    not_modified = _not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+    return _revalidate(jsonify({
+        'count': snap['count'],
+        'version': snap['version'],
+        'position': snap['positions'].get(str(user_id)) if user_id else None
+    }), etag), 200
+
+
+@app.route('/api/stats', methods=['GET'])
+def service_stats():
+    """Внутренние показатели для мониторинга."""
+    snap = get_queue_snapshot()
+    oldest = order_backlog.oldest_created_at()
+    dispatched = order_backlog.dispatched
+    return jsonify({
+        'queue_length': snap['count'],
+        'queue_version': snap['version'],
+        'pending_deadlines': _pending_order_deadlines(),
+        'backlog_depth': len(order_backlog),
+        'backlog_oldest_wait_seconds': (datetime.utcnow() - oldest).total_seconds() if oldest else 0.0,
+        'backlog_dispatched': dispatched,
+        'backlog_avg_wait_seconds': order_backlog.dispatched_wait_total / dispatched if dispatched else 0.0,
+        'geocode_hit_rate': round(geocoder.hit_rate(), 4),
+    }), 200
+
+
+@app.route('/api/geocode/reverse', methods=['GET'])
+@login_required()
+def geocode_reverse():
+    """Улица и дом по координатам (кэш на сервере вместо запросов браузеров к Nominatim)."""
+    try:
+        lat = float(request.args.get('lat'))
+        lng = float(request.args.get('lng'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'lat/lng required'}), 400
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return jsonify({'error': 'Invalid coordinates'}), 400
+
+    try:
+        result, source = geocoder.reverse(lat, lng)
+    except GeocodeUnavailable:
+        GEOCODE_LOOKUPS.inc('unavailable')
+        response = jsonify({'error': 'Geocoding unavailable'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    GEOCODE_LOOKUPS.inc(source)
+    response = jsonify(dict(result, source=source))
+    response.headers['Cache-Control'] = 'private, max-age=86400'
+    return response, 200
+
+
+@app.route('/api/demand/heatmap', methods=['GET'])
+@login_required(UserRole.DRIVER)
+def demand_heatmap_view():
+    """Где сейчас спрос: ячейки geohash с весом (из памяти, без БД); то же приходит событием demand_heatmap."""
+    return jsonify(demand_snapshot()), 200
+
+
+@app.route('/api/fare/estimate', methods=['POST'])
+@login_required()
+def fare_estimate():
+    """Стоимость нескольких маршрутов одним запросом: {"routes": [{pickup_lat, pickup_lng, destination_lat, destination_lng}, ...]}."""
+    routes = (request.json or {}).get('routes')
+    if not isinstance(routes, list) or not routes:
+        return jsonify({'error': 'routes required'}), 400
+    if len(routes) > Config.FARE_ESTIMATE_MAX_ROUTES:
+        return jsonify({'error': f'At most {Config.FARE_ESTIMATE_MAX_ROUTES} routes'}), 400
+    try:
+        coords = np.array([[float(r['pickup_lat']), float(r['pickup_lng']),
+                            float(r['destination_lat']), float(r['destination_lng'])] for r in routes])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Each route needs pickup_lat/pickup_lng/destination_lat/destination_lng'}), 400
+    lats, lngs = coords[:, [0, 2]], coords[:, [1, 3]]
+    if not (np.all(np.abs(lats) <= 90) and np.all(np.abs(lngs) <= 180)):
+        return jsonify({'error': 'Invalid coordinates'}), 400
+
+    quote = fare_engine.quote(coords[:, 0], coords[:, 1], coords[:, 2], coords[:, 3])
+    return jsonify({
+        'currency': Config.FARE_CURRENCY,
+        'night': quote['night'],
+        'quotes': [{'distance_km': round(d, 2), 'zone_surcharge': z, 'price': p}
+                   for d, z, p in zip(quote['distance_km'].tolist(), quote['zone_surcharge'].tolist(),
+                                      quote['price'].tolist())],
+    }), 200
+
+
+@app.route('/metrics', methods=['GET'])
+@monitoring_required
+def prometheus_metrics():
+    """Метрики в текстовом формате Prometheus."""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/debug/slow-requests', methods=['GET'])
+@monitoring_required
+def slow_requests():
+    """Последние медленные запросы с разбивкой по SQL и функциям (только при PROFILE_REQUESTS=1)."""
+    if profiler is None:
+        return jsonify({'error': 'Profiling disabled'}), 404
+    return jsonify({'threshold_ms': profiler.slow_ms, 'requests': profiler.recent()}), 200
 
 
 @app.route('/api/logout', methods=['POST'])
@@ -369,45 +1369,51 @@ def logout():
 
 
 @app.route('/api/me/switch-role', methods=['POST'])
+@login_required()
 def switch_role():
-    user_id = session.get('user_id')
-    if not user_id:
-        return jsonify({'error': 'Not authenticated'}), 401
     data = request.json or {}
     role = (data.get('role') or '').strip().lower()
     if role not in ('driver', 'passenger'):
         return jsonify({'error': 'Укажите роль: driver или passenger'}), 400
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'error': 'User not found'}), 404
+    user = current_user()
+    user_id = user.id
     want = UserRole.DRIVER if role == 'driver' else UserRole.PASSENGER
     if user.role == want:
         session['user_role'] = user.role.value
         return jsonify({'role': user.role.value}), 200
-    if want == UserRole.PASSENGER:
-        if user.role == UserRole.DRIVER and user.current_order_id:
-            return jsonify({'error': 'Завершите или отмените текущий заказ перед сменой роли'}), 400
-        if user.role == UserRole.DRIVER:
-            remove_driver_from_queue(user_id)
-            user.is_online = False
-        user.role = UserRole.PASSENGER
-        session['user_role'] = 'passenger'
+    if want == UserRole.PASSENGER and user.role == UserRole.DRIVER:
+        # Водитель уходит из очереди — это команда диспетчера
+        response, status = _dispatch('driver_to_passenger', _driver_to_passenger, user_id)
+        if status != 200:
+            return response, status
     else:
-        user.role = UserRole.DRIVER
-        session['user_role'] = 'driver'
+        user.role = want
+        db.session.commit()
+    session['user_role'] = want.value
+    # Роль — единственный изменяемый «неизменяемый» факт: сбрасываем кэш
+    invalidate_user_facts(user_id)
+    return jsonify({'role': want.value}), 200
+
+
+def _driver_to_passenger(user_id):
+    user = User.query.get(user_id)
+    if user.current_order_id:
+        return jsonify({'error': 'Завершите или отмените текущий заказ перед сменой роли'}), 400
+    remove_driver_from_queue(user_id)
+    forget_driver_location(user_id)
+    presence.forget(user_id)
+    user.is_online = False
+    user.role = UserRole.PASSENGER
     db.session.commit()
     return jsonify({'role': user.role.value}), 200
 
 
 @app.route('/api/driver/orders/current', methods=['GET'])
+@login_required(UserRole.DRIVER)
+@read_only_db
 def get_current_order():
-    user_id = session.get('user_id')
-    if not user_id:
-        return jsonify({'error': 'Not authenticated'}), 401
-    
-    user = User.query.get(user_id)
-    if not user or user.role != UserRole.DRIVER:
-        return jsonify({'error': 'Not a driver'}), 403
+    user = current_user()
+    user_id = user.id
     
     if user.current_order_id:
         order = Order.query.get(user.current_order_id)
@@ -420,6 +1426,7 @@ def get_current_order():
                 'pickup_lng': order.pickup_lng,
                 'destination_lat': order.destination_lat,
                 'destination_lng': order.destination_lng,
+                'price': order.price,
                 'status': order.status.value,
                 'assigned_at': order.assigned_at.isoformat() if order.assigned_at else None
             }), 200
@@ -427,16 +1434,21 @@ def get_current_order():
     return jsonify({'order': None}), 200
 
 
+@app.route('/api/driver/orders', methods=['GET'])
+@login_required(UserRole.DRIVER)
+@read_only_db
+def driver_order_history():
+    """История заказов водителя: ?after=<order_id>&limit=N, новые первыми (вместе с архивом)."""
+    return _order_history('driver_id')
+
+
 @app.route('/api/driver/orders/<int:order_id>/accept', methods=['POST'])
+@login_required(UserRole.DRIVER)
 def accept_order(order_id):
-    user_id = session.get('user_id')
-    if not user_id:
-        return jsonify({'error': 'Not authenticated'}), 401
-    
-    user = User.query.get(user_id)
-    if not user or user.role != UserRole.DRIVER:
-        return jsonify({'error': 'Not a driver'}), 403
-    
+    return _dispatch('accept', _accept_order, order_id, session.get('user_id'))
+
+
+def _accept_order(order_id, user_id):
     order = Order.query.get(order_id)
     if not order:
         return jsonify({'error': 'Order not found'}), 404
@@ -448,32 +1460,34 @@ def accept_order(order_id):
         return jsonify({'error': 'Order cannot be accepted'}), 400
     
     # Остановить таймер
-    if order_id in order_timers:
-        del order_timers[order_id]
+    cancel_order_timer(order_id)
     
     order.status = OrderStatus.ACCEPTED
-    # Водитель остается в очереди, но с текущим заказом
-    db.session.commit()
-    
-    # Уведомить пассажира
-    socketio.emit('order_accepted', {
+    # Уведомить пассажира (событие уйдет после commit)
+    record_order_event(order_id, 'order_accepted', f'passenger_{order.passenger_id}', {
         'order_id': order_id,
         'driver_id': user_id
-    }, room=f'passenger_{order.passenger_id}')
+    })
+    # Водитель остается в очереди, но с текущим заказом
+    db.session.commit()
+    bump_order_version(order_id)
+    forget_declines(order_id)
+    # С этого момента пассажир видит, как водитель едет к нему
+    start_trip_forwarding(user_id, order_id)
+    order_timers.schedule_if_absent(LOCATION_FORWARD_KEY, Config.LOCATION_FORWARD_INTERVAL_SECONDS,
+                                    _forward_driver_locations)
     
     return jsonify({'status': 'accepted'}), 200
 
 
 @app.route('/api/driver/orders/<int:order_id>/reject', methods=['POST'])
+@login_required(UserRole.DRIVER)
 def reject_order(order_id):
-    user_id = session.get('user_id')
-    if not user_id:
-        return jsonify({'error': 'Not authenticated'}), 401
-    
+    return _dispatch('reject', _reject_order, order_id, session.get('user_id'))
+
+
+def _reject_order(order_id, user_id):
     user = User.query.get(user_id)
-    if not user or user.role != UserRole.DRIVER:
-        return jsonify({'error': 'Not a driver'}), 403
-    
     order = Order.query.get(order_id)
     if not order:
         return jsonify({'error': 'Order not found'}), 404
@@ -482,30 +1496,35 @@ def reject_order(order_id):
         return jsonify({'error': 'Order not assigned to you'}), 403
     
     # Остановить таймер
-    if order_id in order_timers:
-        del order_timers[order_id]
+    cancel_order_timer(order_id)
     
     user.current_order_id = None
     order.driver_id = None
     order.status = OrderStatus.PENDING
     order.assigned_at = None
     db.session.commit()
-    
-    # Попробовать назначить следующему водителю
+    bump_order_version(order_id)
+    mark_driver_free(user_id)
+    ORDER_REJECTIONS.inc()
+    
+    # Попробовать назначить следующему водителю; этот водитель свободен для других заказов из backlog
+    decline_order(order_id, user_id)
+    _schedule_decline_expiry()
+    set_demand_waiting(order_id, True)
     assign_order_to_next_driver(order_id)
+    drain_order_backlog()
     
     return jsonify({'status': 'rejected'}), 200
 
 
 @app.route('/api/driver/orders/<int:order_id>/start', methods=['POST'])
+@login_required(UserRole.DRIVER)
 def start_order(order_id):
     """Пассажир в машине — переход в статус «В пути», уведомление пассажира"""
-    user_id = session.get('user_id')
-    if not user_id:
-        return jsonify({'error': 'Not authenticated'}), 401
-    user = User.query.get(user_id)
-    if not user or user.role != UserRole.DRIVER:
-        return jsonify({'error': 'Not a driver'}), 403
+    return _dispatch('start', _start_order, order_id, session.get('user_id'))
+
+
+def _start_order(order_id, user_id):
     order = Order.query.get(order_id)
     if not order:
         return jsonify({'error': 'Order not found'}), 404
@@ -514,21 +1533,20 @@ def start_order(order_id):
     if order.status != OrderStatus.ACCEPTED:
         return jsonify({'error': 'Заказ уже в пути или завершён'}), 400
     order.status = OrderStatus.IN_PROGRESS
+    record_order_event(order_id, 'order_in_progress', f'passenger_{order.passenger_id}', {'order_id': order_id})
     db.session.commit()
-    socketio.emit('order_in_progress', {'order_id': order_id}, room=f'passenger_{order.passenger_id}')
+    bump_order_version(order_id)
     return jsonify({'status': 'in_progress'}), 200
 
 
 @app.route('/api/driver/orders/<int:order_id>/complete', methods=['POST'])
+@login_required(UserRole.DRIVER)
 def complete_order(order_id):
-    user_id = session.get('user_id')
-    if not user_id:
-        return jsonify({'error': 'Not authenticated'}), 401
-    
+    return _dispatch('complete', _complete_order, order_id, session.get('user_id'))
+
+
+def _complete_order(order_id, user_id):
     user = User.query.get(user_id)
-    if not user or user.role != UserRole.DRIVER:
-        return jsonify({'error': 'Not a driver'}), 403
-    
     order = Order.query.get(order_id)
     if not order:
         return jsonify({'error': 'Order not found'}), 404
@@ -546,25 +1564,25 @@ def complete_order(order_id):
     order.status = OrderStatus.COMPLETED
     order.completed_at = datetime.utcnow()
     user.current_order_id = None
-    db.session.commit()
-    
     # Уведомить пассажира
-    socketio.emit('order_completed', {
+    record_order_event(order_id, 'order_completed', f'passenger_{order.passenger_id}', {
         'order_id': order_id
-    }, room=f'passenger_{order.passenger_id}')
+    })
+    db.session.commit()
+    bump_order_version(order_id)
+    mark_driver_free(user_id)
+    forget_declines(order_id)
+    forget_demand(order_id)
+    
+    drain_order_backlog()
     
     return jsonify({'status': 'completed'}), 200
 
 
 @app.route('/api/passenger/orders', methods=['POST'])
+@login_required(UserRole.PASSENGER)
 def create_order():
     user_id = session.get('user_id')
-    if not user_id:
-        return jsonify({'error': 'Not authenticated'}), 401
-    
-    user = User.query.get(user_id)
-    if not user or user.role != UserRole.PASSENGER:
-        return jsonify({'error': 'Not a passenger'}), 403
     
     data = request.json
     pickup_address = data.get('pickup_address')
@@ -577,7 +1595,19 @@ def create_order():
     if not pickup_address or not destination_address:
         return jsonify({'error': 'Missing required fields'}), 400
     
-    order = Order(
+    try:
+        pickup = _parse_point(pickup_lat, pickup_lng)
+        destination = _parse_point(destination_lat, destination_lng)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid coordinates'}), 400
+    if pickup:
+        pickup_lat, pickup_lng = pickup
+    if destination:
+        destination_lat, destination_lng = destination
+    price = fare_engine.price(*pickup, *destination) if pickup and destination else None
+    
+    # Заказ создается в потоке диспетчера: при переполненной очереди он не сохраняется вовсе (503)
+    return _dispatch('order_created', _create_order, dict(
         passenger_id=user_id,
         pickup_address=pickup_address,
         destination_address=destination_address,
@@ -585,34 +1615,90 @@ def create_order():
         pickup_lng=pickup_lng,
         destination_lat=destination_lat,
         destination_lng=destination_lng,
-        status=OrderStatus.PENDING
-    )
+        price=price,
+    ))
+
+
+def _parse_point(lat, lng):
+    """Точка из запроса: (lat, lng) числами или None, если ее нет.
+
+    ValueError/TypeError — не число, половина точки или вне диапазона (NaN и inf тоже не проходят),
+    как и в /api/fare/estimate.
+    """
+    if lat is None and lng is None:
+        return None
+    lat, lng = float(lat), float(lng)
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError('coordinates out of range')
+    return lat, lng
+
+
+@app.route('/api/passenger/orders', methods=['GET'])
+@login_required(UserRole.PASSENGER)
+@read_only_db
+def passenger_order_history():
+    """История заказов пассажира: ?after=<order_id>&limit=N, новые первыми (вместе с архивом)."""
+    return _order_history('passenger_id')
+
+
+def _order_history(owner):
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', Config.HISTORY_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, Config.HISTORY_PAGE_MAX))
+    orders, next_after = archive.history(db.session, owner, session.get('user_id'), after, limit)
+    return jsonify({'orders': orders, 'next_after': next_after}), 200
+
+
+def _create_order(fields):
+    order = Order(status=OrderStatus.PENDING, **fields)
     db.session.add(order)
+    db.session.flush()
+    order_id = order.id
     db.session.commit()
+    try:
+        record_demand(order_id, float(fields['pickup_lat']), float(fields['pickup_lng']))
+    except (TypeError, ValueError):
+        pass  # Без координат подачи заказ на карту спроса не попадает
     
-    # Попробовать назначить водителю
-    assign_order_to_next_driver(order.id)
+    # Попробовать назначить водителю (статус берем из результата, не перечитывая заказ)
+    driver_id = dispatch_new_order(order_id)
     
     return jsonify({
-        'order_id': order.id,
-        'status': order.status.value
+        'order_id': order_id,
+        'status': (OrderStatus.ASSIGNED if driver_id else OrderStatus.PENDING).value,
+        'price': fields['price'],
+        'currency': Config.FARE_CURRENCY
     }), 201
 
 
 @app.route('/api/passenger/orders/<int:order_id>', methods=['GET'])
+@login_required()
+@read_only_db
 def get_order(order_id):
+    """Заказ пассажира. ETag — версия заказа в памяти: 304 и long-poll (?wait=N&since=<version>) без БД."""
     user_id = session.get('user_id')
-    if not user_id:
-        return jsonify({'error': 'Not authenticated'}), 401
     
-    order = Order.query.get(order_id)
+    known = order_versions.peek(order_id)
+    if known is not None and known[1] == user_id:
+        since = request.args.get('since', type=int)
+        wait = _long_poll_wait()
+        if wait and since == known[0]:
+            _park(lambda: order_versions.wait(order_id, since, wait))
+        not_modified = _not_modified(_etag('o', order_id, order_versions.current(order_id)))
+        if not_modified is not None:
+            return not_modified
+    
+    # Версию берем до чтения из БД: изменение между ними даст клиенту новую версию, а не потеряется
+    version = order_versions.current(order_id)
+    order = Order.query.get(order_id) or ArchivedOrder.query.get(order_id)
     if not order:
         return jsonify({'error': 'Order not found'}), 404
     
     if order.passenger_id != user_id:
         return jsonify({'error': 'Access denied'}), 403
+    order_versions.set_owner(order_id, user_id)
     
-    return jsonify({
+    return _revalidate(jsonify({
         'order_id': order.id,
         'pickup_address': order.pickup_address,
         'destination_address': order.destination_address,
@@ -620,18 +1706,54 @@ def get_order(order_id):
         'pickup_lng': order.pickup_lng,
         'destination_lat': order.destination_lat,
         'destination_lng': order.destination_lng,
+        'price': order.price,
         'status': order.status.value,
         'driver_id': order.driver_id,
-        'created_at': order.created_at.isoformat()
+        'driver_location': _driver_location_for(order),
+        'created_at': order.created_at.isoformat(),
+        'version': version
+    }), _etag('o', order_id, version)), 200
+
+
+@app.route('/api/events', methods=['GET'])
+@login_required()
+@read_only_db
+def order_events_since():
+    """События заказов текущего пользователя после seq (догрузка пропущенного при переподключении).
+
+    Без since — только last_seq: точка отсчета для клиента при загрузке страницы.
+    """
+    user = current_user_facts()
+    room = f'{user.role.value}_{user.id}'
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({'events': [], 'last_seq': outbox.last_seq(db.session, room)}), 200
+    limit = min(request.args.get('limit', Config.EVENTS_SINCE_MAX, type=int), Config.EVENTS_SINCE_MAX)
+    events = outbox.events_since(db.session, room, since, max(limit, 1))
+    return jsonify({
+        'events': events,
+        'last_seq': events[-1]['seq'] if events else since,
+        'more': len(events) == limit,
     }), 200
 
 
+def _driver_location_for(order):
+    """Последняя точка водителя принятого заказа (из памяти), иначе None."""
+    if order.driver_id is None or order.status not in (OrderStatus.ACCEPTED, OrderStatus.IN_PROGRESS):
+        return None
+    fix = location_tracker.latest(order.driver_id)
+    if fix is None:
+        return None
+    return {'lat': fix.lat, 'lng': fix.lng, 'accuracy': fix.accuracy, 'ts': fix.ts}
+
+
 @app.route('/api/passenger/orders/<int:order_id>/cancel', methods=['POST'])
+@login_required()
 def cancel_order(order_id):
-    user_id = session.get('user_id')
-    if not user_id:
-        return jsonify({'error': 'Not authenticated'}), 401
-    
+    return _dispatch('cancel', _cancel_order, order_id, session.get('user_id'))
+
+
+def _cancel_order(order_id, user_id):
     order = Order.query.get(order_id)
     if not order:
         return jsonify({'error': 'Order not found'}), 404
@@ -643,38 +1765,63 @@ def cancel_order(order_id):
         return jsonify({'error': 'Order cannot be cancelled'}), 400
     
     # Если заказ назначен водителю, освободить его
+    freed_driver_id = order.driver_id
     if order.driver_id:
         driver = User.query.get(order.driver_id)
         if driver:
             driver.current_order_id = None
         
         # Остановить таймер если есть
-        if order_id in order_timers:
-            del order_timers[order_id]
+        cancel_order_timer(order_id)
         
         # Уведомить водителя
-        socketio.emit('order_cancelled', {
+        record_order_event(order_id, 'order_cancelled', f'driver_{order.driver_id}', {
             'order_id': order_id
-        }, room=f'driver_{order.driver_id}')
+        })
     
     order.status = OrderStatus.CANCELLED
     order.driver_id = None
     db.session.commit()
+    bump_order_version(order_id)
+    order_backlog.discard(order_id)
+    forget_declines(order_id)
+    forget_demand(order_id)
+    if freed_driver_id:
+        mark_driver_free(freed_driver_id)
+        drain_order_backlog()
     
     return jsonify({'status': 'cancelled'}), 200
 
 
+# Роль каждого соединения (для гейджа socketio_connections): sid -> role
+_socket_roles = {}
+
+
 @socketio.on('connect')
 def handle_connect():
     user_id = session.get('user_id')
-    if user_id:
-        user = User.query.get(user_id)
-        if user:
-            if user.role == UserRole.DRIVER:
-                join_room(f'driver_{user_id}')
-            elif user.role == UserRole.PASSENGER:
-                join_room(f'passenger_{user_id}')
-            emit('connected', {'user_id': user_id, 'role': user.role.value})
+    user = current_user_facts()
+    role = user.role.value if user else 'anonymous'
+    _socket_roles[request.sid] = role
+    SOCKET_CONNECTIONS.inc(role)
+    if user:
+        if user.role == UserRole.DRIVER:
+            join_room(f'driver_{user_id}')
+            join_room('drivers')
+            _track_driver_connection(user_id)
+        elif user.role == UserRole.PASSENGER:
+            join_room(f'passenger_{user_id}')
+            join_room('passengers')
+        emit('connected', {'user_id': user_id, 'role': user.role.value})
+    _emit_queue_state(user_id)
+
+
+def _emit_queue_state(user_id=None):
+    """Текущее состояние очереди одному клиенту (при подключении)."""
+    state = queue_deltas.state_for(user_id)
+    emit('drivers_count', {'count': state['count'], 'seq': state['seq']})
+    if user_id and user_id in driver_queue:
+        emit('queue_position', state)
 
 
 @socketio.on('driver_register')
@@ -688,27 +1835,90 @@ def on_driver_register(data):
     if sid == user_id:
         pass
     elif sid is None:
-        u = User.query.get(user_id)
+        u = user_facts_for(user_id)
         if not u or u.role != UserRole.DRIVER:
             return
     else:
         return
     join_room(f'driver_{user_id}')
+    join_room('drivers')
+    _track_driver_connection(user_id)
+    _emit_queue_state(user_id)
+
+
+def _track_driver_connection(user_id):
+    if Config.PRESENCE_TRACKING:
+        returned = presence.connect(request.sid, user_id)
+        coordination.touch(_presence_key(user_id), Config.PRESENCE_HEARTBEAT_TIMEOUT_SECONDS)
+        _schedule_presence_sweep()
+        if returned:
+            # Пока водитель был недоступен, заказы его пропускали и ждут в backlog — он снова может их взять
+            try:
+                dispatcher.submit('driver_reachable', drain_order_backlog)
+            except DispatcherBusy:
+                logger.warning('Dispatcher busy, backlog drain for returned driver %s skipped', user_id)
+
+
+@socketio.on('driver_location')
+def on_driver_location(data):
+    """Точка от водителя (до раза в секунду): только память, без запросов к БД."""
+    user = current_user_facts()
+    if not user or user.role != UserRole.DRIVER or not isinstance(data, dict):
+        return
+    try:
+        lat = float(data.get('lat'))
+        lng = float(data.get('lng'))
+    except (TypeError, ValueError):
+        return
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return
+    busy = location_tracker.is_busy(user.id)
+    # Не на линии и без заказа — точка никому не нужна
+    if not busy and user.id not in driver_queue:
+        return
+    if Config.PRESENCE_TRACKING:
+        presence.heartbeat(request.sid)
+    update_driver_location(user.id, lat, lng, free=not busy, accuracy=_accuracy(data))
+
+
+@socketio.on('heartbeat')
+def on_heartbeat(data=None):
+    """Водитель на связи (клиент шлет раз в 15 с; соединение без heartbeat считается потерянным)."""
+    if Config.PRESENCE_TRACKING:
+        driver_id = presence.heartbeat(request.sid)
+        if driver_id is not None:
+            # Остальные воркеры видят водителя на связи, пока ключ не истек
+            coordination.touch(_presence_key(driver_id), Config.PRESENCE_HEARTBEAT_TIMEOUT_SECONDS)
 
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    user_id = session.get('user_id')
-    if user_id:
-        user = User.query.get(user_id)
-        if user:
-            if user.role == UserRole.DRIVER:
-                leave_room(f'driver_{user_id}')
-            elif user.role == UserRole.PASSENGER:
-                leave_room(f'passenger_{user_id}')
+    # Водитель остается на линии: снимет его sweep_presence, если не переподключится
+    driver_id = presence.disconnect(request.sid)
+    if driver_id is not None and not presence.is_live(driver_id):
+        coordination.release(_presence_key(driver_id))
+    role = _socket_roles.pop(request.sid, None)
+    if role is not None:
+        SOCKET_CONNECTIONS.dec(role)
+    user = current_user_facts()
+    if user:
+        if user.role == UserRole.DRIVER:
+            leave_room(f'driver_{user.id}')
+            leave_room('drivers')
+        elif user.role == UserRole.PASSENGER:
+            leave_room(f'passenger_{user.id}')
+            leave_room('passengers')
+
+
+# Прием событий других воркеров (очередь, кэши) — после регистрации всех обработчиков
+coordination.start()
 
 
 if __name__ == '__main__':
     init_db()
     rebuild_driver_queue()
+    reconcile_assignments()
+    rebuild_order_backlog()
+    resume_order_events()
+    start_order_archive()
     socketio.run(app, debug=True, host='0.0.0.0', port=5000)
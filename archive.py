@@ -0,0 +1,75 @@
+"""Архив заказов (таблица orders_archive) и история заказов с keyset-пагинацией.
+
+Завершенные и отмененные заказы старше порога переносятся пачками: INSERT … SELECT в архив,
+удаление разосланных событий outbox этих заказов и самих строк из orders — одной транзакцией.
+Живая таблица остается маленькой для запросов назначения, а id сохраняется, так что ссылки
+(трек водителя, ETag заказа) продолжают указывать на тот же заказ.
+
+История читается страницами «после id» (по убыванию id) из обеих таблиц. Архив — поиск в покрывающем
+индексе (owner_id, id, …), время страницы не зависит от глубины истории. В живой таблице у человека
+лишь недавние заказы — хватает обычных индексов по пассажиру и водителю, а вставки и смены статуса
+не платят за широкие индексы.
+"""
+from datetime import datetime
+
+from sqlalchemy import delete, exists, insert, literal, select
+
+from models import HISTORY_COLUMNS, ArchivedOrder, Order, OrderEvent, OrderStatus, User
+
+ARCHIVED_STATUSES = (OrderStatus.COMPLETED, OrderStatus.CANCELLED)
+
+
+def archive_batch(session, before, limit):
+    """Перенести в архив до limit заказов, созданных раньше before; вернуть число перенесенных.
+
+    Пропускаются заказы, на которые еще ссылается users.current_order_id или у которых есть
+    неразосланные события (их дошлет публикатор, заказ уйдет в архив следующим проходом).
+    """
+    ids = [order_id for (order_id,) in (
+        session.query(Order.id)
+        .filter(Order.status.in_(ARCHIVED_STATUSES), Order.created_at < before)
+        .filter(~exists().where(User.current_order_id == Order.id))
+        .filter(~exists().where(OrderEvent.order_id == Order.id, OrderEvent.sent_at.is_(None)))
+        .order_by(Order.created_at)
+        .limit(limit)
+        .all()
+    )]
+    if not ids:
+        session.rollback()
+        return 0
+    columns = [c.name for c in Order.__table__.columns]
+    rows = select(*Order.__table__.columns, literal(datetime.utcnow()).label('archived_at')).where(Order.id.in_(ids))
+    session.execute(insert(ArchivedOrder.__table__).from_select(columns + ['archived_at'], rows))
+    session.execute(delete(OrderEvent).where(OrderEvent.order_id.in_(ids)))
+    session.execute(delete(Order).where(Order.id.in_(ids)))
+    session.commit()
+    return len(ids)
+
+
+def _page(session, model, owner, user_id, after, limit):
+    columns = [getattr(model, name) for name in HISTORY_COLUMNS]
+    query = session.query(*columns).filter(getattr(model, owner) == user_id)
+    if after is not None:
+        query = query.filter(model.id < after)
+    return query.order_by(model.id.desc()).limit(limit).all()
+
+
+def history(session, owner, user_id, after, limit):
+    """Страница истории пользователя (owner — 'passenger_id' или 'driver_id'): (заказы, курсор или None).
+
+    Заказы — по убыванию id, строго меньше after; курсор — id последнего, если есть следующая страница.
+    """
+    rows = _page(session, Order, owner, user_id, after, limit + 1)
+    rows += _page(session, ArchivedOrder, owner, user_id, after, limit + 1)
+    rows.sort(key=lambda row: row.id, reverse=True)
+    page = rows[:limit]
+    orders = [{
+        'order_id': row.id,
+        'status': row.status.value,
+        'pickup_address': row.pickup_address,
+        'destination_address': row.destination_address,
+        'price': row.price,
+        'created_at': row.created_at.isoformat() if row.created_at else None,
+        'completed_at': row.completed_at.isoformat() if row.completed_at else None,
+    } for row in page]
+    return orders, (page[-1].id if len(rows) > limit else None)
@@ -0,0 +1,123 @@
+"""Текущий пользователь: одна загрузка на запрос и кэш неизменяемых фактов (роль, имя) на процесс.
+
+Проверка входа и роли (login_required) идет по кэшу фактов и в БД не ходит.
+Строка User, если она нужна обработчику, загружается один раз за запрос (current_user)
+и заодно обновляет кэш. Роль меняется только в switch_role — там кэш сбрасывается явно;
+TTL страхует от устаревания в других процессах.
+"""
+import hmac
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+
+from flask import g, jsonify, request, session
+
+from config import Config
+from models import User, UserRole
+
+UserFacts = namedtuple('UserFacts', 'id username role')
+
+_ROLE_ERRORS = {
+    UserRole.DRIVER: 'Not a driver',
+    UserRole.PASSENGER: 'Not a passenger',
+}
+
+
+class UserFactsCache:
+    """LRU-кэш {user_id: UserFacts} с TTL."""
+
+    def __init__(self, ttl, maxsize=10000, clock=time.monotonic):
+        self._ttl = ttl
+        self._maxsize = maxsize
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get(self, user_id):
+        with self._lock:
+            item = self._items.get(user_id)
+            if item is None:
+                return None
+            facts, expires = item
+            if expires < self._clock():
+                del self._items[user_id]
+                return None
+            self._items.move_to_end(user_id)
+            return facts
+
+    def put(self, facts):
+        with self._lock:
+            self._items[facts.id] = (facts, self._clock() + self._ttl)
+            self._items.move_to_end(facts.id)
+            while len(self._items) > self._maxsize:
+                self._items.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._items.pop(user_id, None)
+
+
+user_facts = UserFactsCache(ttl=Config.USER_CACHE_TTL_SECONDS)
+
+
+def current_user():
+    """Строка User текущего пользователя (или None) — загружается один раз за запрос/событие."""
+    if 'current_user' not in g:
+        user_id = session.get('user_id')
+        user = User.query.get(user_id) if user_id else None
+        if user is not None:
+            user_facts.put(UserFacts(user.id, user.username, user.role))
+        g.current_user = user
+    return g.current_user
+
+
+def user_facts_for(user_id):
+    """Роль и имя пользователя из кэша; при промахе — одна загрузка строки."""
+    if not user_id:
+        return None
+    facts = user_facts.get(user_id)
+    if facts is None:
+        if user_id == session.get('user_id'):
+            user = current_user()
+        else:
+            user = User.query.get(user_id)
+        if user is None:
+            return None
+        facts = UserFacts(user.id, user.username, user.role)
+        user_facts.put(facts)
+    return facts
+
+
+def current_user_facts():
+    return user_facts_for(session.get('user_id'))
+
+
+def login_required(role=None):
+    """Декоратор маршрута: 401 без входа, 403/404 при неподходящей роли или удаленном пользователе."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not session.get('user_id'):
+                return jsonify({'error': 'Not authenticated'}), 401
+            facts = current_user_facts()
+            if role is not None and (facts is None or facts.role != role):
+                return jsonify({'error': _ROLE_ERRORS[role]}), 403
+            if facts is None:
+                return jsonify({'error': 'User not found'}), 404
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def monitoring_required(view):
+    """Декоратор служебных страниц: 404 без MONITORING_TOKEN, 401 без верного Bearer-токена."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = Config.MONITORING_TOKEN
+        if not token:
+            return jsonify({'error': 'Not found'}), 404
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return jsonify({'error': 'Not authenticated'}), 401
+        return view(*args, **kwargs)
+    return wrapper
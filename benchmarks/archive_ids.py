@@ -0,0 +1,103 @@
+"""Проверка: id заказа не переиспользуется после переноса в orders_archive.
+
+    python benchmarks/archive_ids.py
+
+1) Новая БД: самый новый заказ отменяется и уходит в архив — следующий заказ получает больший id,
+   повторный проход архивации не падает, в истории нет повторов.
+2) Старая БД (orders без AUTOINCREMENT, в архиве есть id больше живых): init_db перестраивает
+   таблицу, сохраняет строки и индексы, а новый id больше любого архивного.
+Код возврата 1 — какая-то проверка не прошла.
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DB_PATH = tempfile.mktemp(prefix='taxi-archive-ids-', suffix='.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_PATH
+os.environ['GEOCODE_CACHE_PATH'] = ''
+os.environ['PRESENCE_TRACKING'] = '0'
+sys.path.insert(0, ROOT)
+
+import app as taxi_app  # noqa: E402
+
+results = []
+
+
+def check(name, ok):
+    results.append((name, bool(ok)))
+
+
+def _archive_all():
+    with taxi_app.app.app_context():
+        return taxi_app.archive.archive_batch(taxi_app.db.session, datetime.utcnow() + timedelta(seconds=1), 100)
+
+
+def _new_order(c):
+    r = c.post('/api/passenger/orders', json={'pickup_address': 'A', 'destination_address': 'B'})
+    return r.get_json()['order_id']
+
+
+def fresh_db():
+    taxi_app.init_db()
+    c = taxi_app.app.test_client()
+    c.post('/api/register', json={'username': 'p', 'phone': '+20000001', 'role': 'passenger'})
+    first = _new_order(c)
+    c.post(f'/api/passenger/orders/{first}/cancel')
+    check('newest order archived', _archive_all() == 1)
+    second = _new_order(c)
+    check('new id above archived id', second > first)
+    c.post(f'/api/passenger/orders/{second}/cancel')
+    check('archiving again succeeds', _archive_all() == 1)
+    ids = [o['order_id'] for o in c.get('/api/passenger/orders').get_json()['orders']]
+    check('history ids unique', len(ids) == len(set(ids)) == 2)
+
+
+def old_db():
+    with taxi_app.app.app_context():
+        taxi_app.db.engine.dispose()
+    conn = sqlite3.connect(DB_PATH)
+    ddl = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'orders'").fetchone()[0]
+    # Схема до AUTOINCREMENT: та же таблица без него, живой заказ 3, в архиве — до 7
+    conn.executescript(f'''
+        DROP TABLE orders;
+        {ddl.replace('AUTOINCREMENT', '')};
+        DELETE FROM sqlite_sequence WHERE name = 'orders';
+        INSERT INTO orders (id, passenger_id, pickup_address, destination_address, status, created_at)
+        VALUES (3, 1, 'A', 'B', 'PENDING', '2020-01-01 00:00:00');
+        UPDATE orders_archive SET id = 7 WHERE id = (SELECT max(id) FROM orders_archive);
+    ''')
+    conn.commit()
+    conn.close()
+    taxi_app.init_db()
+    conn = sqlite3.connect(DB_PATH)
+    ddl = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'orders'").fetchone()[0]
+    check('old table rebuilt with AUTOINCREMENT', 'AUTOINCREMENT' in ddl.upper())
+    check('rows kept', conn.execute('SELECT id FROM orders').fetchall() == [(3,)])
+    indexes = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'orders'")}
+    check('indexes recreated', {'ix_orders_passenger_created_at', 'ix_orders_status_created_at'} <= indexes)
+    conn.close()
+    c = taxi_app.app.test_client()
+    c.post('/api/login', json={'username': 'p'})
+    check('new id above archived ids after migration', _new_order(c) > 7)
+
+
+def main():
+    try:
+        fresh_db()
+        old_db()
+    finally:
+        taxi_app.dispatcher.stop()
+    failed = 0
+    for name, ok in results:
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+        failed += not ok
+    os.remove(DB_PATH)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
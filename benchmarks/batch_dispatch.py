@@ -0,0 +1,110 @@
+"""Сравнение назначения заказов при всплеске: очередь, ближайший (жадно) и пакетное.
+
+Каждая политика прогоняется в отдельном процессе на свежей SQLite-БД через Flask test client:
+N водителей со случайными координатами, затем M заказов подряд (приход поезда).
+Печатает суммарное и среднее расстояние подачи и пропускную способность (заказов/с).
+
+    python benchmarks/batch_dispatch.py --drivers 60 --orders 40
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CENTER = (46.63, 31.10)
+SPAN_DEG = 0.05
+
+
+def _point(rng):
+    return (CENTER[0] + rng.uniform(-SPAN_DEG, SPAN_DEG), CENTER[1] + rng.uniform(-SPAN_DEG, SPAN_DEG) * 1.4)
+
+
+def child(mode, n_drivers, n_orders, seed):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + tempfile.mktemp(prefix='taxi-batch-', suffix='.db')
+    os.environ['DISPATCH_POLICY'] = 'queue' if mode == 'queue' else 'nearest'
+    # В пакетном режиме окно не должно сработать само: пакет запускаем вручную и меряем время
+    os.environ['DISPATCH_BATCH_WINDOW_SECONDS'] = '3600' if mode == 'batch' else '0'
+    os.environ['DISPATCH_RADIUS_KM'] = '50'
+    # Водители здесь ходят только по HTTP, без Socket.IO-соединения
+    os.environ['PRESENCE_TRACKING'] = '0'
+    os.environ['GEOCODE_CACHE_PATH'] = ''
+    sys.path.insert(0, ROOT)
+    import app as taxi_app
+    from geo import haversine_km
+
+    rng = random.Random(seed)
+    taxi_app.init_db()
+    positions = {}
+    for i in range(n_drivers):
+        c = taxi_app.app.test_client()
+        r = c.post('/api/register', json={'username': f'd{i}', 'phone': f'+1{i:06d}', 'role': 'driver'})
+        driver_id = r.get_json()['user_id']
+        c.post('/api/driver/online')
+        lat, lng = _point(rng)
+        c.post('/api/driver/location', json={'lat': lat, 'lng': lng})
+        positions[driver_id] = (lat, lng)
+    passengers = []
+    for i in range(n_orders):
+        c = taxi_app.app.test_client()
+        c.post('/api/register', json={'username': f'p{i}', 'phone': f'+2{i:06d}', 'role': 'passenger'})
+        passengers.append((c, _point(rng), _point(rng)))
+
+    t0 = time.perf_counter()
+    order_ids = []
+    for c, (plat, plng), (dlat, dlng) in passengers:
+        r = c.post('/api/passenger/orders', json={
+            'pickup_address': 'A', 'destination_address': 'B',
+            'pickup_lat': plat, 'pickup_lng': plng, 'destination_lat': dlat, 'destination_lng': dlng,
+        })
+        order_ids.append(r.get_json()['order_id'])
+    if mode == 'batch':
+        taxi_app.order_timers.cancel(taxi_app.BATCH_DISPATCH_KEY)
+        with taxi_app.app.app_context():
+            taxi_app.run_batch_dispatch()
+    elapsed = time.perf_counter() - t0
+
+    total_km = 0.0
+    assigned = 0
+    with taxi_app.app.app_context():
+        for order in taxi_app.Order.query.filter(taxi_app.Order.id.in_(order_ids)).all():
+            if order.driver_id:
+                assigned += 1
+                dlat, dlng = positions[order.driver_id]
+                total_km += haversine_km(dlat, dlng, order.pickup_lat, order.pickup_lng)
+    print(json.dumps({
+        'mode': mode,
+        'assigned': assigned,
+        'total_pickup_km': round(total_km, 2),
+        'avg_pickup_km': round(total_km / assigned, 3) if assigned else None,
+        'orders_per_second': round(n_orders / elapsed, 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--drivers', type=int, default=60)
+    parser.add_argument('--orders', type=int, default=40)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--child', choices=['queue', 'nearest', 'batch'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.drivers, args.orders, args.seed)
+        return 0
+    for mode in ('queue', 'nearest', 'batch'):
+        out = subprocess.run(
+            [sys.executable, '-W', 'ignore', __file__, '--child', mode,
+             '--drivers', str(args.drivers), '--orders', str(args.orders), '--seed', str(args.seed)],
+            capture_output=True, text=True, check=True,
+        )
+        print(out.stdout.strip().splitlines()[-1])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
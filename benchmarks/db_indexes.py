@@ -0,0 +1,193 @@
+"""Индексы и PRAGMA SQLite: планы запросов, задержка горячих запросов и конкурентная запись.
+
+    python benchmarks/db_indexes.py --drivers 2000 --passengers 20000 --orders 200000
+
+1) Горячие запросы (выбор свободного водителя, backlog, сверка назначенных, заказы
+   пассажира/водителя) на одной и той же БД без индексов и с индексами из models.py:
+   EXPLAIN QUERY PLAN и медиана времени.
+2) Запись из нескольких потоков: журнал DELETE без ожидания блокировки против
+   WAL + synchronous=NORMAL + busy_timeout (как настраивает database.py).
+Результаты — строки JSON.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func, insert, select, text, update  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from config import Config  # noqa: E402
+from database import configure_sqlite  # noqa: E402
+from models import db, Order, OrderStatus, User, UserRole  # noqa: E402
+
+users = User.__table__
+orders = Order.__table__
+
+
+def _populate(engine, n_drivers, n_passengers, n_orders, seed):
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        rows = []
+        for i in range(n_drivers):
+            online = rng.random() < 0.3
+            rows.append({'username': f'd{i}', 'phone': f'+1{i:07d}', 'role': UserRole.DRIVER,
+                         'is_active': True, 'is_online': online, 'created_at': now,
+                         'queue_position': None})
+        for i in range(n_passengers):
+            rows.append({'username': f'p{i}', 'phone': f'+2{i:07d}', 'role': UserRole.PASSENGER,
+                         'is_active': True, 'is_online': False, 'created_at': now,
+                         'queue_position': None})
+        conn.execute(insert(users), rows)
+        online = [r[0] for r in conn.execute(select(users.c.id).where(users.c.role == UserRole.DRIVER,
+                                                                      users.c.is_online == True))]
+        for pos, driver_id in enumerate(online, 1):
+            conn.execute(update(users).where(users.c.id == driver_id).values(queue_position=pos))
+
+        statuses = [OrderStatus.COMPLETED] * 90 + [OrderStatus.CANCELLED] * 8 + [OrderStatus.PENDING, OrderStatus.ASSIGNED]
+        batch = []
+        for i in range(n_orders):
+            status = rng.choice(statuses)
+            created = now - timedelta(minutes=n_orders - i)
+            batch.append({
+                'passenger_id': n_drivers + 1 + rng.randrange(n_passengers),
+                'driver_id': None if status == OrderStatus.PENDING else 1 + rng.randrange(n_drivers),
+                'pickup_address': 'A', 'destination_address': 'B',
+                'status': status, 'created_at': created,
+                'assigned_at': created if status == OrderStatus.ASSIGNED else None,
+            })
+            if len(batch) >= 10000:
+                conn.execute(insert(orders), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(orders), batch)
+    return n_drivers + 1
+
+
+def _hot_queries(passenger_id, driver_id):
+    return {
+        'next_free_driver': select(users.c.id).where(
+            users.c.role == UserRole.DRIVER, users.c.is_online == True,
+            users.c.queue_position.isnot(None), users.c.is_active == True,
+            users.c.current_order_id.is_(None),
+        ).order_by(users.c.queue_position, users.c.id).limit(1),
+        'online_drivers': select(users.c.id).where(users.c.role == UserRole.DRIVER, users.c.is_online == True),
+        'pending_backlog': select(orders.c.id, orders.c.created_at).where(
+            orders.c.status == OrderStatus.PENDING).order_by(orders.c.created_at, orders.c.id),
+        'assigned_reconcile': select(orders.c.id, orders.c.assigned_at).where(
+            orders.c.status == OrderStatus.ASSIGNED).order_by(orders.c.assigned_at),
+        'passenger_orders': select(orders.c.id).where(orders.c.passenger_id == passenger_id)
+        .order_by(orders.c.created_at.desc()).limit(20),
+        'driver_active_orders': select(func.count()).select_from(orders).where(
+            orders.c.driver_id == driver_id, orders.c.status == OrderStatus.ACCEPTED),
+    }
+
+
+def _measure(engine, stmt, repeat):
+    with engine.connect() as conn:
+        compiled = stmt.compile(engine, compile_kwargs={'literal_binds': True})
+        plan = [row[-1] for row in conn.execute(text('EXPLAIN QUERY PLAN ' + str(compiled)))]
+        timings = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            conn.execute(stmt).fetchall()
+            timings.append((time.perf_counter() - t0) * 1000)
+    return plan, statistics.median(timings)
+
+
+def run_queries(args, path):
+    engine = create_engine('sqlite:///' + path)
+    first_passenger = _populate(engine, args.drivers, args.passengers, args.orders, args.seed)
+    queries = _hot_queries(first_passenger + args.passengers // 2, args.drivers // 2)
+    index_names = [idx.name for t in db.metadata.tables.values() for idx in t.indexes]
+    for variant in ('no_indexes', 'indexes'):
+        with engine.begin() as conn:
+            for name in index_names:
+                conn.execute(text(f'DROP INDEX IF EXISTS {name}'))
+            if variant == 'indexes':
+                for table in db.metadata.tables.values():
+                    for idx in table.indexes:
+                        idx.create(conn)
+            conn.execute(text('ANALYZE'))
+        for name, stmt in queries.items():
+            plan, median_ms = _measure(engine, stmt, args.repeat)
+            print(json.dumps({'variant': variant, 'query': name, 'median_ms': round(median_ms, 3), 'plan': plan},
+                             ensure_ascii=False))
+    engine.dispose()
+
+
+def _writer(engine, n_commits, result, lock):
+    done = errors = 0
+    for _ in range(n_commits):
+        try:
+            with engine.begin() as conn:
+                conn.execute(update(users).where(users.c.id == 1).values(queue_position=users.c.queue_position + 1))
+                conn.execute(select(func.count()).select_from(orders).where(orders.c.status == OrderStatus.PENDING)).scalar()
+            done += 1
+        except OperationalError:
+            errors += 1
+    with lock:
+        result['commits'] += done
+        result['locked_errors'] += errors
+
+
+def run_writes(args, path):
+    for variant in ('journal_delete', 'wal'):
+        if variant == 'wal':
+            engine = create_engine('sqlite:///' + path, connect_args={'timeout': Config.SQLITE_BUSY_TIMEOUT_MS / 1000})
+            configure_sqlite(engine, {'SQLITE_WAL': True, 'SQLITE_BUSY_TIMEOUT_MS': Config.SQLITE_BUSY_TIMEOUT_MS,
+                                      'SQLITE_MMAP_SIZE': Config.SQLITE_MMAP_SIZE})
+        else:
+            engine = create_engine('sqlite:///' + path, connect_args={'timeout': 0})
+            with engine.connect() as conn:
+                conn.exec_driver_sql('PRAGMA journal_mode=DELETE')
+        result = {'commits': 0, 'locked_errors': 0}
+        lock = threading.Lock()
+        threads = [threading.Thread(target=_writer, args=(engine, args.commits, result, lock))
+                   for _ in range(args.threads)]
+        t0 = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - t0
+        print(json.dumps({'variant': variant, 'threads': args.threads, 'commits': result['commits'],
+                          'locked_errors': result['locked_errors'],
+                          'commits_per_second': round(result['commits'] / elapsed, 1)}))
+        engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--drivers', type=int, default=2000)
+    parser.add_argument('--passengers', type=int, default=20000)
+    parser.add_argument('--orders', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--commits', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    path = tempfile.mktemp(prefix='taxi-idx-', suffix='.db')
+    try:
+        run_queries(args, path)
+        run_writes(args, path)
+    finally:
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""Проверка: заказ, отклоненный всеми водителями, снова предлагается им, когда отказ истекает.
+
+    python benchmarks/decline_expiry.py
+
+Единственный водитель на линии отклоняет заказ: заказ ждет в backlog, пока действует отказ
+(ORDER_DECLINE_TTL_SECONDS), а потом назначается тому же водителю без других событий.
+Код возврата 1 — какая-то проверка не прошла.
+"""
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TTL = 0.5
+
+DB_PATH = tempfile.mktemp(prefix='taxi-decline-expiry-', suffix='.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_PATH
+os.environ['GEOCODE_CACHE_PATH'] = ''
+os.environ['PRESENCE_TRACKING'] = '0'
+os.environ['ORDER_DECLINE_TTL_SECONDS'] = str(TTL)
+sys.path.insert(0, ROOT)
+
+import app as taxi_app  # noqa: E402
+
+results = []
+
+
+def check(name, ok):
+    results.append((name, bool(ok)))
+
+
+def _order(order_id):
+    with taxi_app.app.app_context():
+        order = taxi_app.Order.query.get(order_id)
+        return order.status.value, order.driver_id
+
+
+def _client(username, phone, role):
+    c = taxi_app.app.test_client()
+    c.post('/api/register', json={'username': username, 'phone': phone, 'role': role})
+    return c
+
+
+def main():
+    taxi_app.init_db()
+    try:
+        driver = _client('d', '+10000001', 'driver')
+        driver.post('/api/driver/online')
+        passenger = _client('p', '+20000001', 'passenger')
+        order_id = passenger.post('/api/passenger/orders',
+                                  json={'pickup_address': 'A', 'destination_address': 'B'}).get_json()['order_id']
+        status, driver_id = _order(order_id)
+        check('order assigned to the only driver', status == 'assigned')
+        check('driver rejects', driver.post(f'/api/driver/orders/{order_id}/reject').status_code == 200)
+        check('order waits while the decline holds', _order(order_id) == ('pending', None))
+        time.sleep(TTL * 3)
+        check('order offered again after the decline expires', _order(order_id) == ('assigned', driver_id))
+        check('backlog drained', len(taxi_app.order_backlog) == 0)
+    finally:
+        taxi_app.dispatcher.stop()
+    failed = 0
+    for name, ok in results:
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+        failed += not ok
+    os.remove(DB_PATH)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""Проверка назначения заказов под конкурентной нагрузкой (без сети, через Flask test client).
+
+Поднимает временную SQLite-БД, выводит на линию N водителей и одновременно
+создает M заказов из нескольких процессов (как несколько воркеров gunicorn)
+и потоков. Затем проверяет, что ни один водитель не получил два заказа
+и что users.current_order_id согласован с orders.driver_id.
+
+    python benchmarks/dispatch_concurrency.py --drivers 20 --orders 60 --processes 4
+    python benchmarks/dispatch_concurrency.py --coordination   # общая очередь и блокировка (resp_server.py)
+
+Код возврата 1 — найдено двойное назначение или рассинхронизация.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def _import_app(db_path):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + db_path
+    # Водители здесь ходят только по HTTP, без Socket.IO-соединения
+    os.environ['PRESENCE_TRACKING'] = '0'
+    os.environ['GEOCODE_CACHE_PATH'] = ''
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import app as taxi_app
+    return taxi_app
+
+
+def _setup(db_path, drivers, passengers):
+    taxi_app = _import_app(db_path)
+    taxi_app.init_db()
+    for i in range(drivers):
+        c = taxi_app.app.test_client()
+        c.post('/api/register', json={'username': f'driver{i}', 'phone': f'+1{i:06d}', 'role': 'driver'})
+        r = c.post('/api/driver/online')
+        assert r.status_code == 200, r.get_json()
+    for i in range(passengers):
+        c = taxi_app.app.test_client()
+        r = c.post('/api/register', json={'username': f'passenger{i}', 'phone': f'+2{i:06d}', 'role': 'passenger'})
+        assert r.status_code == 201, r.get_json()
+
+
+def _worker(db_path, usernames, barrier, results):
+    taxi_app = _import_app(db_path)
+    clients = []
+    for name in usernames:
+        c = taxi_app.app.test_client()
+        c.post('/api/login', json={'username': name})
+        clients.append(c)
+
+    local_barrier = threading.Barrier(len(clients))
+    statuses = []
+
+    def fire(c):
+        local_barrier.wait()
+        r = c.post('/api/passenger/orders', json={
+            'pickup_address': 'A', 'destination_address': 'B',
+            'pickup_lat': 46.63, 'pickup_lng': 31.1, 'destination_lat': 46.64, 'destination_lng': 31.11,
+        })
+        statuses.append(r.status_code)
+
+    barrier.wait()
+    threads = [threading.Thread(target=fire, args=(c,)) for c in clients]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # Дождаться хвоста команд диспетчера: процесс, вышедший с блокировкой, держит остальных до истечения аренды
+    taxi_app.dispatcher.stop()
+    results.put(statuses)
+
+
+def _verify(db_path):
+    taxi_app = _import_app(db_path)
+    User, Order, OrderStatus = taxi_app.User, taxi_app.Order, taxi_app.OrderStatus
+    errors = []
+    with taxi_app.app.app_context():
+        active = Order.query.filter(Order.status == OrderStatus.ASSIGNED).all()
+        per_driver = {}
+        for o in active:
+            per_driver.setdefault(o.driver_id, []).append(o.id)
+        for driver_id, order_ids in per_driver.items():
+            if len(order_ids) > 1:
+                errors.append(f'driver {driver_id} holds orders {order_ids}')
+        for u in User.query.filter(User.current_order_id.isnot(None)).all():
+            o = Order.query.get(u.current_order_id)
+            if not o or o.driver_id != u.id:
+                errors.append(f'driver {u.id} points to order {u.current_order_id} owned by {o and o.driver_id}')
+        for o in active:
+            u = User.query.get(o.driver_id)
+            if u.current_order_id != o.id:
+                errors.append(f'order {o.id} assigned to driver {u.id} whose current order is {u.current_order_id}')
+        pending = Order.query.filter(Order.status == OrderStatus.PENDING).count()
+        if taxi_app.coordination.shared:
+            # Общая очередь в координаторе должна совпадать с позициями в БД
+            shared = [int(i) for i in taxi_app.coordination.client.execute('LRANGE', taxi_app.coordination.key('queue'), 0, -1)]
+            in_db = [u.id for u in User.query.filter(User.queue_position.isnot(None)).order_by(User.queue_position)]
+            if shared != in_db:
+                errors.append(f'shared queue {shared} differs from queue positions in DB {in_db}')
+    return len(active), pending, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--drivers', type=int, default=20)
+    parser.add_argument('--orders', type=int, default=60)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--coordination', action='store_true', help='COORDINATION_URL на локальный resp_server.py')
+    args = parser.parse_args()
+
+    server = None
+    if args.coordination:
+        from resp_server import RespServer
+        server = RespServer()
+        os.environ['COORDINATION_URL'] = server.start()
+
+    db_path = tempfile.mktemp(prefix='taxi-concurrency-', suffix='.db')
+    _setup(db_path, args.drivers, args.orders)
+
+    names = [f'passenger{i}' for i in range(args.orders)]
+    chunks = [names[i::args.processes] for i in range(args.processes)]
+    ctx = multiprocessing.get_context('spawn')
+    barrier = ctx.Barrier(args.processes)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(db_path, chunk, barrier, results)) for chunk in chunks]
+    for p in procs:
+        p.start()
+    statuses = []
+    for _ in procs:
+        statuses.extend(results.get())
+    for p in procs:
+        p.join()
+
+    assigned, pending, errors = _verify(db_path)
+    os.remove(db_path)
+    if server is not None:
+        server.shutdown()
+    print(f'orders created: {statuses.count(201)}/{args.orders}, assigned: {assigned}, pending: {pending}')
+    expected = min(args.drivers, args.orders)
+    if assigned != expected:
+        errors.append(f'expected {expected} assigned orders, got {assigned}')
+    for e in errors:
+        print('ERROR:', e)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""Бенчмарк оценки стоимости: один векторный вызов FareEngine.quote против цикла по маршрутам.
+
+    python benchmarks/fare_quotes.py --routes 1 10 100 1000 --zones 20
+
+Зоны — случайные многоугольники в пределах города. Заодно сверяет цены (код возврата 1 при расхождении).
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fares import FareEngine, ZoneIndex  # noqa: E402
+
+CENTER = (46.63, 31.10)
+SPAN_DEG = 0.09
+
+
+def _random_point(rng):
+    return (CENTER[0] + rng.uniform(-SPAN_DEG, SPAN_DEG), CENTER[1] + rng.uniform(-SPAN_DEG, SPAN_DEG) * 1.4)
+
+
+def _random_zone(rng, i, vertices=12):
+    lat, lng = _random_point(rng)
+    radius = rng.uniform(0.005, 0.02)
+    polygon = []
+    for k in range(vertices):
+        angle = 2 * math.pi * k / vertices
+        r = radius * rng.uniform(0.6, 1.0)
+        polygon.append([lat + r * math.sin(angle), lng + r * math.cos(angle) * 1.4])
+    return {'name': f'z{i}', 'surcharge': rng.choice([20, 30, 50]), 'polygon': polygon}
+
+
+def run(engine, n_routes, repeat, seed=1):
+    rng = random.Random(seed)
+    routes = [_random_point(rng) + _random_point(rng) for _ in range(n_routes)]
+    cols = list(zip(*routes))
+
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        vector = engine.quote(*cols)['price'].tolist()
+    t_vector = (time.perf_counter() - t0) / repeat
+
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        loop = [engine.price(*r) for r in routes]
+    t_loop = (time.perf_counter() - t0) / repeat
+
+    return {
+        'routes': n_routes,
+        'vector_us_per_route': round(t_vector / n_routes * 1e6, 1),
+        'loop_us_per_route': round(t_loop / n_routes * 1e6, 1),
+        'mismatches': sum(1 for a, b in zip(vector, loop) if a != b),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--routes', type=int, nargs='+', default=[1, 10, 100, 1000])
+    parser.add_argument('--zones', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    zones = ZoneIndex([_random_zone(rng, i) for i in range(args.zones)])
+    engine = FareEngine(base=40, per_km=12, minimum=60, road_factor=1.3, night_multiplier=1.2,
+                        tz='Europe/Kyiv', zones=zones)
+    failed = False
+    for n in args.routes:
+        r = run(engine, n, args.repeat)
+        failed = failed or r['mismatches'] > 0
+        print(r)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,257 @@
+"""Нагрузочный прогон без сети: Flask test client + SocketIO.test_client.
+
+N водителей (выходят на линию/уходят, принимают/отклоняют/завершают заказы) и M пассажиров
+(создают, отменяют и опрашивают заказы) в течение нескольких раундов на свежей SQLite-БД.
+Результат — JSON: задержка create_order → new_order (p50/p95/p99), пропускная способность
+GET /api/queue, время и число SQL-запросов на запрос по каждому эндпоинту, число потоков.
+
+    python benchmarks/load_test.py --drivers 50 --passengers 80 --rounds 5 --out run.json
+    python benchmarks/load_test.py --baseline run.json      # сравнить с прошлым прогоном
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, p):
+    """Процентиль по ближайшему рангу (values не пустой)."""
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(p / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+def _summary(values):
+    if not values:
+        return {'n': 0}
+    return {
+        'n': len(values),
+        'p50': round(percentile(values, 50), 3),
+        'p95': round(percentile(values, 95), 3),
+        'p99': round(percentile(values, 99), 3),
+        'max': round(max(values), 3),
+    }
+
+
+class Recorder:
+    """Время и число SQL-запросов (текущего потока и потока диспетчера) по каждому эндпоинту."""
+
+    def __init__(self):
+        self._thread = threading.get_ident()
+        self.queries = 0
+        self.endpoints = {}
+
+    def on_query(self, *args):
+        # Команды (заказ, принятие, отказ...) выполняются в потоке диспетчера — их запросы тоже в счет
+        if threading.get_ident() == self._thread or threading.current_thread().name == 'dispatcher':
+            self.queries += 1
+
+    def call(self, name, fn, *args, **kwargs):
+        q0 = self.queries
+        t0 = time.perf_counter()
+        response = fn(*args, **kwargs)
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        stats = self.endpoints.setdefault(name, {'ms': [], 'queries': 0, 'errors': 0})
+        stats['ms'].append(elapsed_ms)
+        stats['queries'] += self.queries - q0
+        if response.status_code >= 400:
+            stats['errors'] += 1
+        return response
+
+    def report(self):
+        out = {}
+        for name, stats in sorted(self.endpoints.items()):
+            n = len(stats['ms'])
+            out[name] = {
+                'count': n,
+                'errors': stats['errors'],
+                'p50_ms': round(percentile(stats['ms'], 50), 3),
+                'p95_ms': round(percentile(stats['ms'], 95), 3),
+                'queries_per_request': round(stats['queries'] / n, 2),
+            }
+        return out
+
+
+def run(args):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + tempfile.mktemp(prefix='taxi-load-', suffix='.db')
+    os.environ['DISPATCH_POLICY'] = args.policy
+    os.environ['DISPATCH_BATCH_WINDOW_SECONDS'] = str(args.batch_window)
+    os.environ['GEOCODE_CACHE_PATH'] = ''
+    sys.path.insert(0, ROOT)
+    from sqlalchemy import event
+    import app as taxi_app
+
+    rng = random.Random(args.seed)
+    threads_before = threading.active_count()
+    taxi_app.init_db()
+    rec = Recorder()
+    with taxi_app.app.app_context():
+        event.listen(taxi_app.db.engine, 'before_cursor_execute', rec.on_query)
+
+    drivers = []
+    for i in range(args.drivers):
+        c = taxi_app.app.test_client()
+        r = rec.call('register', c.post, '/api/register',
+                     json={'username': f'd{i}', 'phone': f'+1{i:06d}', 'role': 'driver'})
+        sio = taxi_app.socketio.test_client(taxi_app.app, flask_test_client=c)
+        drivers.append({'id': r.get_json()['user_id'], 'http': c, 'sio': sio, 'online': False})
+    passengers = []
+    for i in range(args.passengers):
+        c = taxi_app.app.test_client()
+        rec.call('register', c.post, '/api/register',
+                 json={'username': f'p{i}', 'phone': f'+2{i:06d}', 'role': 'passenger'})
+        passengers.append({'http': c, 'order_id': None})
+
+    for d in drivers:
+        rec.call('driver_online', d['http'].post, '/api/driver/online')
+        d['online'] = True
+        lat, lng = 46.63 + rng.uniform(-0.03, 0.03), 31.10 + rng.uniform(-0.04, 0.04)
+        rec.call('driver_location', d['http'].post, '/api/driver/location', json={'lat': lat, 'lng': lng})
+
+    waiting = {}          # order_id -> t0 (ждет new_order)
+    cancelled = set()
+    delivery_ms = []
+
+    def drain_driver_events():
+        """Забрать события водителей: new_order фиксирует задержку, водитель принимает или отклоняет."""
+        now = time.perf_counter()
+        offers = []
+        for d in drivers:
+            for ev in d['sio'].get_received():
+                if ev['name'] == 'new_order':
+                    order_id = ev['args'][0]['order_id']
+                    t0 = waiting.pop(order_id, None)
+                    if t0 is not None:
+                        delivery_ms.append((now - t0) * 1000)
+                    offers.append((d, order_id))
+        for d, order_id in offers:
+            if order_id in cancelled:
+                continue
+            if rng.random() < args.reject_rate:
+                rec.call('reject', d['http'].post, f'/api/driver/orders/{order_id}/reject')
+            else:
+                rec.call('accept', d['http'].post, f'/api/driver/orders/{order_id}/accept')
+                rec.call('complete', d['http'].post, f'/api/driver/orders/{order_id}/complete')
+        return len(offers)
+
+    t_start = time.perf_counter()
+    for _ in range(args.rounds):
+        for p in passengers:
+            plat, plng = 46.63 + rng.uniform(-0.03, 0.03), 31.10 + rng.uniform(-0.04, 0.04)
+            t0 = time.perf_counter()
+            r = rec.call('create_order', p['http'].post, '/api/passenger/orders', json={
+                'pickup_address': 'A', 'destination_address': 'B',
+                'pickup_lat': plat, 'pickup_lng': plng,
+                'destination_lat': plat + 0.01, 'destination_lng': plng + 0.01,
+            })
+            if r.status_code != 201:
+                continue
+            order_id = r.get_json()['order_id']
+            p['order_id'] = order_id
+            if rng.random() < args.cancel_rate:
+                rec.call('cancel_order', p['http'].post, f'/api/passenger/orders/{order_id}/cancel')
+                cancelled.add(order_id)
+                continue
+            waiting[order_id] = t0
+            drain_driver_events()
+            rec.call('get_order', p['http'].get, f'/api/passenger/orders/{order_id}')
+
+        # Смена водителей на линии
+        for d in rng.sample(drivers, int(len(drivers) * args.churn)):
+            endpoint = '/api/driver/offline' if d['online'] else '/api/driver/online'
+            rec.call('driver_offline' if d['online'] else 'driver_online', d['http'].post, endpoint)
+            d['online'] = not d['online']
+
+        # Дожидаемся заказов, ушедших в backlog/пакет
+        deadline = time.perf_counter() + args.batch_window + 2.0
+        while waiting and time.perf_counter() < deadline:
+            if not drain_driver_events():
+                time.sleep(0.005)
+        for d in drivers:
+            if not d['online']:
+                rec.call('driver_online', d['http'].post, '/api/driver/online')
+                d['online'] = True
+        drain_driver_events()
+    scenario_seconds = time.perf_counter() - t_start
+
+    poller = passengers[0]['http']
+    t0 = time.perf_counter()
+    for _ in range(args.queue_polls):
+        rec.call('queue', poller.get, '/api/queue')
+    queue_seconds = time.perf_counter() - t0
+
+    threads = threading.enumerate()
+    result = {
+        'config': {k: v for k, v in vars(args).items() if k not in ('baseline', 'out')},
+        'scenario_seconds': round(scenario_seconds, 3),
+        'delivery_latency_ms': _summary(delivery_ms),
+        'undelivered_orders': len(waiting),
+        'queue_rps': round(args.queue_polls / queue_seconds, 1),
+        'endpoints': rec.report(),
+        'threads': {
+            'before': threads_before,
+            'after': len(threads),
+            'names': sorted({t.name.split('-')[0] if t.name.startswith('Thread-') else t.name for t in threads}),
+        },
+        'stats': taxi_app.app.test_client().get('/api/stats').get_json(),
+    }
+    for d in drivers:
+        d['sio'].disconnect()
+    taxi_app.order_timers.stop()
+    taxi_app.dispatcher.stop()
+    return result
+
+
+def compare(result, baseline):
+    """Отношение текущих значений к базовому прогону (<1 — стало быстрее/меньше)."""
+    def ratio(new, old):
+        return round(new / old, 3) if old else None
+    out = {}
+    for key in ('p50', 'p95', 'p99'):
+        out[f'delivery_{key}'] = ratio(result['delivery_latency_ms'].get(key, 0),
+                                       baseline['delivery_latency_ms'].get(key, 0))
+    out['queue_rps'] = ratio(result['queue_rps'], baseline['queue_rps'])
+    for name, stats in result['endpoints'].items():
+        old = baseline['endpoints'].get(name)
+        if old:
+            out[f'{name}_p95_ms'] = ratio(stats['p95_ms'], old['p95_ms'])
+            out[f'{name}_queries'] = ratio(stats['queries_per_request'], old['queries_per_request'])
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--drivers', type=int, default=50)
+    parser.add_argument('--passengers', type=int, default=80)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--cancel-rate', type=float, default=0.1)
+    parser.add_argument('--reject-rate', type=float, default=0.1)
+    parser.add_argument('--churn', type=float, default=0.1, help='доля водителей, уходящих с линии за раунд')
+    parser.add_argument('--queue-polls', type=int, default=2000)
+    parser.add_argument('--policy', choices=['queue', 'nearest'], default='queue')
+    parser.add_argument('--batch-window', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--out', help='записать JSON в файл')
+    parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+    args = parser.parse_args()
+
+    result = run(args)
+    if args.baseline:
+        with open(args.baseline) as f:
+            result['vs_baseline'] = compare(result, json.load(f))
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
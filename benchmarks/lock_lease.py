@@ -0,0 +1,76 @@
+"""Проверка аренд в координаторе: блокировка диспетчера продлевается, пока взята; чужую аренду не снять.
+
+    python benchmarks/lock_lease.py
+
+Без Redis: поднимается benchmarks/resp_server.py. Два экземпляра RespCoordination — как два воркера.
+1) Первый держит блокировку в три раза дольше ttl — второй все это время не может ее взять.
+2) После выхода из блока второй берет блокировку сразу.
+3) Аренда упавшего воркера (блокировка взята без lock(), никто не продлевает) истекает через ttl.
+4) Водитель переподключился ко второму воркеру раньше, чем первый обработал отключение:
+   release первого не снимает ключ присутствия, который уже отметил второй.
+Код возврата 1 — какая-то проверка не прошла.
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from coordination import RespCoordination  # noqa: E402
+from resp_server import RespServer  # noqa: E402
+
+TTL = 0.3
+
+results = []
+
+
+def check(name, ok):
+    results.append((name, bool(ok)))
+
+
+def main():
+    server = RespServer()
+    url = server.start()
+    a = RespCoordination(url, lock_ttl=TTL)
+    b = RespCoordination(url, lock_ttl=TTL)
+
+    with a.lock('dispatch'):
+        taken = []
+        deadline = time.monotonic() + TTL * 3
+        while time.monotonic() < deadline:
+            token = b.try_lock('dispatch', TTL)
+            if token is not None:
+                taken.append(token)
+                b.unlock('dispatch', token)
+            time.sleep(TTL / 10)
+        check('lock held past its ttl is not taken by another worker', not taken)
+    token = b.try_lock('dispatch', TTL)
+    check('lock released on exit is free at once', token is not None)
+    if token is not None:
+        b.unlock('dispatch', token)
+
+    a.try_lock('crashed', TTL)
+    time.sleep(TTL * 1.5)
+    check('lease of a crashed holder expires', b.try_lock('crashed', TTL) is not None)
+
+    a.touch('presence:1', 10)
+    b.touch('presence:1', 10)
+    a.release('presence:1')
+    check('release keeps a key taken over by another worker', b.held(['presence:1']) == {'presence:1'})
+    b.release('presence:1')
+    check('release by the owner deletes the key', not a.held(['presence:1']))
+
+    a.stop()
+    b.stop()
+    server.shutdown()
+    failed = 0
+    for name, ok in results:
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+        failed += not ok
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
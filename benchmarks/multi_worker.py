@@ -0,0 +1,133 @@
+"""Проверка координации двух воркеров через COORDINATION_URL (без Redis: поднимается benchmarks/resp_server.py).
+
+Два процесса с общей SQLite-БД, как два воркера gunicorn. Водитель подключен по Socket.IO
+к воркеру B и выходит на линию там же; пассажир подключен к воркеру A и заказывает там же.
+Проверяется, что очередь, изменившаяся в B, видна в A, что new_order из A доходит до
+водителя в B, а order_accepted и driver_location из B — до пассажира в A.
+
+    python benchmarks/multi_worker.py
+
+Код возврата 1 — какое-то событие не дошло до клиента другого воркера.
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from resp_server import RespServer  # noqa: E402
+
+
+def _import_app(db_path, url):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + db_path
+    os.environ['COORDINATION_URL'] = url
+    os.environ['GEOCODE_CACHE_PATH'] = ''
+    os.environ['LOCATION_FORWARD_INTERVAL_SECONDS'] = '0.2'
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import app as taxi_app
+    # Тестовый клиент Flask-SocketIO отказывается работать с очередью сообщений (из-за ack-колбэков);
+    # здесь нужны только emit, поэтому проверку отключаем
+    import flask_socketio.test_client
+    flask_socketio.test_client.PubSubManager = type('NoMessageQueue', (), {})
+    return taxi_app
+
+
+def _wait_event(sock, name, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for e in sock.get_received():
+            if e['name'] == name:
+                return e['args'][0]
+        time.sleep(0.05)
+    return None
+
+
+def _passenger_worker(db_path, url, steps, results):
+    """Воркер A: пассажир."""
+    taxi_app = _import_app(db_path, url)
+    taxi_app.init_db()
+    c = taxi_app.app.test_client()
+    c.post('/api/register', json={'username': 'passenger', 'phone': '+20000001', 'role': 'passenger'})
+    sock = taxi_app.socketio.test_client(taxi_app.app, flask_test_client=c)
+    steps['passenger_ready'].set()
+
+    steps['driver_online'].wait(10)
+    deadline = time.monotonic() + 5
+    while taxi_app.driver_queue.snapshot()['count'] != 1 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    results.put(('queue seen by the other worker', c.get('/api/queue').get_json()['count'] == 1))
+
+    sock.get_received()
+    r = c.post('/api/passenger/orders', json={
+        'pickup_address': 'A', 'destination_address': 'B',
+        'pickup_lat': 46.63, 'pickup_lng': 31.1, 'destination_lat': 46.64, 'destination_lng': 31.11,
+    })
+    results.put(('order assigned across workers', r.status_code == 201 and r.get_json()['status'] == 'assigned'))
+    results.put(('order_assigned to the local passenger', _wait_event(sock, 'order_assigned') is not None))
+    steps['order_created'].set()
+
+    results.put(('order_accepted from the other worker', _wait_event(sock, 'order_accepted') is not None))
+    results.put(('driver_location from the other worker', _wait_event(sock, 'driver_location') is not None))
+    steps['done'].set()
+    sock.disconnect()
+    taxi_app.dispatcher.stop()
+
+
+def _driver_worker(db_path, url, steps, results):
+    """Воркер B: водитель."""
+    taxi_app = _import_app(db_path, url)
+    steps['passenger_ready'].wait(10)
+    c = taxi_app.app.test_client()
+    c.post('/api/register', json={'username': 'driver', 'phone': '+10000001', 'role': 'driver'})
+    sock = taxi_app.socketio.test_client(taxi_app.app, flask_test_client=c)
+    r = c.post('/api/driver/online')
+    results.put(('driver online', r.status_code == 200))
+    steps['driver_online'].set()
+
+    steps['order_created'].wait(10)
+    new_order = _wait_event(sock, 'new_order')
+    results.put(('new_order from the other worker', new_order is not None))
+    if new_order is not None:
+        r = c.post(f"/api/driver/orders/{new_order['order_id']}/accept")
+        results.put(('accepted', r.status_code == 200))
+        sock.emit('driver_location', {'lat': 46.631, 'lng': 31.101})
+    steps['done'].wait(10)
+    sock.disconnect()
+    taxi_app.dispatcher.stop()
+
+
+def main():
+    server = RespServer()
+    url = server.start()
+    db_path = tempfile.mktemp(prefix='taxi-multi-', suffix='.db')
+
+    ctx = multiprocessing.get_context('spawn')
+    steps = {name: ctx.Event() for name in ('passenger_ready', 'driver_online', 'order_created', 'done')}
+    results = ctx.Queue()
+    procs = [ctx.Process(target=_passenger_worker, args=(db_path, url, steps, results)),
+             ctx.Process(target=_driver_worker, args=(db_path, url, steps, results))]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+    server.shutdown()
+
+    failed = 0
+    while not results.empty():
+        name, ok = results.get()
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+        failed += not ok
+    for p in procs:
+        if p.exitcode != 0:
+            print(f'FAIL worker exit code {p.exitcode}')
+            failed += 1
+    os.remove(db_path)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
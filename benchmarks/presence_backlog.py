@@ -0,0 +1,94 @@
+"""Проверка: водитель, снова вышедший на связь, забирает заказы, ждавшие в backlog.
+
+    python benchmarks/presence_backlog.py
+
+1) Водитель на линии теряет соединение; заказ, созданный в это время, его пропускает и ждет
+   в backlog; после переподключения водителя заказ назначается ему без других событий.
+2) Как после перезапуска: водитель на линии без соединения (rebuild_driver_queue ждет его
+   присутствия), заказ ждет в backlog и назначается, когда водитель подключается.
+Код возврата 1 — какая-то проверка не прошла.
+"""
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DB_PATH = tempfile.mktemp(prefix='taxi-presence-backlog-', suffix='.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_PATH
+os.environ['GEOCODE_CACHE_PATH'] = ''
+os.environ['PRESENCE_TRACKING'] = '1'
+sys.path.insert(0, ROOT)
+
+import app as taxi_app  # noqa: E402
+
+results = []
+
+
+def check(name, ok):
+    results.append((name, bool(ok)))
+
+
+def _order_status(order_id, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        with taxi_app.app.app_context():
+            status = taxi_app.Order.query.get(order_id).status.value
+        if status != 'pending' or time.monotonic() >= deadline:
+            return status
+        time.sleep(0.05)
+
+
+def _client(username, phone, role):
+    c = taxi_app.app.test_client()
+    c.post('/api/register', json={'username': username, 'phone': phone, 'role': role})
+    return c
+
+
+def _new_order(passenger):
+    r = passenger.post('/api/passenger/orders', json={'pickup_address': 'A', 'destination_address': 'B'})
+    return r.get_json()['order_id']
+
+
+def reconnect(passenger):
+    driver = _client('d1', '+10000001', 'driver')
+    sock = taxi_app.socketio.test_client(taxi_app.app, flask_test_client=driver)
+    driver.post('/api/driver/online')
+    sock.disconnect()
+    order_id = _new_order(passenger)
+    check('order waits while the driver is unreachable', _order_status(order_id, timeout=0.3) == 'pending')
+    sock = taxi_app.socketio.test_client(taxi_app.app, flask_test_client=driver)
+    check('order assigned after the driver reconnects', _order_status(order_id) == 'assigned')
+    check('backlog drained', len(taxi_app.order_backlog) == 0)
+    sock.disconnect()
+
+
+def after_restart(passenger):
+    driver = _client('d2', '+10000002', 'driver')
+    driver.post('/api/driver/online')  # Без соединения — как водитель из rebuild_driver_queue
+    order_id = _new_order(passenger)
+    check('order waits for the expected driver', _order_status(order_id, timeout=0.3) == 'pending')
+    sock = taxi_app.socketio.test_client(taxi_app.app, flask_test_client=driver)
+    check('order assigned once the expected driver connects', _order_status(order_id) == 'assigned')
+    sock.disconnect()
+
+
+def main():
+    taxi_app.init_db()
+    passenger = _client('p', '+20000001', 'passenger')
+    try:
+        reconnect(passenger)
+        after_restart(passenger)
+    finally:
+        taxi_app.dispatcher.stop()
+    failed = 0
+    for name, ok in results:
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+        failed += not ok
+    os.remove(DB_PATH)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
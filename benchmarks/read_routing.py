@@ -0,0 +1,162 @@
+"""Смешанная нагрузка чтение/запись: GET-обработчики через основной движок против движка чтения.
+
+    python benchmarks/read_routing.py --readers 8 --writers 2 --seconds 10
+
+Один и тот же набор данных (пассажиры с историей заказов) копируется для каждого режима; режим
+задается переменными окружения до импорта приложения, поэтому каждый прогон — отдельный процесс:
+  primary — DB_READ_ROUTING=0, все запросы через основной пул;
+  read    — DB_READ_ROUTING=1, GET через пул читателя WAL того же файла SQLite;
+  replica — DATABASE_READ_URL на тот же файл (как реплика без отставания) с окном устаревшести.
+Читатели крутят GET /api/passenger/orders/<id>, историю и /api/user/current; писатели создают
+и отменяют заказы. Результат — строки JSON: чтения и записи в секунду, p50/p95 задержки.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    'primary': {'DB_READ_ROUTING': '0'},
+    'read': {'DB_READ_ROUTING': '1'},
+    'replica': {'DB_READ_ROUTING': '1', 'DATABASE_READ_URL': None, 'DB_READ_MAX_STALENESS_SECONDS': '1'},
+}
+
+
+def _import_app(db_path, env):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + db_path
+    os.environ['GEOCODE_CACHE_PATH'] = ''
+    os.environ['PRESENCE_TRACKING'] = '0'
+    for key, value in env.items():
+        os.environ[key] = 'sqlite:///' + db_path if value is None else value
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import app as taxi_app
+    return taxi_app
+
+
+def _seed(db_path, passengers, orders_each):
+    taxi_app = _import_app(db_path, MODES['primary'])
+    taxi_app.init_db()
+    from datetime import datetime, timedelta
+    from sqlalchemy import insert
+    User, Order, UserRole, OrderStatus = taxi_app.User, taxi_app.Order, taxi_app.UserRole, taxi_app.OrderStatus
+    now = datetime.utcnow()
+    with taxi_app.app.app_context():
+        conn = taxi_app.db.session.connection()
+        conn.execute(insert(User.__table__), [
+            {'username': f'p{i}', 'phone': f'+2{i:07d}', 'role': UserRole.PASSENGER, 'is_active': True,
+             'is_online': False, 'created_at': now} for i in range(passengers)])
+        conn.execute(insert(Order.__table__), [
+            {'passenger_id': p + 1, 'pickup_address': 'A', 'destination_address': 'B',
+             'status': OrderStatus.COMPLETED, 'price': 100.0,
+             'created_at': now - timedelta(hours=n), 'completed_at': now - timedelta(hours=n)}
+            for p in range(passengers) for n in range(orders_each)])
+        taxi_app.db.session.commit()
+    taxi_app.dispatcher.stop()
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 2)
+
+
+def _run(mode, db_path, readers, writers, seconds, passengers, out):
+    taxi_app = _import_app(db_path, MODES[mode])
+    stop = threading.Event()
+    reads, writes, errors = [], [], []
+
+    def login(i):
+        c = taxi_app.app.test_client()
+        c.post('/api/login', json={'username': f'p{i}'})
+        return c
+
+    def reader(n):
+        rng = random.Random(n)
+        c = login(n % passengers)
+        own = [o['order_id'] for o in c.get('/api/passenger/orders?limit=50').get_json()['orders']]
+        while not stop.is_set():
+            url = rng.choice((f'/api/passenger/orders/{rng.choice(own)}', '/api/passenger/orders?limit=20',
+                              '/api/user/current'))
+            started = time.perf_counter()
+            r = c.get(url)
+            reads.append(time.perf_counter() - started)
+            if r.status_code != 200:
+                errors.append(r.status_code)
+
+    def writer(n):
+        c = login(passengers - 1 - n)
+        while not stop.is_set():
+            started = time.perf_counter()
+            r = c.post('/api/passenger/orders', json={'pickup_address': 'A', 'destination_address': 'B'})
+            if r.status_code == 201:
+                c.post(f"/api/passenger/orders/{r.get_json()['order_id']}/cancel")
+            else:
+                errors.append(r.status_code)
+            writes.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    threads += [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    taxi_app.dispatcher.stop()
+    out.put({
+        'mode': mode,
+        'read_engine': taxi_app.read_engine is not None,
+        'reads_per_s': round(len(reads) / seconds, 1),
+        'writes_per_s': round(len(writes) / seconds, 1),
+        'read_p50_ms': _percentile(reads, 0.5),
+        'read_p95_ms': _percentile(reads, 0.95),
+        'write_p50_ms': _percentile(writes, 0.5),
+        'write_p95_ms': _percentile(writes, 0.95),
+        'read_mean_ms': round(statistics.mean(reads) * 1000, 2) if reads else None,
+        'errors': len(errors),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--passengers', type=int, default=200)
+    parser.add_argument('--orders-each', type=int, default=200)
+    parser.add_argument('--modes', default='primary,read,replica')
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    workdir = tempfile.mkdtemp(prefix='taxi-read-routing-')
+    seed_path = os.path.join(workdir, 'seed.db')
+    p = ctx.Process(target=_seed, args=(seed_path, args.passengers, args.orders_each))
+    p.start()
+    p.join()
+    out = ctx.Queue()
+    try:
+        for mode in args.modes.split(','):
+            db_path = os.path.join(workdir, f'{mode}.db')
+            shutil.copy(seed_path, db_path)
+            p = ctx.Process(target=_run, args=(mode, db_path, args.readers, args.writers, args.seconds,
+                                               args.passengers, out))
+            p.start()
+            p.join()
+            print(json.dumps(out.get(timeout=5)))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+"""Локальный сервер с протоколом Redis (RESP2) — замена Redis для проверки COORDINATION_URL без внешних зависимостей.
+
+Поддерживает только то, что нужно coordination.py и RespManager: строки с TTL, INCR, списки,
+MGET/EXISTS/DEL, WATCH/MULTI/EXEC и PUBLISH/SUBSCRIBE. Все команды выполняются под одной
+блокировкой, поэтому MULTI … EXEC атомарны, как в Redis. Данные только в памяти.
+
+    python benchmarks/resp_server.py --port 6390
+    COORDINATION_URL=redis://127.0.0.1:6390/0 gunicorn ...
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+
+class RespError(Exception):
+    pass
+
+
+class _Store:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}  # key -> (value, expires_at или None)
+        self.versions = {}  # key -> счетчик изменений (для WATCH)
+        self.channels = {}  # channel -> set(handler)
+
+    def get(self, key):
+        item = self.data.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= time.monotonic():
+            self.delete(key)
+            return None
+        return item[0]
+
+    def set(self, key, value, ttl_ms=None):
+        self.data[key] = (value, time.monotonic() + ttl_ms / 1000 if ttl_ms else None)
+        self.touch(key)
+
+    def delete(self, key):
+        existed = self.data.pop(key, None) is not None
+        self.touch(key)
+        return existed
+
+    def touch(self, key):
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def version(self, key):
+        self.get(key)  # истекший ключ — тоже изменение
+        return self.versions.get(key, 0)
+
+
+def _int(value):
+    try:
+        return int(value)
+    except ValueError:
+        raise RespError('ERR value is not an integer or out of range') from None
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    store = None
+
+    def setup(self):
+        super().setup()
+        self.write_lock = threading.Lock()
+        self.watched = {}
+        self.queued = None
+        self.subscriptions = set()
+
+    def finish(self):
+        with self.store.lock:
+            for channel in self.subscriptions:
+                self.store.channels.get(channel, set()).discard(self)
+        super().finish()
+
+    # --- протокол ---
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(size + 2)[:-2])
+        return args
+
+    def encode(self, value):
+        if value is None:
+            return b'$-1\r\n'
+        if isinstance(value, RespError):
+            return b'-%s\r\n' % str(value).encode()
+        if isinstance(value, bool):
+            return b':%d\r\n' % value
+        if isinstance(value, int):
+            return b':%d\r\n' % value
+        if isinstance(value, str):
+            return b'+%s\r\n' % value.encode()
+        if isinstance(value, bytes):
+            return b'$%d\r\n%s\r\n' % (len(value), value)
+        if isinstance(value, list):
+            return b'*%d\r\n' % len(value) + b''.join(self.encode(v) for v in value)
+        raise TypeError(value)
+
+    def write(self, value):
+        with self.write_lock:
+            self.wfile.write(self.encode(value))
+            self.wfile.flush()
+
+    def handle(self):
+        while True:
+            try:
+                args = self.read_command()
+            except (OSError, ValueError):
+                return
+            if args is None:
+                return
+            if not args:
+                continue
+            name = args[0].decode().upper()
+            try:
+                reply = self.dispatch(name, args[1:])
+            except RespError as e:
+                reply = e
+            try:
+                self.write(reply)
+            except OSError:
+                return
+
+    # --- команды ---
+
+    def dispatch(self, name, args):
+        if name in ('MULTI', 'EXEC', 'DISCARD', 'WATCH', 'UNWATCH', 'SUBSCRIBE', 'PUBLISH'):
+            return getattr(self, 'cmd_' + name.lower())(args)
+        if self.queued is not None:
+            self.queued.append((name, args))
+            return 'QUEUED'
+        with self.store.lock:
+            return self.execute(name, args)
+
+    def execute(self, name, args):
+        method = getattr(self, 'cmd_' + name.lower(), None)
+        if method is None:
+            raise RespError(f"ERR unknown command '{name}'")
+        return method(args)
+
+    def cmd_ping(self, args):
+        return args[0] if args else 'PONG'
+
+    def cmd_select(self, args):
+        return 'OK'
+
+    def cmd_auth(self, args):
+        return 'OK'
+
+    def cmd_flushall(self, args):
+        for key in list(self.store.data):
+            self.store.delete(key)
+        return 'OK'
+
+    def cmd_get(self, args):
+        value = self.store.get(args[0])
+        if isinstance(value, list):
+            raise RespError('WRONGTYPE Operation against a key holding the wrong kind of value')
+        return value
+
+    def cmd_set(self, args):
+        key, value, opts = args[0], args[1], [a.upper() for a in args[2:]]
+        ttl_ms = None
+        if b'PX' in opts:
+            ttl_ms = _int(args[2 + opts.index(b'PX') + 1])
+        elif b'EX' in opts:
+            ttl_ms = _int(args[2 + opts.index(b'EX') + 1]) * 1000
+        if b'NX' in opts and self.store.get(key) is not None:
+            return None
+        if b'XX' in opts and self.store.get(key) is None:
+            return None
+        self.store.set(key, value, ttl_ms)
+        return 'OK'
+
+    def cmd_del(self, args):
+        return sum(self.store.delete(k) for k in args if self.store.get(k) is not None)
+
+    def cmd_exists(self, args):
+        return sum(1 for k in args if self.store.get(k) is not None)
+
+    def cmd_mget(self, args):
+        return [v if isinstance(v, bytes) else None for v in map(self.store.get, args)]
+
+    def cmd_incr(self, args):
+        value = _int(self.store.get(args[0]) or 0) + 1
+        self.store.set(args[0], str(value).encode())
+        return value
+
+    def _list(self, key):
+        value = self.store.get(key)
+        if value is not None and not isinstance(value, list):
+            raise RespError('WRONGTYPE Operation against a key holding the wrong kind of value')
+        return value or []
+
+    def cmd_rpush(self, args):
+        items = self._list(args[0]) + list(args[1:])
+        self.store.set(args[0], items)
+        return len(items)
+
+    def cmd_lrem(self, args):
+        items = self._list(args[0])
+        count = _int(args[1])
+        kept, removed = [], 0
+        for item in items:
+            if item == args[2] and (count == 0 or removed < abs(count)):
+                removed += 1
+            else:
+                kept.append(item)
+        if kept:
+            self.store.set(args[0], kept)
+        else:
+            self.store.delete(args[0])
+        return removed
+
+    def cmd_lrange(self, args):
+        items = self._list(args[0])
+        start, stop = _int(args[1]), _int(args[2])
+        stop = len(items) if stop == -1 else stop + 1
+        return items[start:stop]
+
+    # --- транзакции ---
+
+    def cmd_watch(self, args):
+        with self.store.lock:
+            for key in args:
+                self.watched[key] = self.store.version(key)
+        return 'OK'
+
+    def cmd_unwatch(self, args):
+        self.watched = {}
+        return 'OK'
+
+    def cmd_multi(self, args):
+        self.queued = []
+        return 'OK'
+
+    def cmd_discard(self, args):
+        self.queued = None
+        self.watched = {}
+        return 'OK'
+
+    def cmd_exec(self, args):
+        if self.queued is None:
+            raise RespError('ERR EXEC without MULTI')
+        queued, self.queued = self.queued, None
+        watched, self.watched = self.watched, {}
+        with self.store.lock:
+            if any(self.store.version(k) != v for k, v in watched.items()):
+                return None
+            results = []
+            for name, cmd_args in queued:
+                try:
+                    results.append(self.execute(name, cmd_args))
+                except RespError as e:
+                    results.append(e)
+            return results
+
+    # --- pub/sub ---
+
+    def cmd_subscribe(self, args):
+        with self.store.lock:
+            for channel in args:
+                self.store.channels.setdefault(channel, set()).add(self)
+                self.subscriptions.add(channel)
+        for n, channel in enumerate(args[:-1], 1):
+            self.write([b'subscribe', channel, len(self.subscriptions) - len(args) + n])
+        return [b'subscribe', args[-1], len(self.subscriptions)]
+
+    def cmd_publish(self, args):
+        channel, message = args
+        with self.store.lock:
+            receivers = list(self.store.channels.get(channel, ()))
+        delivered = 0
+        for handler in receivers:
+            try:
+                handler.write([b'message', channel, message])
+                delivered += 1
+            except OSError:
+                pass
+        return delivered
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        handler = type('Handler', (_Handler,), {'store': _Store()})
+        super().__init__((host, port), handler)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'redis://{host}:{port}/0'
+
+    def start(self):
+        """Обслуживать в фоновом потоке (для бенчмарков); вернуть URL для COORDINATION_URL."""
+        threading.Thread(target=self.serve_forever, name='resp-server', daemon=True).start()
+        return self.url
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6390)
+    args = parser.parse_args()
+    server = RespServer(args.host, args.port)
+    print(f'Listening on {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
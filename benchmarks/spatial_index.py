@@ -0,0 +1,73 @@
+"""Бенчмарк поиска ближайших водителей: GridIndex против линейного перебора.
+
+    python benchmarks/spatial_index.py --drivers 100 1000 10000 --queries 2000
+
+Заодно сверяет результаты индекса с перебором (код возврата 1 при расхождении).
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geo import GridIndex, haversine_km  # noqa: E402
+
+# Примерно город размером 20×20 км
+CENTER = (46.63, 31.10)
+SPAN_DEG = 0.09
+
+
+def _random_point(rng):
+    return (CENTER[0] + rng.uniform(-SPAN_DEG, SPAN_DEG), CENTER[1] + rng.uniform(-SPAN_DEG, SPAN_DEG) * 1.4)
+
+
+def run(n_drivers, n_queries, k, radius_km, seed=1):
+    rng = random.Random(seed)
+    index = GridIndex(cell_km=0.5)
+    points = {}
+    for driver_id in range(n_drivers):
+        lat, lng = _random_point(rng)
+        points[driver_id] = (lat, lng)
+        index.update(driver_id, lat, lng)
+    queries = [_random_point(rng) for _ in range(n_queries)]
+
+    t0 = time.perf_counter()
+    indexed = [index.nearest(lat, lng, k=k, max_km=radius_km) for lat, lng in queries]
+    t_index = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    linear = []
+    for lat, lng in queries:
+        found = [(haversine_km(lat, lng, plat, plng), d) for d, (plat, plng) in points.items()]
+        linear.append(sorted(x for x in found if x[0] <= radius_km)[:k])
+    t_linear = time.perf_counter() - t0
+
+    mismatches = sum(1 for a, b in zip(indexed, linear) if [d for _, d in a] != [d for _, d in b])
+    return {
+        'drivers': n_drivers,
+        'index_us_per_query': round(t_index / n_queries * 1e6, 1),
+        'linear_us_per_query': round(t_linear / n_queries * 1e6, 1),
+        'mismatches': mismatches,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--drivers', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('-k', type=int, default=5)
+    parser.add_argument('--radius-km', type=float, default=3.0)
+    args = parser.parse_args()
+
+    failed = False
+    for n in args.drivers:
+        r = run(n, args.queries, args.k, args.radius_km)
+        failed = failed or r['mismatches'] > 0
+        print(r)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
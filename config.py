@@ -5,7 +5,121 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///taxi.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Пул соединений (для SQLite в памяти не используется)
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '10'))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '20'))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '30'))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '1800'))  # Только для серверных БД
+    # SQLite: WAL + synchronous=NORMAL, ожидание блокировки и mmap (см. database.py)
+    SQLITE_WAL = os.environ.get('SQLITE_WAL', '1') == '1'
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+    # Чтение в GET-обработчиках — через отдельный пул: реплика DATABASE_READ_URL или, без нее, читатель WAL
+    # того же файла SQLite. С репликой пользователь, чьи данные менялись за DB_READ_MAX_STALENESS_SECONDS,
+    # читает из основной БД. DB_READ_ROUTING=0 — все через основную
+    DB_READ_ROUTING = os.environ.get('DB_READ_ROUTING', '1') == '1'
+    DATABASE_READ_URL = os.environ.get('DATABASE_READ_URL', '')
+    DB_READ_MAX_STALENESS_SECONDS = float(os.environ.get('DB_READ_MAX_STALENESS_SECONDS', '5'))
     ORDER_TIMEOUT_SECONDS = 60  # 1 минута на принятие заказа
+    # Отказ водителя (reject/таймаут) действует столько, потом заказ снова могут предложить ему (0 — бессрочно)
+    ORDER_DECLINE_TTL_SECONDS = float(os.environ.get('ORDER_DECLINE_TTL_SECONDS', '300'))
+    # Политика назначения: 'queue' — строго по очереди, 'nearest' — ближайший свободный
+    # водитель в радиусе DISPATCH_RADIUS_KM, иначе по очереди
+    DISPATCH_POLICY = os.environ.get('DISPATCH_POLICY', 'queue')
+    DISPATCH_RADIUS_KM = float(os.environ.get('DISPATCH_RADIUS_KM', '3'))
+    DISPATCH_NEAREST_CANDIDATES = 5
+    # Окно пакетного назначения новых заказов, сек (0 — выключено, каждый заказ назначается сразу)
+    DISPATCH_BATCH_WINDOW_SECONDS = float(os.environ.get('DISPATCH_BATCH_WINDOW_SECONDS', '0'))
+    # Диспетчер (dispatcher.py): очередь команд ограничена — при переполнении ответ 503 с Retry-After
+    DISPATCH_QUEUE_SIZE = int(os.environ.get('DISPATCH_QUEUE_SIZE', '1000'))
+    DISPATCH_COMMAND_BATCH_SIZE = 64  # Команд за одно пробуждение (позиции в очереди — одним commit)
+    DISPATCH_RETRY_AFTER_SECONDS = 1
+    # Несколько процессов/узлов (coordination.py): пусто — один процесс, все в памяти; redis://host:port/db —
+    # общая очередь, блокировка диспетчеров, аренда таймеров и рассылка Socket.IO через Redis (или сервер с его протоколом)
+    COORDINATION_URL = os.environ.get('COORDINATION_URL', '')
+    COORDINATION_PREFIX = os.environ.get('COORDINATION_PREFIX', 'taxi:')  # Префикс ключей и каналов
+    COORDINATION_LOCK_TTL_SECONDS = 10  # Аренда блокировки диспетчера (продлевается, пока взята; истекает у упавшего воркера)
+    COORDINATION_LOCK_WAIT_SECONDS = 15  # Дольше аренды: блокировка упавшего воркера успеет истечь; потом ответ 503
+    COORDINATION_LOCK_RETRY_SECONDS = 0.05  # Наибольшая пауза между попытками взять блокировку
+    COORDINATION_TIMER_GRACE_SECONDS = 5  # Аренда таймера заказа живет дольше дедлайна на это время
+    COORDINATION_TIMER_ADOPT_SECONDS = 15  # Как часто воркеры подбирают таймеры пропавших воркеров
+    DRIVER_LOCATION_MAX_AGE_SECONDS = 120  # Координаты старше — не учитываются при поиске ближайшего
+    SPATIAL_CELL_KM = 0.5  # Размер ячейки пространственного индекса водителей
+    # Изменения очереди рассылаются не чаще раза в этот интервал (одной дельтой)
+    QUEUE_BROADCAST_INTERVAL_SECONDS = float(os.environ.get('QUEUE_BROADCAST_INTERVAL_SECONDS', '0.5'))
+    # Присутствие водителей по Socket.IO: водитель без живого соединения не получает заказы,
+    # а через PRESENCE_GRACE_SECONDS снимается с линии. PRESENCE_TRACKING=0 — выключить
+    PRESENCE_TRACKING = os.environ.get('PRESENCE_TRACKING', '1') == '1'
+    PRESENCE_GRACE_SECONDS = float(os.environ.get('PRESENCE_GRACE_SECONDS', '20'))
+    PRESENCE_HEARTBEAT_TIMEOUT_SECONDS = 45  # Клиент шлет heartbeat каждые 15 с
+    PRESENCE_SWEEP_INTERVAL_SECONDS = 5
+    # Профилирование (PROFILE_REQUESTS=1): SQL и коммиты каждого запроса/события, сэмплы стека;
+    # запросы дольше PROFILE_SLOW_MS пишутся в PROFILE_LOG (пусто — только /debug/slow-requests)
+    PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS') == '1'
+    PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', '200'))
+    PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', '5'))
+    PROFILE_LOG = os.environ.get('PROFILE_LOG', 'slow_requests.log')
+    # /metrics и /debug/slow-requests (пути и тайминги запросов) — только с заголовком
+    # Authorization: Bearer <MONITORING_TOKEN>; пусто — эти страницы выключены (404)
+    MONITORING_TOKEN = os.environ.get('MONITORING_TOKEN', '')
+    USER_CACHE_TTL_SECONDS = 300  # Кэш роли/имени пользователя в процессе (сбрасывается при смене роли)
+    # Поток координат водителей (событие driver_location): буфер последних точек на водителя,
+    # пересылка пассажиру не чаще раза в интервал, трек — прореженный и пачками в БД
+    LOCATION_BUFFER_SIZE = 32
+    LOCATION_FORWARD_INTERVAL_SECONDS = float(os.environ.get('LOCATION_FORWARD_INTERVAL_SECONDS', '1'))
+    LOCATION_TRACK_INTERVAL_SECONDS = 10
+    LOCATION_TRACK_MIN_DISTANCE_M = 25
+    LOCATION_TRACK_FLUSH_SECONDS = 5
+    LOCATION_TRACK_MAX_PENDING = 10000
+    # Outbox событий заказа (order_events): рассылка пачками вне запроса, догрузка по GET /api/events?since=N
+    OUTBOX_BATCH_SIZE = 200  # Событий за один проход публикатора
+    OUTBOX_RETRY_SECONDS = 2.0  # Пауза перед повтором, если рассылка упала
+    EVENTS_SINCE_MAX = 200  # Максимум событий в одном ответе /api/events
+    # Архив заказов (archive.py): завершенные и отмененные старше ORDER_ARCHIVE_AFTER_DAYS переносятся
+    # в orders_archive пачками раз в интервал (0 — не архивировать). История — GET /api/{passenger,driver}/orders
+    ORDER_ARCHIVE_AFTER_DAYS = float(os.environ.get('ORDER_ARCHIVE_AFTER_DAYS', '30'))
+    ORDER_ARCHIVE_BATCH_SIZE = 500
+    ORDER_ARCHIVE_INTERVAL_SECONDS = 3600
+    HISTORY_PAGE_SIZE = 20
+    HISTORY_PAGE_MAX = 100
+    # Карта спроса для водителей (demand.py): заказы по ячейкам geohash, недавние — с затуханием, плюс ждущие водителя.
+    # Событие demand_heatmap в комнату drivers — не чаще раза в интервал; также GET /api/demand/heatmap
+    DEMAND_GEOHASH_PRECISION = 6  # ~1.2 × 0.6 км
+    DEMAND_HALF_LIFE_SECONDS = float(os.environ.get('DEMAND_HALF_LIFE_SECONDS', '900'))
+    DEMAND_BROADCAST_INTERVAL_SECONDS = float(os.environ.get('DEMAND_BROADCAST_INTERVAL_SECONDS', '10'))
+    DEMAND_MAX_CELLS = 200  # Самых горячих ячеек в ответе
+    DEMAND_MIN_WEIGHT = 0.05  # Остывшие ячейки не показываются
+    # Условный GET и long-poll (/api/queue, /api/user/current, /api/passenger/orders/<id>): ETag → 304 из памяти,
+    # ?wait=N&since=<version> держит запрос до изменения, но не дольше LONGPOLL_MAX_SECONDS
+    LONGPOLL_MAX_SECONDS = float(os.environ.get('LONGPOLL_MAX_SECONDS', '25'))
+    LONGPOLL_MAX_WAITERS = int(os.environ.get('LONGPOLL_MAX_WAITERS', '200'))  # Каждый ожидающий держит поток
+    LONGPOLL_MAX_ORDERS = 10000  # Заказов в таблице версий (старые вытесняются)
+    # Обратный геокодинг через сервер (/api/geocode/reverse): провайдер 'nominatim' или 'stub' (без сети)
+    GEOCODE_PROVIDER = os.environ.get('GEOCODE_PROVIDER', 'nominatim')
+    GEOCODE_NOMINATIM_URL = os.environ.get('GEOCODE_NOMINATIM_URL', 'https://nominatim.openstreetmap.org/reverse')
+    GEOCODE_USER_AGENT = os.environ.get('GEOCODE_USER_AGENT', 'taxi-app/1.0')  # Nominatim требует User-Agent
+    GEOCODE_LANGUAGE = 'ru'
+    GEOCODE_BUCKET_DECIMALS = 4  # Округление координат: 4 знака — ячейка ~11 м
+    GEOCODE_LRU_SIZE = 20000
+    GEOCODE_CACHE_PATH = os.environ.get('GEOCODE_CACHE_PATH', 'geocode_cache.db')  # Пусто — без кэша на диске
+    GEOCODE_DISK_TTL_DAYS = 30
+    GEOCODE_RATE_PER_SECOND = float(os.environ.get('GEOCODE_RATE_PER_SECOND', '1'))  # Лимит Nominatim — 1 запрос/с
+    GEOCODE_MAX_WAIT_SECONDS = 2.0  # Дольше ждать очереди к провайдеру не стоит — клиент покажет координаты
+    GEOCODE_UPSTREAM_TIMEOUT_SECONDS = 5.0
+    # Тариф: (посадка + за км) · ночной коэффициент + доплата за зоны, не меньше минимума.
+    # Расстояние — по прямой, умноженное на FARE_ROAD_FACTOR (извилистость дорог)
+    FARE_CURRENCY = 'UAH'
+    FARE_BASE = float(os.environ.get('FARE_BASE', '40'))
+    FARE_PER_KM = float(os.environ.get('FARE_PER_KM', '12'))
+    FARE_MINIMUM = float(os.environ.get('FARE_MINIMUM', '60'))
+    FARE_ROAD_FACTOR = float(os.environ.get('FARE_ROAD_FACTOR', '1.3'))
+    FARE_NIGHT_MULTIPLIER = float(os.environ.get('FARE_NIGHT_MULTIPLIER', '1.2'))
+    FARE_NIGHT_START_HOUR = 22
+    FARE_NIGHT_END_HOUR = 6
+    FARE_TIMEZONE = os.environ.get('FARE_TIMEZONE', 'Europe/Kyiv')
+    FARE_ROUNDING = 1.0  # Цена округляется вверх до этого шага
+    FARE_ZONES_PATH = os.environ.get('FARE_ZONES_PATH', '')  # JSON с зонами-многоугольниками и доплатами
+    FARE_ESTIMATE_MAX_ROUTES = 100  # Маршрутов в одном запросе /api/fare/estimate
     SOCKETIO_CORS_ALLOWED_ORIGINS = "*"
     # Ключ API Яндекс.Карт: https://developer.tech.yandex.ru/ — без ключа используется Leaflet (OSM)
     YANDEX_MAPS_API_KEY = os.environ.get('YANDEX_MAPS_API_KEY', 'df6f0239-66a8-4976-9d42-c4292899fec5')
@@ -0,0 +1,562 @@
+"""Координация нескольких процессов (воркеров gunicorn, узлов): общая очередь, блокировка, таймеры, рассылка.
+
+Без COORDINATION_URL приложение работает в одном процессе и LocalCoordination ничего не делает:
+очередь, таймеры и комнаты Socket.IO живут в памяти, как раньше. С COORDINATION_URL=redis://…
+(Redis или любой сервер с тем же протоколом, см. benchmarks/resp_server.py):
+
+- порядок очереди водителей хранится в координаторе, а каждый воркер держит копию в памяти
+  (SharedDriverQueue), поэтому чтения по-прежнему не ходят ни в БД, ни в сеть;
+- диспетчеры воркеров выполняют пачки команд по одной — под общей блокировкой с арендой (lease);
+- таймер заказа заводит тот воркер, что первым взял аренду; аренда истекает, если воркер пропал;
+- изменения кэшей в памяти (версии заказов, отказы, привязка водитель → пассажир) рассылаются
+  остальным воркерам через канал событий, а события Socket.IO — через RespManager.
+
+Клиент RESP минимальный: одно соединение на процесс под блокировкой плюс отдельные для подписок.
+"""
+import json
+import logging
+import pickle
+import random
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from urllib.parse import unquote, urlparse
+
+from socketio import PubSubManager
+
+from queue_state import DriverQueue
+
+logger = logging.getLogger(__name__)
+
+
+class CoordinationError(Exception):
+    """Ошибка в ответе сервера координации."""
+
+
+class LockTimeout(Exception):
+    """Блокировку не удалось взять за отведенное время — клиенту стоит повторить позже."""
+
+
+# --- клиент RESP ---
+
+def _encode(args):
+    out = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if isinstance(arg, bytes):
+            data = arg
+        elif isinstance(arg, str):
+            data = arg.encode()
+        else:
+            data = str(arg).encode()
+        out.append(b'$%d\r\n%s\r\n' % (len(data), data))
+    return b''.join(out)
+
+
+class RespConnection:
+    """Одно TCP-соединение: команды и ответы по протоколу RESP2."""
+
+    def __init__(self, host, port, password=None, db=0, timeout=5.0):
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile('rb')
+        if password:
+            self.execute('AUTH', password)
+        if db:
+            self.execute('SELECT', db)
+
+    def close(self):
+        try:
+            self._file.close()
+            self._sock.close()
+        except OSError:
+            pass
+
+    def settimeout(self, timeout):
+        self._sock.settimeout(timeout)
+
+    def send(self, *commands):
+        self._sock.sendall(b''.join(_encode(c) for c in commands))
+
+    def read(self):
+        line = self._file.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError('Coordination server closed the connection')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            return CoordinationError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            n = int(rest)
+            if n < 0:
+                return None
+            data = self._file.read(n + 2)
+            return data[:-2]
+        if kind == b'*':
+            n = int(rest)
+            return None if n < 0 else [self.read() for _ in range(n)]
+        raise ConnectionError(f'Unexpected RESP reply: {line!r}')
+
+    def execute(self, *args):
+        self.send(args)
+        reply = self.read()
+        if isinstance(reply, CoordinationError):
+            raise reply
+        return reply
+
+    def pipeline(self, *commands):
+        """Отправить команды разом и прочитать все ответы (ошибки возвращаются, а не бросаются)."""
+        self.send(*commands)
+        return [self.read() for _ in commands]
+
+    def transaction(self, *commands):
+        """MULTI … EXEC: результаты команд или None, если транзакция отменена (WATCH)."""
+        replies = self.pipeline(('MULTI',), *commands, ('EXEC',))
+        for reply in replies[:-1]:
+            if isinstance(reply, CoordinationError):
+                raise reply
+        result = replies[-1]
+        if isinstance(result, CoordinationError):
+            raise result
+        if result is not None:
+            for reply in result:
+                if isinstance(reply, CoordinationError):
+                    raise reply
+        return result
+
+
+class RespClient:
+    """Общее соединение процесса; при обрыве переподключается на следующей команде."""
+
+    def __init__(self, url, timeout=5.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def connect(self, timeout=None):
+        return RespConnection(self.host, self.port, self.password, self.db, timeout or self.timeout)
+
+    @contextmanager
+    def connection(self):
+        """Соединение в монопольное пользование (несколько команд подряд, WATCH)."""
+        with self._lock:
+            if self._conn is None:
+                self._conn = self.connect()
+            try:
+                yield self._conn
+            except (OSError, ConnectionError):
+                self._conn.close()
+                self._conn = None
+                raise
+
+    def execute(self, *args):
+        with self.connection() as conn:
+            return conn.execute(*args)
+
+    def transaction(self, *commands):
+        with self.connection() as conn:
+            return conn.transaction(*commands)
+
+    def listen(self, channels, stop=None):
+        """Сообщения подписки (channel, data) с переподключением; stop — threading.Event для выхода."""
+        delay = 0.5
+        while stop is None or not stop.is_set():
+            conn = None
+            try:
+                conn = self.connect()
+                conn.settimeout(None)
+                conn.send(('SUBSCRIBE', *channels))
+                delay = 0.5
+                while True:
+                    reply = conn.read()
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == b'message':
+                        yield reply[1].decode(), reply[2]
+            except (OSError, ConnectionError):
+                logger.warning('Coordination subscription lost, reconnecting in %.1f s', delay)
+            finally:
+                if conn is not None:
+                    conn.close()
+            if stop is not None and stop.wait(delay):
+                return
+            if stop is None:
+                time.sleep(delay)
+            delay = min(delay * 2, 30)
+
+
+# --- Socket.IO ---
+
+class RespManager(PubSubManager):
+    """Менеджер клиентов python-socketio поверх RESP: emit из любого воркера доходит до клиентов всех воркеров.
+
+    Формат сообщений тот же, что у socketio.RedisManager (pickle), — с ним можно смешивать.
+    """
+    name = 'resp'
+
+    def __init__(self, url, channel='flask-socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self._client = RespClient(url)
+
+    def _publish(self, data):
+        try:
+            return self._client.execute('PUBLISH', self.channel, pickle.dumps(data))
+        except (OSError, ConnectionError):
+            self._get_logger().error('Cannot publish to the coordination server')
+
+    def _listen(self):
+        for _, data in self._client.listen([self.channel]):
+            yield data
+
+
+# --- очередь ---
+
+class SharedDriverQueue:
+    """Очередь водителей в координаторе и ее копия в памяти воркера (тот же интерфейс, что у DriverQueue).
+
+    Чтения идут из копии. Изменения (add/remove/load) выполняются под блокировкой диспетчера:
+    список и версия меняются одной транзакцией, копия перезагружается, остальные воркеры получают
+    событие 'queue' и подтягивают новую версию (sync).
+    """
+
+    def __init__(self, coordination):
+        self._coordination = coordination
+        self._client = coordination.client
+        self._key = coordination.key('queue')
+        self._version_key = coordination.key('queue:version')
+        self._mirror = DriverQueue()
+
+    @property
+    def version(self):
+        return self._mirror.version
+
+    def snapshot(self):
+        return self._mirror.snapshot()
+
+    def wait_for_change(self, since, timeout):
+        return self._mirror.wait_for_change(since, timeout)
+
+    def position(self, driver_id):
+        return self._mirror.position(driver_id)
+
+    def ids(self):
+        return self._mirror.ids()
+
+    def __contains__(self, driver_id):
+        return driver_id in self._mirror
+
+    def __len__(self):
+        return len(self._mirror)
+
+    def _apply(self, version, ids):
+        return self._mirror.load([int(i) for i in ids], version=int(version))
+
+    def sync(self, version=None):
+        """Подтянуть копию, если в координаторе версия новее (version — из события, если известна)."""
+        if version is not None and version <= self._mirror.version:
+            return {}
+        version, ids = self._client.transaction(('GET', self._version_key), ('LRANGE', self._key, 0, -1))
+        if version is None or int(version) <= self._mirror.version:
+            return {}
+        return self._apply(version, ids)
+
+    def _change(self, *commands):
+        _, version, ids = self._client.transaction(*commands, ('INCR', self._version_key), ('LRANGE', self._key, 0, -1))
+        changed = self._apply(version, ids)
+        self._coordination.broadcast('queue', version)
+        return changed
+
+    def load(self, driver_ids):
+        """Восстановление при старте: если очередь уже ведут другие воркеры — взять ее, иначе заполнить."""
+        if self._client.execute('EXISTS', self._version_key):
+            self.sync()
+            return {}
+        driver_ids = list(dict.fromkeys(driver_ids))
+        if not driver_ids:
+            return self._change(('DEL', self._key))
+        _, _, version, ids = self._client.transaction(
+            ('DEL', self._key), ('RPUSH', self._key, *driver_ids),
+            ('INCR', self._version_key), ('LRANGE', self._key, 0, -1))
+        changed = self._apply(version, ids)
+        self._coordination.broadcast('queue', version)
+        return changed
+
+    def add(self, driver_id):
+        if driver_id in self._mirror:
+            return {}
+        return self._change(('RPUSH', self._key, driver_id))
+
+    def remove(self, driver_id):
+        if driver_id not in self._mirror:
+            return {}
+        return self._change(('LREM', self._key, 0, driver_id))
+
+
+# --- координация ---
+
+class LocalCoordination:
+    """Один процесс: все состояние уже в памяти, координировать нечего."""
+
+    shared = False
+
+    def driver_queue(self):
+        return DriverQueue()
+
+    def dispatch_lock(self):
+        return nullcontext()
+
+    def try_lock(self, name, ttl):
+        return True
+
+    def unlock(self, name, token):
+        pass
+
+    def claim(self, key, ttl):
+        return True
+
+    def touch(self, key, ttl):
+        pass
+
+    def release(self, key):
+        pass
+
+    def held(self, keys):
+        """Ключи, которые держат другие процессы (здесь их нет)."""
+        return set()
+
+    def on(self, topic, handler):
+        pass
+
+    def broadcast(self, topic, *args):
+        pass
+
+    def replicated(self, topic, fn):
+        return fn
+
+    def socketio_manager(self):
+        return None
+
+    def start(self):
+        pass
+
+
+class RespCoordination:
+    """Координация через сервер с протоколом Redis (RESP)."""
+
+    shared = True
+
+    def __init__(self, url, prefix='taxi:', lock_ttl=10.0, lock_wait=10.0, lock_retry=0.05):
+        self.url = url
+        self.prefix = prefix
+        self.client = RespClient(url)
+        self.worker_id = uuid.uuid4().hex
+        self.lock_ttl = lock_ttl
+        self.lock_wait = lock_wait
+        self.lock_retry = lock_retry
+        self._handlers = {}
+        self._queue = None
+        self._thread = None
+        self._stop = threading.Event()
+        # Взятые блокировки {token: [name, ttl, когда продлить]} и поток, продлевающий их аренду
+        self._leases = {}
+        self._leases_cond = threading.Condition()
+        self._renewer = None
+
+    def key(self, name):
+        return self.prefix + name
+
+    def driver_queue(self):
+        """Очередь водителей; на событие 'queue' от других воркеров нужно вызывать ее sync(version)."""
+        self._queue = SharedDriverQueue(self)
+        return self._queue
+
+    # --- блокировки и аренды ---
+
+    def try_lock(self, name, ttl):
+        """Взять блокировку с арендой ttl секунд: токен для unlock или None, если занята."""
+        token = uuid.uuid4().hex
+        if self.client.execute('SET', self.key('lock:' + name), token, 'NX', 'PX', int(ttl * 1000)):
+            return token
+        return None
+
+    def _delete_if(self, key, value):
+        """Удалить ключ, только если в нем все еще value (WATCH/GET/MULTI DEL/EXEC)."""
+        with self.client.connection() as conn:
+            conn.execute('WATCH', key)
+            if conn.execute('GET', key) != value.encode():
+                conn.execute('UNWATCH')
+                return
+            conn.transaction(('DEL', key))
+
+    def unlock(self, name, token):
+        """Снять блокировку, только если она все еще наша (аренда могла истечь и перейти другому)."""
+        self._delete_if(self.key('lock:' + name), token)
+
+    def renew(self, name, token, ttl):
+        """Продлить аренду блокировки на ttl секунд, только если она все еще наша: False — уже потеряна."""
+        key = self.key('lock:' + name)
+        with self.client.connection() as conn:
+            conn.execute('WATCH', key)
+            if conn.execute('GET', key) != token.encode():
+                conn.execute('UNWATCH')
+                return False
+            return conn.transaction(('SET', key, token, 'XX', 'PX', int(ttl * 1000))) is not None
+
+    @contextmanager
+    def lock(self, name, ttl=None, wait=None):
+        """Блокировка на время блока; пока она взята, аренда продлевается каждую треть ttl.
+
+        Так долгая пачка команд не теряет блокировку посреди работы, а аренда упавшего воркера
+        по-прежнему истекает через ttl.
+        """
+        ttl = ttl or self.lock_ttl
+        deadline = time.monotonic() + (self.lock_wait if wait is None else wait)
+        delay = self.lock_retry / 10
+        while True:
+            token = self.try_lock(name, ttl)
+            if token is not None:
+                break
+            if time.monotonic() >= deadline:
+                raise LockTimeout(name)
+            time.sleep(delay * random.uniform(0.5, 1.5))
+            delay = min(delay * 2, self.lock_retry)
+        self._hold(name, token, ttl)
+        try:
+            yield
+        finally:
+            with self._leases_cond:
+                self._leases.pop(token, None)
+            self.unlock(name, token)
+
+    def _hold(self, name, token, ttl):
+        with self._leases_cond:
+            self._leases[token] = [name, ttl, time.monotonic() + ttl / 3]
+            if self._renewer is None:
+                self._renewer = threading.Thread(target=self._renew_leases, name='coordination-leases', daemon=True)
+                self._renewer.start()
+            self._leases_cond.notify()
+
+    def _renew_leases(self):
+        while not self._stop.is_set():
+            with self._leases_cond:
+                now = time.monotonic()
+                due = [(token, lease[0], lease[1]) for token, lease in self._leases.items() if lease[2] <= now]
+                if not due:
+                    # Пачки обычно короче трети аренды — тогда поток просто спит до следующей блокировки
+                    wait = min((lease[2] for lease in self._leases.values()), default=now + self.lock_ttl) - now
+                    self._leases_cond.wait(wait)
+                    continue
+            for token, name, ttl in due:
+                try:
+                    renewed = self.renew(name, token, ttl)
+                except (OSError, ConnectionError, CoordinationError):
+                    logger.exception('Cannot renew lock %s', name)
+                    renewed = None
+                with self._leases_cond:
+                    lease = self._leases.get(token)
+                    if lease is None:
+                        continue  # Блокировку уже сняли
+                    if renewed is None:
+                        # Аренда еще не истекла — пробуем снова вскоре, а не через треть ttl
+                        lease[2] = time.monotonic() + min(ttl / 10, 1.0)
+                    elif renewed:
+                        lease[2] = time.monotonic() + ttl / 3
+                    else:
+                        del self._leases[token]
+                        logger.error('Lock %s lease expired while held; another worker may run concurrently', name)
+
+    @contextmanager
+    def dispatch_lock(self):
+        """Пачка команд диспетчера: общая блокировка и свежая копия очереди."""
+        with self.lock('dispatch'):
+            if self._queue is not None:
+                self._queue.sync()
+            yield
+
+    def claim(self, key, ttl):
+        """Аренда ключа на ttl секунд; False — ее держит кто-то другой."""
+        return bool(self.client.execute('SET', self.key(key), self.worker_id, 'NX', 'PX', max(1, int(ttl * 1000))))
+
+    def touch(self, key, ttl):
+        """Продлить аренду ключа и сделать ее своей: присутствие водителя отмечает воркер с его соединением."""
+        self.client.execute('SET', self.key(key), self.worker_id, 'PX', max(1, int(ttl * 1000)))
+
+    def release(self, key):
+        """Снять свою аренду; ключ, который уже взял другой воркер (водитель переподключился к нему,
+        таймер подобран после истечения), не трогаем."""
+        self._delete_if(self.key(key), self.worker_id)
+
+    def held(self, keys):
+        keys = list(keys)
+        if not keys:
+            return set()
+        values = self.client.execute('MGET', *[self.key(k) for k in keys])
+        return {k for k, v in zip(keys, values) if v is not None}
+
+    # --- события между воркерами ---
+
+    def on(self, topic, handler):
+        self._handlers[topic] = handler
+
+    def broadcast(self, topic, *args):
+        message = json.dumps({'origin': self.worker_id, 'topic': topic, 'args': args})
+        try:
+            self.client.execute('PUBLISH', self.key('events'), message)
+        except (OSError, ConnectionError):
+            # Копии в других воркерах догонят состояние по следующему событию или по TTL
+            logger.exception('Coordination broadcast %s failed', topic)
+
+    def replicated(self, topic, fn):
+        """fn(*args) здесь и во всех остальных воркерах (аргументы — JSON)."""
+        self.on(topic, fn)
+
+        def call(*args):
+            fn(*args)
+            self.broadcast(topic, *args)
+        return call
+
+    def socketio_manager(self):
+        return RespManager(self.url, channel=self.key('socketio'))
+
+    def start(self):
+        """Запустить поток, принимающий события остальных воркеров."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._listen, name='coordination', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._leases_cond:
+            self._leases_cond.notify()
+
+    def _listen(self):
+        for _, data in self.client.listen([self.key('events')], stop=self._stop):
+            try:
+                message = json.loads(data)
+                if message['origin'] == self.worker_id:
+                    continue
+                handler = self._handlers.get(message['topic'])
+                if handler is not None:
+                    handler(*message['args'])
+            except Exception:
+                logger.exception('Coordination event handler failed')
+
+
+def create_coordination(config):
+    url = config['COORDINATION_URL']
+    if not url:
+        return LocalCoordination()
+    return RespCoordination(
+        url,
+        prefix=config['COORDINATION_PREFIX'],
+        lock_ttl=config['COORDINATION_LOCK_TTL_SECONDS'],
+        lock_wait=config['COORDINATION_LOCK_WAIT_SECONDS'],
+        lock_retry=config['COORDINATION_LOCK_RETRY_SECONDS'],
+    )
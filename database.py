@@ -0,0 +1,186 @@
+"""Настройка БД: пул соединений, PRAGMA для SQLite, индексы на уже существующих таблицах
+и маршрутизация чтения (GET-обработчики читают через отдельный движок, запись — всегда в основной)."""
+import threading
+import time
+
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.schema import CreateTable
+
+# Ключ движка для чтения в SQLALCHEMY_BINDS и флаг в session.info: читать через него
+READ_BIND = 'read'
+READ_ONLY_KEY = 'read_only'
+
+
+def _is_memory_sqlite(uri):
+    return uri in ('sqlite://', 'sqlite:///') or ':memory:' in uri or 'mode=memory' in uri
+
+
+def engine_options(config, uri=None):
+    """SQLALCHEMY_ENGINE_OPTIONS по настройкам DB_POOL_* / SQLITE_* из Config (uri — по умолчанию основной)."""
+    uri = uri or config['SQLALCHEMY_DATABASE_URI']
+    if uri.startswith('sqlite') and _is_memory_sqlite(uri):
+        # БД в памяти живет в единственном соединении — пул SQLAlchemy выбирает сам
+        return {}
+    options = {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+    }
+    if uri.startswith('sqlite'):
+        # Ожидание блокировки вместо мгновенного «database is locked»
+        options['connect_args'] = {'timeout': config['SQLITE_BUSY_TIMEOUT_MS'] / 1000}
+    else:
+        options['pool_recycle'] = config['DB_POOL_RECYCLE']
+        options['pool_pre_ping'] = True
+    return options
+
+
+def configure_sqlite(engine, config, read_only=False):
+    """PRAGMA на каждое новое соединение SQLite: WAL, synchronous=NORMAL, busy_timeout, mmap.
+
+    В WAL читатели не блокируют писателя и наоборот, поэтому воркеры gunicorn
+    не упираются в общую блокировку файла. synchronous=NORMAL в WAL безопасен для
+    целостности (при сбое питания теряется лишь последняя транзакция).
+    read_only — движок для чтения: режим журнала не трогает, query_only запрещает запись.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = ['PRAGMA busy_timeout=%d' % config['SQLITE_BUSY_TIMEOUT_MS']]
+    if read_only:
+        pragmas.append('PRAGMA query_only=ON')
+    elif config['SQLITE_WAL'] and not _is_memory_sqlite(str(engine.url)):
+        pragmas += ['PRAGMA journal_mode=WAL', 'PRAGMA synchronous=NORMAL']
+    if config['SQLITE_MMAP_SIZE']:
+        pragmas.append('PRAGMA mmap_size=%d' % config['SQLITE_MMAP_SIZE'])
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+
+def ensure_indexes(engine, metadata):
+    """Создать недостающие индексы: create_all() не трогает таблицы, которые уже есть в БД."""
+    with engine.begin() as conn:
+        # Порядок не важен (индексы не зависят друг от друга), а sorted_tables предупреждает о цикле users↔orders
+        for table in metadata.tables.values():
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+
+def drop_indexes(engine, table, names):
+    """Удалить индексы прежних версий схемы, если они еще есть в БД (create_all() их не трогает)."""
+    existing = {index['name'] for index in inspect(engine).get_indexes(table.name)}
+    with engine.begin() as conn:
+        for name in names:
+            if name in existing:
+                conn.exec_driver_sql(f'DROP INDEX {name}')
+
+
+def ensure_order_ids(engine, orders, archive):
+    """id заказов не переиспользуются: в SQLite orders — с AUTOINCREMENT, счетчик не ниже архивных id.
+
+    Без AUTOINCREMENT SQLite выдает новому заказу max(id)+1, и после переноса в архив самого нового
+    заказа его id достался бы следующему. Старая таблица перестраивается (на месте это не поменять).
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+    with engine.begin() as conn:
+        ddl = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                   (orders.name,)).scalar()
+        if ddl is not None and 'AUTOINCREMENT' not in ddl.upper():
+            _rebuild_with_autoincrement(conn, orders)
+        archived = conn.scalar(select(func.max(archive.c.id))) or 0
+        floor = max(conn.scalar(select(func.max(orders.c.id))) or 0, archived)
+        seq = conn.exec_driver_sql('SELECT seq FROM sqlite_sequence WHERE name = ?', (orders.name,)).scalar()
+        if seq is None:
+            conn.exec_driver_sql('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (orders.name, floor))
+        elif seq < floor:
+            conn.exec_driver_sql('UPDATE sqlite_sequence SET seq = ? WHERE name = ?', (floor, orders.name))
+        seq = conn.exec_driver_sql('SELECT seq FROM sqlite_sequence WHERE name = ?', (orders.name,)).scalar()
+        if seq < archived:
+            raise RuntimeError(f'orders id sequence {seq} is behind archived id {archived}')
+
+
+def _rebuild_with_autoincrement(conn, table):
+    # Индексы удаляются вместе со старой таблицей — их заново создаст ensure_indexes
+    rebuilt = table.name + '_rebuild'
+    ddl = str(CreateTable(table).compile(dialect=conn.dialect))
+    columns = ', '.join(c.name for c in table.columns)
+    conn.exec_driver_sql(ddl.replace(f'CREATE TABLE {table.name} ', f'CREATE TABLE {rebuilt} ', 1))
+    conn.exec_driver_sql(f'INSERT INTO {rebuilt} ({columns}) SELECT {columns} FROM {table.name}')
+    conn.exec_driver_sql(f'DROP TABLE {table.name}')
+    conn.exec_driver_sql(f'ALTER TABLE {rebuilt} RENAME TO {table.name}')
+
+
+def read_bind(config):
+    """Запись SQLALCHEMY_BINDS для движка чтения или None (читать из основного).
+
+    DATABASE_READ_URL — реплика; без нее для файла SQLite в WAL — второй пул к тому же файлу
+    (читатель WAL видит каждый commit и не ждет писателя). DB_READ_ROUTING=0 — выключено.
+    """
+    if not config['DB_READ_ROUTING']:
+        return None
+    uri = config['DATABASE_READ_URL']
+    if not uri:
+        primary = config['SQLALCHEMY_DATABASE_URI']
+        if not primary.startswith('sqlite') or _is_memory_sqlite(primary) or not config['SQLITE_WAL']:
+            return None
+        uri = primary
+    return dict(engine_options(config, uri), url=uri)
+
+
+def is_replica(config):
+    """Читаем с реплики (может отставать), а не из того же файла SQLite."""
+    return bool(config['DB_READ_ROUTING'] and config['DATABASE_READ_URL'])
+
+
+class RoutingSession(Session):
+    """Сессия Flask-SQLAlchemy, отправляющая чтение в движок READ_BIND, если в session.info стоит READ_ONLY_KEY.
+
+    Запись туда не попадает никогда: flush, несохраненные изменения и INSERT/UPDATE/DELETE
+    идут в основной движок, даже если обработчик помечен как читающий.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get(READ_ONLY_KEY):
+            reader = self._db.engines.get(READ_BIND)
+            writes = self._flushing or self.new or self.dirty or self.deleted or getattr(clause, 'is_dml', False)
+            if reader is not None and not writes:
+                return reader
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class RecentWriters:
+    """Ограниченная устаревшесть при чтении с реплики: пользователь, чьи данные менялись
+    за последние window секунд, читает из основного движка (реплика могла еще не догнать).
+
+    window=0 — отметки не нужны (читатель WAL того же файла не отстает).
+    """
+
+    def __init__(self, window, max_users=100000):
+        self.window = window
+        self._max_users = max_users
+        self._marks = {}  # user_id -> time.monotonic() последней записи
+        self._lock = threading.Lock()
+
+    def mark(self, *user_ids):
+        if not self.window:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for user_id in user_ids:
+                self._marks[user_id] = now
+            if len(self._marks) > self._max_users:
+                self._marks = {u: t for u, t in self._marks.items() if now - t < self.window}
+
+    def recent(self, user_id):
+        if not self.window or user_id is None:
+            return False
+        marked = self._marks.get(user_id)
+        return marked is not None and time.monotonic() - marked < self.window
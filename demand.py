@@ -0,0 +1,101 @@
+"""Карта спроса для водителей: заказы по ячейкам geohash, где стоит ждать.
+
+Вес ячейки — недавние заказы с экспоненциальным затуханием (период полураспада half_life)
+плюс заказы, которые прямо сейчас ждут водителя. Обновление на создание, назначение, возврат
+в ожидание и закрытие заказа — O(1): затухание пересчитывается лениво, только для затронутой
+ячейки в момент изменения. Ни одного запроса к БД по пути запроса.
+"""
+import threading
+import time
+
+from geo import geohash
+
+
+class DemandHeatmap:
+    """Ячейки {geohash: [вес на момент ts, ts, ждущих заказов]} и заказы {order_id: [geohash, ждет ли]}."""
+
+    def __init__(self, precision=6, half_life=900.0, clock=time.time, on_change=None):
+        self.precision = precision
+        self.half_life = half_life
+        self._clock = clock
+        self._on_change = on_change
+        self._lock = threading.Lock()
+        self._cells = {}
+        self._orders = {}
+        self.version = 0
+
+    def __len__(self):
+        """Количество ячеек."""
+        return len(self._cells)
+
+    def _decayed(self, cell, now):
+        weight, ts, _ = cell
+        return weight * 2 ** (-(now - ts) / self.half_life) if now > ts else weight
+
+    def _changed(self):
+        self.version += 1
+        if self._on_change is not None:
+            self._on_change()
+
+    def add(self, order_id, lat, lng, ts=None, waiting=True):
+        """Новый заказ с точкой подачи (ts — время создания, по умолчанию сейчас)."""
+        now = self._clock()
+        ts = now if ts is None else ts
+        key = geohash(lat, lng, self.precision)
+        with self._lock:
+            if order_id in self._orders:
+                return
+            cell = self._cells.get(key)
+            if cell is None:
+                cell = self._cells[key] = [0.0, ts, 0]
+            if ts >= cell[1]:
+                cell[0] = self._decayed(cell, ts) + 1.0
+                cell[1] = ts
+            else:
+                # Заказ старше последнего обновления ячейки (восстановление при старте)
+                cell[0] += 2 ** (-(cell[1] - ts) / self.half_life)
+            cell[2] += waiting
+            self._orders[order_id] = [key, waiting]
+        self._changed()
+
+    def set_waiting(self, order_id, waiting):
+        """Заказ назначен водителю (False) или снова ждет (True, после отказа или таймаута)."""
+        with self._lock:
+            entry = self._orders.get(order_id)
+            if entry is None or entry[1] == waiting:
+                return
+            entry[1] = waiting
+            # Ячейку назначенного заказа snapshot мог уже удалить как остывшую
+            cell = self._cells.setdefault(entry[0], [0.0, self._clock(), 0])
+            cell[2] += 1 if waiting else -1
+        self._changed()
+
+    def forget(self, order_id):
+        """Заказ закрыт (завершен или отменен): больше не ждет, недавний спрос остается и затухает."""
+        with self._lock:
+            entry = self._orders.pop(order_id, None)
+            if entry is None:
+                return
+            if entry[1]:
+                self._cells[entry[0]][2] -= 1
+        if entry[1]:
+            self._changed()
+
+    def snapshot(self, min_weight=0.05, limit=None):
+        """Ячейки с весом не меньше min_weight, самые горячие первыми: [(geohash, вес, ждущих)].
+
+        Остывшие ячейки без ждущих заказов заодно удаляются.
+        """
+        now = self._clock()
+        cells = []
+        with self._lock:
+            for key, cell in list(self._cells.items()):
+                recent = self._decayed(cell, now)
+                if recent < min_weight and not cell[2]:
+                    del self._cells[key]
+                    continue
+                weight = recent + cell[2]
+                if weight >= min_weight:
+                    cells.append((key, weight, cell[2]))
+        cells.sort(key=lambda c: c[1], reverse=True)
+        return cells[:limit] if limit else cells
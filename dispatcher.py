@@ -0,0 +1,140 @@
+"""Диспетчер: один поток, через который проходят все изменения состояния назначения (single writer).
+
+HTTP-обработчики и таймеры кладут команду в ограниченную очередь и ждут результат (Future).
+Команды выполняются строго по очереди, поэтому очередь водителей, backlog и переходы статусов
+заказа не требуют блокировок и не гоняются между потоками (принятие против таймаута, отмена
+против назначения). За одно пробуждение поток разбирает до batch_size команд и после пачки
+вызывает on_batch_end — там копившиеся записи (позиции в очереди) уходят одним commit.
+Если очередь заполнена, submit бросает DispatcherBusy — обработчик отвечает 503.
+Несколько воркеров: guard() держит общую блокировку на время пачки (см. coordination.py).
+"""
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from contextlib import nullcontext
+
+logger = logging.getLogger(__name__)
+
+
+class DispatcherBusy(Exception):
+    """Очередь команд заполнена — клиенту стоит повторить позже."""
+
+
+class Dispatcher:
+    def __init__(self, context=None, wrap=None, on_batch_end=None, guard=None, maxsize=1000, batch_size=64,
+                 name='dispatcher'):
+        # context() — контекст на каждую команду (app_context: своя сессия БД, без протекших транзакций);
+        # wrap(name, fn) — обертка команды (профилировщик); guard() — контекст вокруг всей пачки
+        self._context = context
+        self._wrap = wrap
+        self._guard = guard or nullcontext
+        self._on_batch_end = on_batch_end
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._batch_size = batch_size
+        self._name = name
+        self._thread = None
+        self._ident = None
+        self._start_lock = threading.Lock()
+        self._stopped = False
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def on_dispatcher_thread(self):
+        return threading.get_ident() == self._ident
+
+    def submit(self, name, fn, *args, block=False):
+        """Поставить команду в очередь. block=False — DispatcherBusy при заполненной очереди."""
+        future = Future()
+        if self.on_dispatcher_thread():
+            # Команда из команды: выполняем сразу, иначе поток ждал бы сам себя
+            self._execute(name, fn, args, future)
+            return future
+        self._ensure_started()
+        try:
+            self._queue.put((name, fn, args, future), block=block)
+        except queue.Full:
+            raise DispatcherBusy(name) from None
+        return future
+
+    def call(self, name, fn, *args, timeout=None):
+        """Выполнить команду в потоке диспетчера и вернуть ее результат (исключение пробрасывается)."""
+        return self.submit(name, fn, *args).result(timeout)
+
+    def stop(self):
+        """Остановить поток после уже поставленных команд (для тестов и бенчмарков)."""
+        self._stopped = True
+        if self._thread is not None:
+            try:
+                # Очередь может быть полна: ждем, пока поток освободит место, но не бесконечно
+                self._queue.put(None, timeout=5)
+            except queue.Full:
+                logger.warning('Dispatcher queue is full, %s not stopped', self._name)
+                return
+            self._thread.join(timeout=5)
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None and not self._stopped:
+                    self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+                    self._thread.start()
+
+    def _execute(self, name, fn, args, future):
+        if not future.set_running_or_notify_cancel():
+            return
+        if self._wrap is not None:
+            fn = self._wrap(f'dispatch {name}', fn)
+        try:
+            if self._context is not None:
+                with self._context():
+                    result = fn(*args)
+            else:
+                result = fn(*args)
+        except BaseException as e:
+            # Результат таймеров (таймаут принятия, пакетное назначение) никто не ждет — иначе ошибка пропала бы
+            logger.exception('Dispatch command %s failed', name)
+            future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+        else:
+            future.set_result(result)
+
+    def _run(self):
+        self._ident = threading.get_ident()
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            if stop:
+                batch = batch[:batch.index(None)]
+            if batch:
+                self._run_batch(batch)
+            if stop:
+                return
+
+    def _run_batch(self, batch):
+        try:
+            with self._guard():
+                for item in batch:
+                    self._execute(*item)
+                if self._on_batch_end is not None:
+                    try:
+                        if self._context is not None:
+                            with self._context():
+                                self._on_batch_end()
+                        else:
+                            self._on_batch_end()
+                    except Exception:
+                        logger.exception('Dispatcher batch hook failed')
+        except Exception as e:
+            # Не удалось взять (или снять) общую блокировку — невыполненные команды получают ошибку
+            logger.exception('Dispatcher guard failed')
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
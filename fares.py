@@ -0,0 +1,136 @@
+"""Расчет стоимости поездки: расстояние по прямой с коэффициентом извилистости дорог и тариф.
+
+Цена = max(минимум, (посадка + за км · км) · ночной коэффициент + доплата за зоны).
+Зоны (аэропорт, вокзал, пригород) — многоугольники из JSON-файла; для каждой заранее
+посчитаны рамка и массивы ребер, поэтому проверка «точка в зоне» для пачки маршрутов —
+несколько векторных операций NumPy. Все функции принимают массивы: один вызов на N маршрутов.
+"""
+import json
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from geo import EARTH_RADIUS_KM
+
+
+def haversine_pairs(lat1, lng1, lat2, lng2):
+    """Расстояния, км, между точками с одинаковыми индексами (в отличие от haversine_matrix)."""
+    p1, p2 = np.radians(lat1), np.radians(lat2)
+    dl = np.radians(lng2) - np.radians(lng1)
+    a = np.sin((p2 - p1) / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+class ZoneIndex:
+    """Многоугольники тарифных зон с предрасчитанными рамками и ребрами."""
+
+    def __init__(self, zones):
+        self.names = []
+        self.surcharges = []
+        self._bboxes = []
+        self._edges = []
+        for zone in zones:
+            poly = np.asarray(zone['polygon'], dtype=float)  # [[lat, lng], ...]
+            if len(poly) < 3:
+                raise ValueError(f"Zone {zone.get('name')!r}: polygon needs at least 3 points")
+            lat1, lng1 = poly[:, 0], poly[:, 1]
+            lat2, lng2 = np.roll(lat1, -1), np.roll(lng1, -1)
+            self.names.append(zone['name'])
+            self.surcharges.append(float(zone['surcharge']))
+            self._bboxes.append((lat1.min(), lat1.max(), lng1.min(), lng1.max()))
+            self._edges.append((lat1[:, None], lng1[:, None], lat2[:, None], lng2[:, None]))
+        self._bbox_array = np.asarray(self._bboxes, dtype=float).reshape(-1, 4, 1)
+
+    def __len__(self):
+        return len(self.names)
+
+    def contains(self, i, lat, lng):
+        """Маска точек, попадающих в зону i (луч по долготе, четность пересечений)."""
+        lat_min, lat_max, lng_min, lng_max = self._bboxes[i]
+        inside = np.zeros(lat.shape, dtype=bool)
+        cand = np.flatnonzero((lat >= lat_min) & (lat <= lat_max) & (lng >= lng_min) & (lng <= lng_max))
+        if not len(cand):
+            return inside
+        y, x = lat[cand][None, :], lng[cand][None, :]
+        y1, x1, y2, x2 = self._edges[i]
+        crosses = (y1 > y) != (y2 > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_at = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        inside[cand] = np.count_nonzero(crosses & (x < x_at), axis=0) % 2 == 1
+        return inside
+
+    def surcharge(self, plat, plng, dlat, dlng):
+        """Доплата за маршрут: каждая зона, где начало или конец, считается один раз."""
+        total = np.zeros(plat.shape)
+        if not self.names:
+            return total
+        # Сначала рамки всех зон разом: точный тест только для зон, в рамку которых что-то попало
+        b = self._bbox_array
+        lat, lng = np.concatenate([plat, dlat])[None, :], np.concatenate([plng, dlng])[None, :]
+        touched = ((lat >= b[:, 0]) & (lat <= b[:, 1]) & (lng >= b[:, 2]) & (lng <= b[:, 3])).any(axis=1)
+        for i in np.flatnonzero(touched):
+            total += self.surcharges[i] * (self.contains(i, plat, plng) | self.contains(i, dlat, dlng))
+        return total
+
+
+def load_zones(path):
+    """Зоны из JSON: [{"name": ..., "surcharge": ..., "polygon": [[lat, lng], ...]}, ...]."""
+    if not path:
+        return ZoneIndex([])
+    with open(path, encoding='utf-8') as f:
+        return ZoneIndex(json.load(f))
+
+
+class FareEngine:
+    def __init__(self, base, per_km, minimum, road_factor=1.0, night_multiplier=1.0,
+                 night_hours=(22, 6), tz='UTC', rounding=1.0, zones=None):
+        self.base = base
+        self.per_km = per_km
+        self.minimum = minimum
+        self.road_factor = road_factor
+        self.night_multiplier = night_multiplier
+        self.night_start, self.night_end = night_hours
+        self.tz = ZoneInfo(tz)
+        self.rounding = rounding
+        self.zones = zones if zones is not None else ZoneIndex([])
+
+    def is_night(self, at=None):
+        """Ночной тариф по местному времени (интервал может переходить через полночь)."""
+        at = at or datetime.now(timezone.utc)
+        if at.tzinfo is None:
+            at = at.replace(tzinfo=timezone.utc)  # В БД и приложении — naive UTC
+        hour = at.astimezone(self.tz).hour
+        if self.night_start <= self.night_end:
+            return self.night_start <= hour < self.night_end
+        return hour >= self.night_start or hour < self.night_end
+
+    def quote(self, plat, plng, dlat, dlng, at=None):
+        """Стоимость N маршрутов одним вызовом: {'distance_km', 'zone_surcharge', 'price'} (массивы), 'night'."""
+        plat, plng, dlat, dlng = (np.asarray(a, dtype=float) for a in (plat, plng, dlat, dlng))
+        distance = haversine_pairs(plat, plng, dlat, dlng) * self.road_factor
+        night = self.is_night(at)
+        price = (self.base + self.per_km * distance) * (self.night_multiplier if night else 1.0)
+        surcharge = self.zones.surcharge(plat, plng, dlat, dlng)
+        price = np.maximum(self.minimum, price + surcharge)
+        if self.rounding:
+            price = np.ceil(price / self.rounding - 1e-9) * self.rounding
+        return {'distance_km': distance, 'zone_surcharge': surcharge, 'price': price, 'night': night}
+
+    def price(self, plat, plng, dlat, dlng, at=None):
+        """Стоимость одного маршрута (float)."""
+        return float(self.quote([plat], [plng], [dlat], [dlng], at)['price'][0])
+
+
+def create_fare_engine(config):
+    return FareEngine(
+        base=config['FARE_BASE'],
+        per_km=config['FARE_PER_KM'],
+        minimum=config['FARE_MINIMUM'],
+        road_factor=config['FARE_ROAD_FACTOR'],
+        night_multiplier=config['FARE_NIGHT_MULTIPLIER'],
+        night_hours=(config['FARE_NIGHT_START_HOUR'], config['FARE_NIGHT_END_HOUR']),
+        tz=config['FARE_TIMEZONE'],
+        rounding=config['FARE_ROUNDING'],
+        zones=load_zones(config['FARE_ZONES_PATH']),
+    )
@@ -0,0 +1,162 @@
+"""Гео-утилиты: расстояния, geohash и пространственный индекс водителей."""
+import math
+import threading
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG_LAT = 111.32
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Расстояние по большому кругу, км."""
+    p1 = math.radians(lat1)
+    p2 = math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+_GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash(lat, lng, precision=6):
+    """Geohash точки (precision символов; 6 — ячейка ~1.2 × 0.6 км)."""
+    lat_lo, lat_hi, lng_lo, lng_hi = -90.0, 90.0, -180.0, 180.0
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            bit = lng >= mid
+            lng_lo, lng_hi = (mid, lng_hi) if bit else (lng_lo, mid)
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            bit = lat >= mid
+            lat_lo, lat_hi = (mid, lat_hi) if bit else (lat_lo, mid)
+        value = (value << 1) | bit
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_GEOHASH_BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+class GridIndex:
+    """Сеточный индекс точек (ячейки cell_km × cell_km) для поиска k ближайших.
+
+    Поиск обходит кольца ячеек вокруг точки запроса и останавливается, как только
+    следующее кольцо заведомо дальше k-го найденного кандидата (или радиуса).
+    Для городского парка в сотни-тысячи машин это доли миллисекунды.
+    """
+
+    def __init__(self, cell_km=0.5):
+        self._lock = threading.Lock()
+        self._cell_deg = cell_km / KM_PER_DEG_LAT
+        self._buckets = {}
+        self._points = {}
+
+    def _cell(self, lat, lng):
+        return (math.floor(lat / self._cell_deg), math.floor(lng / self._cell_deg))
+
+    def _min_cell_km(self, lat):
+        # По долготе ячейка уже у полюса — берём меньшую сторону, чтобы оценка была нижней
+        return self._cell_deg * KM_PER_DEG_LAT * max(0.01, math.cos(math.radians(min(89.0, abs(lat) + self._cell_deg))))
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, key):
+        return key in self._points
+
+    def get(self, key):
+        """(lat, lng, ts) или None."""
+        p = self._points.get(key)
+        return p[:3] if p else None
+
+    def points(self, newer_than=None):
+        """Все точки: список (key, lat, lng), без устаревших (ts < newer_than)."""
+        with self._lock:
+            return [(key, p[0], p[1]) for key, p in self._points.items()
+                    if newer_than is None or p[2] >= newer_than]
+
+    def update(self, key, lat, lng, ts=0.0):
+        """Добавить или переместить точку."""
+        cell = self._cell(lat, lng)
+        with self._lock:
+            old = self._points.get(key)
+            if old is not None and old[3] != cell:
+                self._discard(key, old[3])
+            self._points[key] = (lat, lng, ts, cell)
+            self._buckets.setdefault(cell, {})[key] = True
+
+    def remove(self, key):
+        with self._lock:
+            old = self._points.pop(key, None)
+            if old is not None:
+                self._discard(key, old[3])
+            return old is not None
+
+    def _discard(self, key, cell):
+        bucket = self._buckets.get(cell)
+        if bucket is not None:
+            bucket.pop(key, None)
+            if not bucket:
+                del self._buckets[cell]
+
+    def _ring(self, ci, cj, r):
+        if r == 0:
+            yield (ci, cj)
+            return
+        for j in range(cj - r, cj + r + 1):
+            yield (ci - r, j)
+            yield (ci + r, j)
+        for i in range(ci - r + 1, ci + r):
+            yield (i, cj - r)
+            yield (i, cj + r)
+
+    def nearest(self, lat, lng, k=1, max_km=None, newer_than=None):
+        """До k ближайших точек: список (distance_km, key), по возрастанию расстояния.
+
+        newer_than — отбросить точки с ts < newer_than (устаревшие координаты).
+        """
+        with self._lock:
+            if not self._points:
+                return []
+            ci, cj = self._cell(lat, lng)
+            step_km = self._min_cell_km(lat)
+            found = []
+            seen_cells = 0
+            r = 0
+            while True:
+                if 8 * r > len(self._buckets) - seen_cells:
+                    # Кольца стали длиннее, чем осталось непустых ячеек — досматриваем их напрямую
+                    for (i, j), bucket in self._buckets.items():
+                        if max(abs(i - ci), abs(j - cj)) >= r:
+                            self._collect(bucket, lat, lng, max_km, newer_than, found)
+                    break
+                for cell in self._ring(ci, cj, r):
+                    bucket = self._buckets.get(cell)
+                    if bucket:
+                        seen_cells += 1
+                        self._collect(bucket, lat, lng, max_km, newer_than, found)
+                # Любая точка в кольце r+1 не ближе r * step_km
+                bound = r * step_km
+                if max_km is not None and bound > max_km:
+                    break
+                if len(found) >= k:
+                    found.sort()
+                    if found[k - 1][0] <= bound:
+                        break
+                r += 1
+            found.sort()
+            return found[:k]
+
+    def _collect(self, bucket, lat, lng, max_km, newer_than, out):
+        points = self._points
+        for key in bucket:
+            plat, plng, ts, _ = points[key]
+            if newer_than is not None and ts < newer_than:
+                continue
+            d = haversine_km(lat, lng, plat, plng)
+            if max_km is None or d <= max_km:
+                out.append((d, key))
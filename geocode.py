@@ -0,0 +1,253 @@
+"""Обратный геокодинг через сервер: округление координат, LRU в памяти, кэш на диске, ограничение частоты.
+
+Координаты округляются до GEOCODE_BUCKET_DECIMALS знаков (4 знака — ячейка ~11 м), так что соседние
+тапы по карте попадают в один ключ. Порядок поиска: LRU → SQLite-файл → провайдер. Одинаковые
+одновременные промахи объединяются: к провайдеру идет один запрос, остальные ждут его результат.
+Запросы к провайдеру проходят через общий token bucket (Nominatim разрешает 1 запрос/с).
+"""
+import json
+import sqlite3
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+
+
+class GeocodeUnavailable(Exception):
+    """Провайдер недоступен или лимит запросов исчерпан — ответ не кэшируется."""
+
+
+def bucket(lat, lng, decimals):
+    """Ключ ячейки и ее координаты (к провайдеру идет центр ячейки, а не исходная точка)."""
+    lat, lng = round(lat, decimals), round(lng, decimals)
+    return f'{lat:.{decimals}f},{lng:.{decimals}f}', lat, lng
+
+
+class NominatimProvider:
+    def __init__(self, url, user_agent, language='ru', timeout=5.0):
+        self.url = url
+        self.user_agent = user_agent
+        self.language = language
+        self.timeout = timeout
+
+    def reverse(self, lat, lng):
+        query = urllib.parse.urlencode({'lat': lat, 'lon': lng, 'format': 'json'})
+        req = urllib.request.Request(f'{self.url}?{query}', headers={
+            'User-Agent': self.user_agent,
+            'Accept-Language': self.language,
+        })
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                data = json.load(resp)
+        except (OSError, ValueError) as e:
+            raise GeocodeUnavailable(str(e)) from e
+        a = data.get('address') or {}
+        return {
+            'street': a.get('road') or a.get('street') or a.get('pedestrian') or a.get('footway'),
+            'house': a.get('house_number') or a.get('house'),
+            'display_name': data.get('display_name'),
+        }
+
+
+class StubProvider:
+    """Детерминированный провайдер без сети (локальная разработка, бенчмарки, проверки)."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+
+    def reverse(self, lat, lng):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return {
+            'street': f'Тестовая {int(abs(lat) * 1000) % 100}',
+            'house': str(int(abs(lng) * 10000) % 200 + 1),
+            'display_name': f'{lat}, {lng}',
+        }
+
+
+class RateLimiter:
+    """Token bucket: rate запросов в секунду, до burst подряд."""
+
+    def __init__(self, rate, burst=1, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait):
+        """Взять токен, подождав не дольше max_wait секунд; False — лимит исчерпан."""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = (1 - self._tokens) / self.rate if self._tokens < 1 else 0.0
+            if wait > max_wait:
+                return False
+            # Токен резервируется сразу: следующий поток увидит отрицательный остаток и подождет дольше
+            self._tokens -= 1
+        if wait:
+            time.sleep(wait)
+        return True
+
+
+class LRUCache:
+    def __init__(self, maxsize):
+        self._maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self._maxsize:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class DiskCache:
+    """Постоянный кэш в отдельном SQLite-файле (не в основной БД: запись не конкурирует с заказами)."""
+
+    def __init__(self, path, ttl_seconds):
+        self.ttl = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS reverse_geocode '
+                           '(key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)')
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT value, stored_at FROM reverse_geocode WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] < time.time() - self.ttl:
+            return None
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO reverse_geocode (key, value, stored_at) VALUES (?, ?, ?)',
+                               (key, json.dumps(value, ensure_ascii=False), time.time()))
+            self._conn.commit()
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ReverseGeocoder:
+    def __init__(self, provider, limiter, decimals=4, lru_size=10000, disk=None, max_wait=2.0):
+        self.provider = provider
+        self.limiter = limiter
+        self.decimals = decimals
+        self.max_wait = max_wait
+        self.lru = LRUCache(lru_size)
+        self.disk = disk
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        # memory/disk — попадания в кэш, upstream — запросы к провайдеру, coalesced — ждали чужой запрос
+        self.stats = {'memory': 0, 'disk': 0, 'upstream': 0, 'coalesced': 0, 'error': 0, 'rate_limited': 0}
+
+    def _count(self, outcome):
+        with self._stats_lock:
+            self.stats[outcome] += 1
+
+    def hit_rate(self):
+        """Доля запросов, обслуженных без обращения к провайдеру."""
+        s = dict(self.stats)
+        total = sum(s.values())
+        return (s['memory'] + s['disk'] + s['coalesced']) / total if total else 0.0
+
+    def reverse(self, lat, lng):
+        """(результат, источник) для точки; GeocodeUnavailable — если провайдер не ответил."""
+        key, blat, blng = bucket(lat, lng, self.decimals)
+        result = self.lru.get(key)
+        if result is not None:
+            self._count('memory')
+            return result, 'memory'
+        if self.disk is not None:
+            result = self.disk.get(key)
+            if result is not None:
+                self.lru.put(key, result)
+                self._count('disk')
+                return result, 'disk'
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                self._count('error')
+                raise flight.error
+            self._count('coalesced')
+            return flight.result, 'coalesced'
+
+        try:
+            flight.result = self._fetch(key, blat, blng)
+            return flight.result, 'upstream'
+        except GeocodeUnavailable as e:
+            flight.error = e
+            raise
+        finally:
+            if flight.result is None and flight.error is None:
+                flight.error = GeocodeUnavailable('upstream failed')
+            with self._lock:
+                del self._inflight[key]
+            flight.done.set()
+
+    def _fetch(self, key, lat, lng):
+        if not self.limiter.acquire(self.max_wait):
+            self._count('rate_limited')
+            raise GeocodeUnavailable('rate limit')
+        try:
+            result = self.provider.reverse(lat, lng)
+        except GeocodeUnavailable:
+            self._count('error')
+            raise
+        self._count('upstream')
+        self.lru.put(key, result)
+        if self.disk is not None:
+            self.disk.put(key, result)
+        return result
+
+
+def create_geocoder(config):
+    if config['GEOCODE_PROVIDER'] == 'stub':
+        provider = StubProvider()
+    else:
+        provider = NominatimProvider(config['GEOCODE_NOMINATIM_URL'], config['GEOCODE_USER_AGENT'],
+                                     language=config['GEOCODE_LANGUAGE'],
+                                     timeout=config['GEOCODE_UPSTREAM_TIMEOUT_SECONDS'])
+    path = config['GEOCODE_CACHE_PATH']
+    return ReverseGeocoder(
+        provider,
+        RateLimiter(config['GEOCODE_RATE_PER_SECOND']),
+        decimals=config['GEOCODE_BUCKET_DECIMALS'],
+        lru_size=config['GEOCODE_LRU_SIZE'],
+        disk=DiskCache(path, config['GEOCODE_DISK_TTL_DAYS'] * 86400) if path else None,
+        max_wait=config['GEOCODE_MAX_WAIT_SECONDS'],
+    )
@@ -0,0 +1,81 @@
+"""Версии в памяти для условных GET (ETag → 304) и long-poll (?wait=&since=).
+
+VersionBoard хранит для ключа (заказа) версию и владельца. Версии берутся из одного
+возрастающего счетчика и никогда не повторяются, поэтому вытесненный и заново
+появившийся ключ не совпадет со старым ETag. Ожидающие запросы будятся при bump().
+WaitSlots ограничивает число «припаркованных» запросов: каждый держит поток сервера.
+"""
+import threading
+from collections import OrderedDict
+
+
+class VersionBoard:
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._cond = threading.Condition()
+        self._items = OrderedDict()  # key -> [version, owner]
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def _entry(self, key):
+        entry = self._items.get(key)
+        if entry is None:
+            self._seq += 1
+            entry = self._items[key] = [self._seq, None]
+            while len(self._items) > self.max_keys:
+                self._items.popitem(last=False)
+        else:
+            self._items.move_to_end(key)
+        return entry
+
+    def peek(self, key):
+        """(version, owner) или None, если ключ неизвестен (без регистрации)."""
+        with self._cond:
+            entry = self._items.get(key)
+            return tuple(entry) if entry is not None else None
+
+    def current(self, key):
+        """Версия ключа; неизвестный ключ получает новую. Читать ДО чтения данных из БД."""
+        with self._cond:
+            return self._entry(key)[0]
+
+    def set_owner(self, key, owner):
+        with self._cond:
+            self._entry(key)[1] = owner
+
+    def bump(self, key):
+        """Данные ключа изменились (вызывать после commit) — разбудить ожидающих."""
+        with self._cond:
+            self._seq += 1
+            self._entry(key)[0] = self._seq
+            self._cond.notify_all()
+
+    def wait(self, key, since, timeout):
+        """Подождать, пока версия ключа отличается от since (не дольше timeout); вернуть текущую."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._entry(key)[0] != since, timeout)
+            return self._entry(key)[0]
+
+
+class WaitSlots:
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._used = 0
+
+    def __len__(self):
+        return self._used
+
+    def acquire(self):
+        """Занять слот; False — слотов нет, ответить сразу."""
+        with self._lock:
+            if self._used >= self.limit:
+                return False
+            self._used += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._used -= 1
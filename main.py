@@ -1,13 +1,17 @@
 """Точка входа: инициализация БД и запуск приложения."""
 import os
-from app import app, socketio, init_db, rebuild_driver_queue
+from app import app, socketio, init_db, rebuild_driver_queue, reconcile_assignments, rebuild_order_backlog, resume_order_events, start_order_archive
 
 if __name__ == '__main__':
     init_db()
     rebuild_driver_queue()
+    reconcile_assignments()
+    rebuild_order_backlog()
+    resume_order_events()
+    start_order_archive()
     ssl = (os.environ.get('USE_HTTPS') == '1')
     if ssl:
-        # Важно: use_reloader=False, иначе Flask поднимает второй процесс и очередь "расслаивается"
+        # Важно: use_reloader=False, иначе Flask поднимает второй процесс и очередь "расслаивается" (без COORDINATION_URL)
         socketio.run(app, debug=True, host='0.0.0.0', port=5000, ssl_context='adhoc', allow_unsafe_werkzeug=True, use_reloader=False)
     else:
         socketio.run(app, debug=True, host='0.0.0.0', port=5000, use_reloader=False)
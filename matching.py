@@ -0,0 +1,76 @@
+"""Глобальное сопоставление заказов и водителей (пакетное назначение).
+
+Матрица стоимостей — расстояния от водителей до точек подачи (NumPy),
+задача о назначениях решается венгерским алгоритмом (O(n²·m), внутренний
+цикл по столбцам векторизован).
+"""
+import numpy as np
+
+from geo import EARTH_RADIUS_KM
+
+
+def haversine_matrix(lat1, lng1, lat2, lng2):
+    """Матрица расстояний, км: строки — точки (lat1, lng1), столбцы — (lat2, lng2)."""
+    p1 = np.radians(np.asarray(lat1, dtype=float))[:, None]
+    p2 = np.radians(np.asarray(lat2, dtype=float))[None, :]
+    dl = np.radians(np.asarray(lng2, dtype=float))[None, :] - np.radians(np.asarray(lng1, dtype=float))[:, None]
+    a = np.sin((p2 - p1) / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+def solve_assignment(cost):
+    """Минимальное по сумме назначение строк столбцам (прямоугольная матрица).
+
+    Возвращает список пар (row, col); назначается min(n_rows, n_cols) пар.
+    Бесконечные/NaN стоимости трактуются как «очень дорого».
+    """
+    cost = np.array(cost, dtype=float)
+    if cost.size == 0:
+        return []
+    finite = np.isfinite(cost)
+    if not finite.all():
+        big = (np.abs(cost[finite]).max() if finite.any() else 0.0) * cost.shape[0] * 10 + 1e6
+        cost[~finite] = big
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+
+    # Потенциалы и текущее паросочетание (индексация с 1, столбец 0 — фиктивный)
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=np.int64)
+    way = np.zeros(m + 1, dtype=np.int64)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            cur = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (cur < minv[1:])
+            minv[1:][better] = cur[better]
+            way[1:][better] = j0
+            masked = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(masked)) + 1
+            delta = masked[j1 - 1]
+            used_cols = np.flatnonzero(used)
+            u[p[used_cols]] += delta
+            v[used_cols] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    pairs = [(int(p[j]) - 1, j - 1) for j in range(1, m + 1) if p[j] != 0]
+    if transposed:
+        pairs = [(col, row) for row, col in pairs]
+    pairs.sort()
+    return pairs
@@ -3,7 +3,10 @@ from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import Enum
 import enum
 
-db = SQLAlchemy()
+from database import RoutingSession
+
+# Чтение в GET-обработчиках может идти через отдельный движок (см. database.RoutingSession)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 class UserRole(enum.Enum):
@@ -35,15 +38,20 @@ class User(db.Model):
     queue_position = db.Column(db.Integer, nullable=True)  # Позиция в очереди
     current_order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=True)
     
-    # Для пассажиров
-    orders = db.relationship('Order', backref='passenger', lazy=True, foreign_keys='Order.passenger_id')
+    # Для пассажиров (запрос, а не список: история может быть длинной — см. GET /api/passenger/orders)
+    orders = db.relationship('Order', backref='passenger', lazy='dynamic', foreign_keys='Order.passenger_id')
+    
+    __table_args__ = (
+        # Выбор следующего свободного водителя при назначении заказа
+        db.Index('ix_users_dispatch', 'role', 'is_online', 'queue_position'),
+    )
     
     def __repr__(self):
         return f'<User {self.username} ({self.role.value})>'
 
 
-class Order(db.Model):
-    __tablename__ = 'orders'
+class OrderFields:
+    """Колонки заказа: общие для живой таблицы orders и архива orders_archive."""
     
     id = db.Column(db.Integer, primary_key=True)
     passenger_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -62,6 +70,89 @@ class Order(db.Model):
     completed_at = db.Column(db.DateTime, nullable=True)
     
     price = db.Column(db.Float, nullable=True)
+
+
+# Колонки строки истории заказов (archive.history) — их покрывают индексы *_history архива
+HISTORY_COLUMNS = ('id', 'status', 'pickup_address', 'destination_address', 'price', 'created_at', 'completed_at')
+
+
+class Order(OrderFields, db.Model):
+    __tablename__ = 'orders'
+    
+    __table_args__ = (
+        # Ожидающие заказы в порядке поступления (backlog при старте, отбор в архив)
+        db.Index('ix_orders_status_created_at', 'status', 'created_at'),
+        # Назначенные заказы по времени назначения (сверка дедлайнов при старте)
+        db.Index('ix_orders_status_assigned_at', 'status', 'assigned_at'),
+        # Заказы пассажира и водителя (и их история в живой таблице: заказов в ней на человека немного)
+        db.Index('ix_orders_passenger_created_at', 'passenger_id', 'created_at'),
+        db.Index('ix_orders_driver_status', 'driver_id', 'status'),
+        # id не переиспользуется после переноса заказа в orders_archive (см. database.ensure_order_ids)
+        {'sqlite_autoincrement': True},
+    )
     
     def __repr__(self):
         return f'<Order {self.id} - {self.status.value}>'
+
+
+# Индексы прежних версий схемы: широкие покрывающие индексы истории на горячей таблице orders
+# удорожали каждую вставку и смену статуса (удаляются в init_db)
+OBSOLETE_ORDER_INDEXES = ('ix_orders_passenger_history', 'ix_orders_driver_history')
+
+
+class ArchivedOrder(OrderFields, db.Model):
+    """Завершенные и отмененные заказы старше ORDER_ARCHIVE_AFTER_DAYS (переносятся пачками, см. archive.py)."""
+    __tablename__ = 'orders_archive'
+    
+    archived_at = db.Column(db.DateTime, nullable=False)
+    
+    __table_args__ = (
+        # История с keyset-пагинацией по id (покрывающие: страница читается только из индекса)
+        db.Index('ix_orders_archive_passenger_history', 'passenger_id', *HISTORY_COLUMNS),
+        db.Index('ix_orders_archive_driver_history', 'driver_id', *HISTORY_COLUMNS),
+    )
+    
+    def __repr__(self):
+        return f'<ArchivedOrder {self.id} - {self.status.value}>'
+
+
+class DriverTrackPoint(db.Model):
+    """Прореженный трек водителя (пишется пачками, см. tracking.py)."""
+    __tablename__ = 'driver_track_points'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    driver_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # Без внешнего ключа: завершенный заказ со временем переезжает в orders_archive (тот же id)
+    order_id = db.Column(db.Integer, nullable=True)
+    lat = db.Column(db.Float, nullable=False)
+    lng = db.Column(db.Float, nullable=False)
+    accuracy = db.Column(db.Float, nullable=True)
+    recorded_at = db.Column(db.DateTime, nullable=False)
+    
+    __table_args__ = (
+        # Трек поездки и трек водителя за период
+        db.Index('ix_track_points_order_recorded_at', 'order_id', 'recorded_at'),
+        db.Index('ix_track_points_driver_recorded_at', 'driver_id', 'recorded_at'),
+    )
+
+
+class OrderEvent(db.Model):
+    """Outbox событий заказа: пишется в одной транзакции с переходом статуса, id — порядковый номер (seq)."""
+    __tablename__ = 'order_events'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
+    event = db.Column(db.String(40), nullable=False)  # Имя Socket.IO-события
+    room = db.Column(db.String(40), nullable=False)  # Комната получателя: driver_<id> / passenger_<id>
+    payload = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = db.Column(db.DateTime, nullable=True)  # NULL — еще не разослано
+    
+    __table_args__ = (
+        # События получателя после seq (догрузка при переподключении)
+        db.Index('ix_order_events_room_id', 'room', 'id'),
+        # Неразосланные события для публикатора
+        db.Index('ix_order_events_sent_at_id', 'sent_at', 'id'),
+        # seq не переиспользуется даже после удаления старых строк
+        {'sqlite_autoincrement': True},
+    )
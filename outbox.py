@@ -0,0 +1,75 @@
+"""Transactional outbox событий заказа (таблица order_events).
+
+Переход статуса и строка события пишутся одной транзакцией (record), а рассылает их фоновый
+публикатор: берет пачку неразосланных строк по порядку seq, отправляет в комнаты Socket.IO
+и одним UPDATE помечает отправленными. Доставка «хотя бы раз»: если процесс упал между emit
+и отметкой, событие уйдет повторно — клиенты отбрасывают уже виденные seq.
+Те же строки отдаются по GET /api/events?since=N — догрузка пропущенного при переподключении.
+"""
+from datetime import datetime
+
+from sqlalchemy import func, update
+
+from models import OrderEvent
+
+# Флаг в session.info: в транзакции есть события — после commit нужно запустить публикатор
+PENDING_KEY = 'outbox_pending'
+# Комнаты получателей событий транзакции (session.info): их данные изменились этим commit
+ROOMS_KEY = 'outbox_rooms'
+
+
+def record(session, order_id, event, room, payload):
+    """Добавить событие в текущую транзакцию (разошлется после commit)."""
+    session.add(OrderEvent(order_id=order_id, event=event, room=room, payload=payload))
+    session.info[PENDING_KEY] = True
+    session.info.setdefault(ROOMS_KEY, set()).add(room)
+
+
+def publish_pending(session, emit, limit):
+    """Разослать до limit неразосланных событий по порядку seq: [(seq, created_at)] разосланных.
+
+    Если emit упал, уже отправленные все равно помечаются, а исключение пробрасывается.
+    """
+    rows = (session.query(OrderEvent.id, OrderEvent.event, OrderEvent.room, OrderEvent.payload, OrderEvent.created_at)
+            .filter(OrderEvent.sent_at.is_(None))
+            .order_by(OrderEvent.id)
+            .limit(limit)
+            .all())
+    sent = []
+    try:
+        for seq, event, room, payload, created_at in rows:
+            emit(event, dict(payload, seq=seq), room=room)
+            sent.append((seq, created_at))
+    finally:
+        if sent:
+            session.execute(
+                update(OrderEvent)
+                .where(OrderEvent.id.in_([seq for seq, _ in sent]))
+                .values(sent_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+        else:
+            session.rollback()
+    return sent
+
+
+def events_since(session, room, since, limit):
+    """События комнаты с seq > since по порядку (уже разосланные и еще нет)."""
+    rows = (session.query(OrderEvent.id, OrderEvent.order_id, OrderEvent.event, OrderEvent.payload, OrderEvent.created_at)
+            .filter(OrderEvent.room == room, OrderEvent.id > since)
+            .order_by(OrderEvent.id)
+            .limit(limit)
+            .all())
+    return [{
+        'seq': seq,
+        'order_id': order_id,
+        'event': event,
+        'payload': payload,
+        'created_at': created_at.isoformat(),
+    } for seq, order_id, event, payload, created_at in rows]
+
+
+def last_seq(session, room):
+    """Последний seq комнаты (0, если событий не было) — точка отсчета для клиента."""
+    return session.query(func.max(OrderEvent.id)).filter(OrderEvent.room == room).scalar() or 0
@@ -0,0 +1,93 @@
+"""Присутствие водителей: живые Socket.IO-соединения и heartbeat.
+
+Учет ведется по соединениям (sid), а не по пользователям: у водителя может быть
+открыто несколько вкладок, и он на связи, пока жива хотя бы одна. Водитель без
+живых соединений считается «недоступным» с момента потери последнего из них;
+если он не вернулся за отведенное время, его снимают с линии (см. app.sweep_presence).
+"""
+import threading
+import time
+
+
+class PresenceTracker:
+    """Соединения водителей {sid: (driver_id, last_seen)} и недоступные водители {driver_id: since}."""
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._conns = {}
+        self._by_user = {}
+        self._away = {}
+
+    def __len__(self):
+        """Количество живых соединений."""
+        return len(self._conns)
+
+    def connect(self, sid, user_id):
+        """Новое соединение. Возвращает True, если водитель был недоступен и теперь снова на связи."""
+        with self._lock:
+            old = self._conns.get(sid)
+            if old is not None and old[0] != user_id:
+                self._drop(sid, self._clock())
+            self._conns[sid] = (user_id, self._clock())
+            self._by_user.setdefault(user_id, set()).add(sid)
+            return self._away.pop(user_id, None) is not None
+
+    def heartbeat(self, sid):
+        """Отметить соединение живым. Возвращает driver_id или None, если sid неизвестен."""
+        with self._lock:
+            conn = self._conns.get(sid)
+            if conn is None:
+                return None
+            self._conns[sid] = (conn[0], self._clock())
+            return conn[0]
+
+    def disconnect(self, sid):
+        """Соединение закрыто. Возвращает driver_id или None, если sid неизвестен."""
+        with self._lock:
+            return self._drop(sid, self._clock())
+
+    def _drop(self, sid, since):
+        conn = self._conns.pop(sid, None)
+        if conn is None:
+            return None
+        user_id = conn[0]
+        sids = self._by_user.get(user_id)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self._by_user[user_id]
+                self._away[user_id] = since
+        return user_id
+
+    def expire(self, timeout):
+        """Закрыть соединения без heartbeat дольше timeout секунд (телефон пропал из сети)."""
+        with self._lock:
+            deadline = self._clock() - timeout
+            stale = [(sid, seen) for sid, (_, seen) in self._conns.items() if seen < deadline]
+            return [self._drop(sid, seen) for sid, seen in stale]
+
+    def expect(self, user_id):
+        """Водитель на линии: если у него нет живого соединения, начать отсчет с этого момента."""
+        with self._lock:
+            if user_id not in self._by_user:
+                self._away.setdefault(user_id, self._clock())
+
+    def forget(self, user_id):
+        """Водитель ушел с линии — отслеживать его недоступность больше не нужно."""
+        with self._lock:
+            self._away.pop(user_id, None)
+
+    def is_live(self, user_id):
+        return user_id in self._by_user
+
+    def unreachable(self):
+        """Водители, у которых сейчас нет живого соединения."""
+        with self._lock:
+            return frozenset(self._away)
+
+    def gone(self, grace):
+        """Водители, недоступные дольше grace секунд."""
+        with self._lock:
+            deadline = self._clock() - grace
+            return [user_id for user_id, since in self._away.items() if since <= deadline]
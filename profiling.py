@@ -0,0 +1,210 @@
+"""Профилирование запросов (включается PROFILE_REQUESTS=1): SQL, коммиты и сэмплы стека.
+
+На каждый HTTP-запрос, Socket.IO-событие и колбэк таймера заводится трасса: выполненные
+SQL-выражения с длительностями, число commit/rollback. Пока трасса активна, отдельный поток
+раз в PROFILE_SAMPLE_INTERVAL_MS снимает стек ее потока. Если запрос длился дольше
+PROFILE_SLOW_MS, отчет (повторяющиеся выражения — кандидаты в N+1, время по функциям)
+пишется строкой JSON в лог и остается в памяти для /debug/slow-requests.
+"""
+import collections
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r'\s+')
+# Код библиотек и стандартной библиотеки: в разбивку по функциям идет только как «горячая точка»
+_LIBRARY_PREFIXES = tuple({os.path.realpath(p) for p in (sys.prefix, sys.base_prefix, sys.exec_prefix)})
+
+
+def _frame_key(frame):
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}"
+
+
+def _is_library(frame):
+    # __file__ модуля, а не co_filename: у скомпилированных (Cython) модулей co_filename относительный
+    filename = frame.f_globals.get('__file__') or frame.f_code.co_filename
+    return 'site-packages' in filename or os.path.realpath(filename).startswith(_LIBRARY_PREFIXES)
+
+
+class _Trace:
+    __slots__ = ('name', 'thread', 'started', 'status', 'statements', 'commits', 'rollbacks',
+                 'samples', 'self_samples', 'n_samples', 'query_started')
+
+    def __init__(self, name):
+        self.name = name
+        self.thread = threading.get_ident()
+        self.started = time.perf_counter()
+        self.status = None
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.samples = collections.Counter()
+        self.self_samples = collections.Counter()
+        self.n_samples = 0
+        self.query_started = []
+
+
+class RequestProfiler:
+    def __init__(self, slow_ms=200.0, sample_interval_ms=5.0, log_path=None, keep=50):
+        self.slow_ms = slow_ms
+        self.interval = sample_interval_ms / 1000.0
+        self.log_path = log_path
+        self._recent = collections.deque(maxlen=keep)
+        self._local = threading.local()
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._sampler = None
+
+    # --- трассы ---
+
+    def current(self):
+        return getattr(self._local, 'trace', None)
+
+    def start(self, name):
+        trace = _Trace(name)
+        self._local.trace = trace
+        with self._lock:
+            self._active[trace.thread] = trace
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample_loop, name='request-profiler', daemon=True)
+                self._sampler.start()
+        self._wake.set()
+        return trace
+
+    def finish(self):
+        trace = self.current()
+        if trace is None:
+            return None
+        self._local.trace = None
+        with self._lock:
+            self._active.pop(trace.thread, None)
+        duration_ms = (time.perf_counter() - trace.started) * 1000
+        logger.debug('%s %.1fms sql=%d commits=%d', trace.name, duration_ms, len(trace.statements), trace.commits)
+        if duration_ms < self.slow_ms:
+            return None
+        report = self._report(trace, duration_ms)
+        self._recent.appendleft(report)
+        logger.warning('Slow request: %s %.0fms, %d SQL, %d commits',
+                       trace.name, duration_ms, len(trace.statements), trace.commits)
+        if self.log_path:
+            with self._lock, open(self.log_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(report, ensure_ascii=False) + '\n')
+        return report
+
+    def wrap(self, name, fn):
+        """Обернуть обработчик (Socket.IO-событие, колбэк таймера) в трассу."""
+        def traced(*args, **kwargs):
+            if self.current() is not None:
+                return fn(*args, **kwargs)
+            self.start(name)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.finish()
+        traced.__name__ = getattr(fn, '__name__', 'traced')
+        traced.__doc__ = fn.__doc__
+        return traced
+
+    def recent(self):
+        """Последние медленные запросы, новые первыми."""
+        return list(self._recent)
+
+    # --- SQL ---
+
+    def install(self, engine):
+        """Подписаться на события движка: выражения, их длительность, commit/rollback."""
+        @event.listens_for(engine, 'before_cursor_execute')
+        def _before(conn, cursor, statement, parameters, context, executemany):
+            trace = self.current()
+            if trace is not None:
+                trace.query_started.append(time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def _after(conn, cursor, statement, parameters, context, executemany):
+            trace = self.current()
+            if trace is not None and trace.query_started:
+                elapsed = time.perf_counter() - trace.query_started.pop()
+                trace.statements.append((statement, elapsed))
+
+        @event.listens_for(engine, 'commit')
+        def _commit(conn):
+            trace = self.current()
+            if trace is not None:
+                trace.commits += 1
+
+        @event.listens_for(engine, 'rollback')
+        def _rollback(conn):
+            trace = self.current()
+            if trace is not None:
+                trace.rollbacks += 1
+
+    # --- сэмплирование стека ---
+
+    def _sample_loop(self):
+        while True:
+            with self._lock:
+                traces = list(self._active.values())
+            if not traces:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            frames = sys._current_frames()
+            for trace in traces:
+                frame = frames.get(trace.thread)
+                if frame is None:
+                    continue
+                seen = set()
+                top = True
+                while frame is not None:
+                    key = _frame_key(frame)
+                    if top:
+                        trace.self_samples[key] += 1
+                        top = False
+                    if key not in seen and not _is_library(frame):
+                        seen.add(key)
+                        trace.samples[key] += 1
+                    frame = frame.f_back
+                trace.n_samples += 1
+            del frames
+            time.sleep(self.interval)
+
+    def _report(self, trace, duration_ms):
+        grouped = {}
+        for statement, elapsed in trace.statements:
+            sql = _WHITESPACE.sub(' ', statement).strip()[:300]
+            entry = grouped.setdefault(sql, [0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed
+        statements = sorted(grouped.items(), key=lambda kv: kv[1][1], reverse=True)[:10]
+        interval_ms = self.interval * 1000
+        # functions — код приложения, время включая вызовы; hotspots — где именно стоял стек
+        functions = [{'function': fn, 'samples': n, 'approx_ms': round(n * interval_ms, 1)}
+                     for fn, n in trace.samples.most_common(15)]
+        hotspots = [{'function': fn, 'samples': n, 'approx_ms': round(n * interval_ms, 1)}
+                    for fn, n in trace.self_samples.most_common(10)]
+        return {
+            'name': trace.name,
+            'at': datetime.utcnow().isoformat(),
+            'duration_ms': round(duration_ms, 1),
+            'status': trace.status,
+            'sql': {
+                'count': len(trace.statements),
+                'total_ms': round(sum(e for _, e in trace.statements) * 1000, 2),
+                'commits': trace.commits,
+                'rollbacks': trace.rollbacks,
+                'statements': [{'sql': sql, 'count': n, 'total_ms': round(t * 1000, 2)}
+                               for sql, (n, t) in statements],
+            },
+            'profile': {'samples': trace.n_samples, 'interval_ms': interval_ms,
+                        'functions': functions, 'hotspots': hotspots},
+        }
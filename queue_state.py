@@ -0,0 +1,267 @@
+"""Очереди в памяти процесса: водители на линии и заказы, ждущие водителя.
+
+Источник правды для порядка очереди — этот объект, а не БД: чтения (поллинг /api/queue,
+счетчики на UI) отдают заранее собранный снимок без запросов к базе. Колонка
+users.queue_position лишь отражает очередь и пишется только при её изменении.
+"""
+import heapq
+import threading
+import time
+
+
+class DriverQueue:
+    """Упорядоченная очередь ID водителей с монотонно растущей версией.
+
+    Каждая мутация пересобирает неизменяемый снимок и увеличивает version,
+    поэтому snapshot() — это O(1) и его можно отдавать клиентам как есть.
+    Методы-мутаторы возвращают словарь {driver_id: новая позиция или None}
+    только для водителей, чья позиция изменилась, — его и нужно сохранить в БД.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._order = []
+        self._positions = {}
+        self._version = 0
+        self._snapshot = self._build_snapshot()
+
+    def _build_snapshot(self):
+        q = list(self._order)
+        return {
+            'queue': q,
+            'count': len(q),
+            'positions': {str(driver_id): idx for idx, driver_id in enumerate(q, 1)},
+            'version': self._version,
+        }
+
+    def _commit(self, old_positions, version=None):
+        """Пересобрать позиции/снимок и вернуть дифф позиций (под self._lock)."""
+        self._positions = {driver_id: idx for idx, driver_id in enumerate(self._order, 1)}
+        changed = {}
+        for driver_id, pos in self._positions.items():
+            if old_positions.get(driver_id) != pos:
+                changed[driver_id] = pos
+        for driver_id in old_positions:
+            if driver_id not in self._positions:
+                changed[driver_id] = None
+        if changed or (version is not None and version != self._version):
+            self._version = self._version + 1 if version is None else version
+            self._snapshot = self._build_snapshot()
+            self._changed.notify_all()
+        return changed
+
+    @property
+    def version(self):
+        return self._version
+
+    def snapshot(self):
+        """Текущий снимок {'queue', 'count', 'positions', 'version'}. Не изменять!"""
+        return self._snapshot
+
+    def wait_for_change(self, since, timeout):
+        """Подождать, пока version станет отличной от since (long-poll); вернуть текущую версию."""
+        with self._changed:
+            self._changed.wait_for(lambda: self._version != since, timeout)
+            return self._version
+
+    def position(self, driver_id):
+        return self._positions.get(driver_id)
+
+    def ids(self):
+        """Копия порядка очереди (для перебора при назначении заказа)."""
+        return list(self._order)
+
+    def __contains__(self, driver_id):
+        return driver_id in self._positions
+
+    def __len__(self):
+        return len(self._order)
+
+    def load(self, driver_ids, version=None):
+        """Полностью заменить очередь (восстановление из БД при старте).
+
+        version — версия общей очереди (coordination.SharedDriverQueue); более старая игнорируется.
+        """
+        with self._lock:
+            if version is not None and version < self._version:
+                return {}
+            old = self._positions
+            self._order = []
+            seen = set()
+            for driver_id in driver_ids:
+                if driver_id not in seen:
+                    seen.add(driver_id)
+                    self._order.append(driver_id)
+            return self._commit(old, version)
+
+    def add(self, driver_id):
+        """Поставить водителя в конец очереди (если его там ещё нет)."""
+        with self._lock:
+            if driver_id in self._positions:
+                return {}
+            old = self._positions
+            self._order.append(driver_id)
+            return self._commit(old)
+
+    def remove(self, driver_id):
+        """Убрать водителя из очереди; позиции стоящих за ним сдвигаются."""
+        with self._lock:
+            if driver_id not in self._positions:
+                return {}
+            old = self._positions
+            self._order.remove(driver_id)
+            return self._commit(old)
+
+
+class QueueDeltaTracker:
+    """Изменения очереди между последовательными рассылками, с порядковым номером seq.
+
+    Рассылка адресная: всем — только счетчик, каждому водителю — только его позиция.
+    Поэтому дельта — это {driver_id: новая позиция или None} лишь для тех, чья позиция
+    изменилась, плюс счетчик. Значения абсолютные: пропущенное событие исправляется
+    следующим или полным состоянием (state_for) при переподключении.
+    seq — версия очереди, поэтому он одинаков во всех воркерах (клиент может переподключиться к другому).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._last = {'queue': [], 'count': 0, 'positions': {}, 'version': 0}
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def state_for(self, driver_id=None):
+        """Состояние последней рассылки для одного получателя: {'seq', 'count', 'position'}."""
+        with self._lock:
+            position = self._last['positions'].get(str(driver_id)) if driver_id is not None else None
+            return {'seq': self._seq, 'count': self._last['count'], 'position': position}
+
+    def delta(self, snapshot):
+        """Изменения от последней рассылки до snapshot или None, если очередь не изменилась.
+
+        {'seq', 'version', 'count', 'count_changed', 'positions': {driver_id: позиция или None}}
+        """
+        with self._lock:
+            old = self._last['positions']
+            new = snapshot['positions']
+            if snapshot['queue'] == self._last['queue']:
+                return None
+            positions = {int(k): pos for k, pos in new.items() if old.get(k) != pos}
+            positions.update({int(k): None for k in old if k not in new})
+            count_changed = snapshot['count'] != self._last['count']
+            self._seq = snapshot['version']
+            self._last = snapshot
+            return {
+                'seq': self._seq,
+                'version': snapshot['version'],
+                'count': snapshot['count'],
+                'count_changed': count_changed,
+                'positions': positions,
+            }
+
+
+class OrderBacklog:
+    """Заказы, ждущие свободного водителя, в порядке created_at (старые — первыми).
+
+    Заполняется, когда назначить заказ некому, и разбирается при каждом освобождении
+    водителя — без периодических полных проходов по таблице orders.
+    Отдельно хранятся водители, отказавшиеся от заказа (reject/таймаут): им этот заказ
+    повторно не предлагается, пока отказ не старше decline_ttl секунд (None/0 — бессрочно).
+    """
+
+    def __init__(self, decline_ttl=None, clock=time.monotonic):
+        self._lock = threading.Lock()
+        self._heap = []
+        self._entries = {}
+        self._declined = {}
+        self.decline_ttl = decline_ttl
+        self._clock = clock
+        self.dispatched = 0
+        self.dispatched_wait_total = 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, order_id):
+        return order_id in self._entries
+
+    def add(self, order_id, created_at):
+        with self._lock:
+            if order_id in self._entries:
+                return
+            self._entries[order_id] = created_at
+            heapq.heappush(self._heap, (created_at, order_id))
+
+    def discard(self, order_id, dispatched_at=None):
+        """Убрать заказ из ожидания; dispatched_at — время назначения (для статистики ожидания)."""
+        with self._lock:
+            created_at = self._entries.pop(order_id, None)
+            if created_at is not None and dispatched_at is not None:
+                self.dispatched += 1
+                self.dispatched_wait_total += max(0.0, (dispatched_at - created_at).total_seconds())
+            # Кучу чистим лениво: устаревшие элементы выбрасываются при чтении/разрастании
+            if len(self._heap) > 2 * len(self._entries) + 32:
+                self._compact()
+
+    def _compact(self):
+        self._heap = [(c, oid) for oid, c in self._entries.items()]
+        heapq.heapify(self._heap)
+
+    def ordered(self):
+        """ID ожидающих заказов, старые первыми."""
+        with self._lock:
+            self._compact()
+            return [oid for _, oid in sorted(self._heap)]
+
+    def oldest_created_at(self):
+        with self._lock:
+            while self._heap and self._entries.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def decline(self, order_id, driver_id):
+        with self._lock:
+            self._declined.setdefault(order_id, {})[driver_id] = self._clock()
+
+    def declined(self, order_id):
+        """Водители, чей отказ от заказа еще действует (истекшие отказы заодно удаляются)."""
+        with self._lock:
+            drivers = self._declined.get(order_id)
+            if not drivers:
+                return frozenset()
+            if self.decline_ttl:
+                since = self._clock() - self.decline_ttl
+                for driver_id in [d for d, ts in drivers.items() if ts <= since]:
+                    del drivers[driver_id]
+                if not drivers:
+                    del self._declined[order_id]
+            return frozenset(drivers)
+
+    def next_decline_expiry(self):
+        """Через сколько секунд истечет ближайший отказ; None — отказов нет или они бессрочные.
+
+        Уже истекшие отказы удаляются.
+        """
+        with self._lock:
+            if not self.decline_ttl:
+                return None
+            now = self._clock()
+            since = now - self.decline_ttl
+            oldest = None
+            for order_id, drivers in list(self._declined.items()):
+                for driver_id, ts in list(drivers.items()):
+                    if ts <= since:
+                        del drivers[driver_id]
+                    elif oldest is None or ts < oldest:
+                        oldest = ts
+                if not drivers:
+                    del self._declined[order_id]
+            return None if oldest is None else oldest + self.decline_ttl - now
+
+    def forget(self, order_id):
+        """Заказ принят/отменен — забыть отказы по нему."""
+        with self._lock:
+            self._declined.pop(order_id, None)
@@ -0,0 +1,181 @@
+"""Планировщик дедлайнов: один поток на все таймеры принятия заказов.
+
+Вместо потока со sleep() на каждый заказ — индексируемая двоичная куча.
+schedule/cancel работают за O(log n); отменённый дедлайн удаляется из кучи сразу,
+так что его колбэк не выполнится и не сделает лишний запрос к БД.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ('deadline', 'seq', 'key', 'callback', 'args', 'index')
+
+    def __init__(self, deadline, seq, key, callback, args):
+        self.deadline = deadline
+        self.seq = seq
+        self.key = key
+        self.callback = callback
+        self.args = args
+        self.index = -1
+
+    def __lt__(self, other):
+        return (self.deadline, self.seq) < (other.deadline, other.seq)
+
+
+class DeadlineScheduler:
+    """Дедлайны по ключу (например, order_id), исполняемые одним рабочим потоком.
+
+    runner(callback, *args) — обёртка для запуска колбэка (например, внутри app_context).
+    Повторный schedule() с тем же ключом заменяет прежний дедлайн.
+    """
+
+    def __init__(self, runner=None, clock=time.monotonic, name='deadline-scheduler'):
+        self._runner = runner
+        self._clock = clock
+        self._name = name
+        self._cond = threading.Condition(threading.RLock())
+        self._heap = []
+        self._entries = {}
+        self._seq = 0
+        self._thread = None
+        self._stopped = False
+
+    # --- куча ---
+
+    def _swap(self, i, j):
+        h = self._heap
+        h[i], h[j] = h[j], h[i]
+        h[i].index = i
+        h[j].index = j
+
+    def _sift_up(self, i):
+        h = self._heap
+        while i > 0:
+            parent = (i - 1) // 2
+            if not h[i] < h[parent]:
+                break
+            self._swap(i, parent)
+            i = parent
+
+    def _sift_down(self, i):
+        h = self._heap
+        n = len(h)
+        while True:
+            smallest = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < n and h[child] < h[smallest]:
+                    smallest = child
+            if smallest == i:
+                break
+            self._swap(i, smallest)
+            i = smallest
+
+    def _remove_at(self, i):
+        h = self._heap
+        last = len(h) - 1
+        if i != last:
+            self._swap(i, last)
+        entry = h.pop()
+        if i < len(h):
+            self._sift_down(i)
+            self._sift_up(i)
+        entry.index = -1
+        del self._entries[entry.key]
+        return entry
+
+    # --- публичный API ---
+
+    def schedule(self, key, delay, callback, *args):
+        """Запланировать callback(*args) через delay секунд (заменяет дедлайн с тем же ключом)."""
+        with self._cond:
+            old = self._entries.get(key)
+            if old is not None:
+                self._remove_at(old.index)
+            self._seq += 1
+            entry = _Entry(self._clock() + max(0.0, delay), self._seq, key, callback, args)
+            entry.index = len(self._heap)
+            self._heap.append(entry)
+            self._entries[key] = entry
+            self._sift_up(entry.index)
+            self._ensure_started()
+            # Будим поток только если новый дедлайн стал ближайшим
+            if self._heap[0] is entry:
+                self._cond.notify()
+
+    def schedule_if_absent(self, key, delay, callback, *args):
+        """Как schedule(), но не трогает уже запланированный дедлайн (для окон/debounce).
+
+        Возвращает True, если дедлайн был добавлен.
+        """
+        with self._cond:
+            if key in self._entries:
+                return False
+            self.schedule(key, delay, callback, *args)
+            return True
+
+    def cancel(self, key):
+        """Отменить дедлайн. Возвращает True, если он был запланирован."""
+        with self._cond:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            was_first = entry.index == 0
+            self._remove_at(entry.index)
+            if was_first:
+                self._cond.notify()
+            return True
+
+    def __contains__(self, key):
+        with self._cond:
+            return key in self._entries
+
+    def __len__(self):
+        """Количество ожидающих дедлайнов (для мониторинга)."""
+        with self._cond:
+            return len(self._heap)
+
+    def count(self, predicate):
+        """Количество ожидающих дедлайнов, ключ которых удовлетворяет predicate."""
+        with self._cond:
+            return sum(1 for key in self._entries if predicate(key))
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    # --- рабочий поток ---
+
+    def _ensure_started(self):
+        if self._thread is None and not self._stopped:
+            self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                entry = None
+                while not self._stopped:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    delay = self._heap[0].deadline - self._clock()
+                    if delay <= 0:
+                        entry = self._remove_at(0)
+                        break
+                    self._cond.wait(delay)
+                if entry is None:
+                    return
+            try:
+                if self._runner is not None:
+                    self._runner(entry.callback, *entry.args)
+                else:
+                    entry.callback(*entry.args)
+            except Exception:
+                logger.exception('Deadline callback failed (key=%r)', entry.key)
@@ -38,3 +38,75 @@ function showNotification(message, type = 'info') {
     // В реальном приложении можно использовать библиотеку уведомлений
     console.log(`[${type.toUpperCase()}] ${message}`);
 }
+
+// События заказа приходят с seq (outbox на сервере). Устаревшие и повторные отбрасываются,
+// а после переподключения пропущенное догружается через GET /api/events?since=N.
+// handlers: { имя_события: function (data) {...} }
+function subscribeOrderEvents(socket, handlers) {
+    var lastSeq = 0;
+    var synced = false;
+
+    function apply(name, data) {
+        if (data && data.seq != null) {
+            if (data.seq <= lastSeq) return;
+            lastSeq = data.seq;
+        }
+        if (handlers[name]) handlers[name](data);
+    }
+
+    function catchUp() {
+        fetch('/api/events?since=' + lastSeq).then(function (r) { return r.json(); }).then(function (d) {
+            (d.events || []).forEach(function (e) {
+                apply(e.event, Object.assign({ seq: e.seq }, e.payload));
+            });
+            if (d.more) catchUp();
+        }).catch(function () {});
+    }
+
+    Object.keys(handlers).forEach(function (name) {
+        socket.on(name, function (data) { apply(name, data); });
+    });
+    // Точка отсчета: все, что было до загрузки страницы, уже учтено в ответах REST
+    fetch('/api/events').then(function (r) { return r.json(); }).then(function (d) {
+        if (d && d.last_seq > lastSeq) lastSeq = d.last_seq;
+        synced = true;
+    }).catch(function () {});
+    socket.on('connect', function () {
+        if (synced) catchUp();
+    });
+}
+
+// Long-poll, пока нет WebSocket (например, его режет прокси оператора): сервер держит запрос
+// до изменения версии (?wait=&since=), так что обновления приходят почти сразу и без частого поллинга.
+// url() возвращает адрес или null, если ждать нечего. Ответ должен содержать version.
+var LONG_POLL_WAIT_S = 25;
+var LONG_POLL_IDLE_MS = 3000;
+
+function longPollWhileOffline(socket, url, onData) {
+    var since = null;
+    var lastUrl = null;
+
+    function poll() {
+        var u = url();
+        if (socket.connected || !u) {
+            since = null;
+            setTimeout(poll, LONG_POLL_IDLE_MS);
+            return;
+        }
+        if (u !== lastUrl) { since = null; lastUrl = u; }
+        var q = since == null ? u : u + (u.indexOf('?') < 0 ? '?' : '&') + 'wait=' + LONG_POLL_WAIT_S + '&since=' + since;
+        fetch(q).then(function (r) {
+            if (!r.ok) throw new Error(String(r.status));
+            return r.json();
+        }).then(function (d) {
+            since = d.version;
+            onData(d);
+            setTimeout(poll, 0);
+        }).catch(function () {
+            since = null;
+            setTimeout(poll, LONG_POLL_IDLE_MS);
+        });
+    }
+
+    setTimeout(poll, LONG_POLL_IDLE_MS);
+}
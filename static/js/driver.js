@@ -14,8 +14,15 @@ let navStage = 'to_pickup'; // to_pickup | to_destination
 // Геолокация водителя
 let lastGeo = null; // { lat, lng, accuracy, ts }
 let geoWatchId = null;
-
-// --- Обратный геокодинг: улица и дом (Nominatim) ---
+let lastLocationReportTs = 0;
+const LOCATION_REPORT_INTERVAL_MS = 15000;
+// По Socket.IO координаты идут чаще: пассажир видит, как водитель едет к нему
+const LOCATION_STREAM_INTERVAL_MS = 1000;
+let lastLocationStreamTs = 0;
+// Heartbeat: без него сервер сочтет соединение потерянным и снимет водителя с линии
+const HEARTBEAT_INTERVAL_MS = 15000;
+
+// --- Обратный геокодинг: улица и дом (через сервер, /api/geocode/reverse) ---
 function formatStreetAndHouse(street, house) {
     var parts = [];
     if (street) parts.push(street.indexOf('ул.') === 0 || street.indexOf('улица') === 0 ? street : 'ул. ' + street);
@@ -25,13 +32,10 @@ function formatStreetAndHouse(street, house) {
 
 function reverseGeocode(lat, lng, callback) {
     var fallback = lat.toFixed(6) + ', ' + lng.toFixed(6);
-    fetch('https://nominatim.openstreetmap.org/reverse?lat=' + lat + '&lon=' + lng + '&format=json', { headers: { 'Accept-Language': 'ru' } })
-        .then(function (r) { return r.json(); })
+    fetch('/api/geocode/reverse?lat=' + lat + '&lng=' + lng, { credentials: 'same-origin' })
+        .then(function (r) { if (!r.ok) throw new Error(r.status); return r.json(); })
         .then(function (data) {
-            var a = data.address || {};
-            var street = a.road || a.street || a.pedestrian || a.footway;
-            var house = a.house_number || a.house;
-            var addr = formatStreetAndHouse(street, house) || data.display_name || fallback;
+            var addr = formatStreetAndHouse(data.street, data.house) || data.display_name || fallback;
             callback(addr);
         })
         .catch(function () { callback(fallback); });
@@ -136,6 +140,7 @@ function getCurrentLocation(cb) {
         function (p) {
             lastGeo = { lat: p.coords.latitude, lng: p.coords.longitude, accuracy: p.coords.accuracy, ts: Date.now() };
             updateGeoStatus();
+            reportLocation();
             cb({ lat: lastGeo.lat, lng: lastGeo.lng });
         },
         function () { cb(null); },
@@ -204,6 +209,27 @@ function updateGeoStatus(extra) {
     el.textContent = 'Геолокация: ' + lastGeo.lat.toFixed(6) + ', ' + lastGeo.lng.toFixed(6) + ' (±' + Math.round(lastGeo.accuracy) + 'м)' + warn2;
 }
 
+// Отправка координат на сервер: по Socket.IO не чаще LOCATION_STREAM_INTERVAL_MS,
+// без соединения — HTTP не чаще LOCATION_REPORT_INTERVAL_MS
+function reportLocation(force) {
+    if (!lastGeo) return;
+    var dot = document.querySelector('.status-dot');
+    if ((!dot || !dot.classList.contains('online')) && !currentOrder) return;
+    if (socket.connected) {
+        if (!force && Date.now() - lastLocationStreamTs < LOCATION_STREAM_INTERVAL_MS) return;
+        lastLocationStreamTs = Date.now();
+        socket.emit('driver_location', { lat: lastGeo.lat, lng: lastGeo.lng, accuracy: lastGeo.accuracy });
+        return;
+    }
+    if (!force && Date.now() - lastLocationReportTs < LOCATION_REPORT_INTERVAL_MS) return;
+    lastLocationReportTs = Date.now();
+    fetch('/api/driver/location', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ lat: lastGeo.lat, lng: lastGeo.lng, accuracy: lastGeo.accuracy })
+    }).catch(function () {});
+}
+
 function startGeoWatch() {
     if (geoWatchId != null) return;
     updateGeoStatus();
@@ -213,6 +239,7 @@ function startGeoWatch() {
             function (p) {
                 lastGeo = { lat: p.coords.latitude, lng: p.coords.longitude, accuracy: p.coords.accuracy, ts: Date.now() };
                 updateGeoStatus();
+                reportLocation();
             },
             function (err) {
                 var msg = err && err.message ? err.message : (err && err.code ? ('код ' + err.code) : 'ошибка');
@@ -240,6 +267,7 @@ async function checkCurrentOrder() {
                 pickup_lng: data.pickup_lng,
                 destination_lat: data.destination_lat,
                 destination_lng: data.destination_lng,
+                price: data.price,
                 assigned_at: data.assigned_at,
                 status: data.status
             };
@@ -301,6 +329,7 @@ document.getElementById('toggle-status-btn').addEventListener('click', async ()
 
         if (response.ok) {
             if (nextOnline) {
+                reportLocation(true);
                 if (data.queue_position != null) {
                     document.getElementById('queue-position').textContent = data.queue_position;
                     queueInfo.style.display = 'block';
@@ -427,6 +456,7 @@ function showOrder(orderData) {
         pickup_lng: orderData.pickup_lng,
         destination_lat: orderData.destination_lat,
         destination_lng: orderData.destination_lng,
+        price: orderData.price,
         assigned_at: orderData.assigned_at,
         status: orderData.status
     };
@@ -435,6 +465,11 @@ function showOrder(orderData) {
     var destEl = document.getElementById('order-destination');
     resolveAddress(pickupEl, currentOrder.pickup_lat, currentOrder.pickup_lng, currentOrder.pickup_address);
     resolveAddress(destEl, currentOrder.destination_lat, currentOrder.destination_lng, currentOrder.destination_address);
+    var priceRow = document.getElementById('order-price-row');
+    if (priceRow) {
+        priceRow.style.display = currentOrder.price != null ? 'block' : 'none';
+        document.getElementById('order-price').textContent = currentOrder.price != null ? Math.round(currentOrder.price) + ' грн' : '';
+    }
 
     document.getElementById('order-section').style.display = 'block';
     document.getElementById('accepted-order-section').style.display = 'none';
@@ -526,58 +561,97 @@ function clearOrderTimer() {
     document.getElementById('order-timer').textContent = '00:60';
 }
 
+// seq очереди (= версия очереди), см. queue_position / drivers_count ниже
+let lastQueueSeq = -1;
+
 // WebSocket события
 socket.on('connect', () => {
+    // Новое соединение (возможно, к другому воркеру или после перезапуска, где seq начался заново):
+    // старый seq не должен отбрасывать актуальное состояние, которое сервер присылает при подключении
+    lastQueueSeq = -1;
     if (driverUserId) socket.emit('driver_register', { user_id: driverUserId });
     // при переподключении синхронизируем очередь, даже если событие было пропущено
     fetch('/api/queue').then(function (r) { return r.json(); }).then(function (d) {
+        if (d.version < lastQueueSeq) return;
+        lastQueueSeq = d.version;
         applyQueueUpdate(d);
     }).catch(function () {});
 });
 
-socket.on('new_order', function (data) {
-    showOrder({
-        id: data.order_id,
-        order_id: data.order_id,
-        pickup_address: data.pickup_address,
-        destination_address: data.destination_address,
-        pickup_lat: data.pickup_lat,
-        pickup_lng: data.pickup_lng,
-        destination_lat: data.destination_lat,
-        destination_lng: data.destination_lng,
-        assigned_at: data.assigned_at,
-        status: 'assigned'
-    });
+// События заказа (с seq; пропущенные за время обрыва связи догружаются, см. app.js)
+subscribeOrderEvents(socket, {
+    new_order: function (data) {
+        showOrder({
+            id: data.order_id,
+            order_id: data.order_id,
+            pickup_address: data.pickup_address,
+            destination_address: data.destination_address,
+            pickup_lat: data.pickup_lat,
+            pickup_lng: data.pickup_lng,
+            destination_lat: data.destination_lat,
+            destination_lng: data.destination_lng,
+            price: data.price,
+            assigned_at: data.assigned_at,
+            status: 'assigned'
+        });
+    },
+    order_timeout: function (data) {
+        if (currentOrder && currentOrder.id === data.order_id) {
+            hideOrder();
+            alert('Время на принятие заказа истекло');
+        }
+    },
+    order_cancelled: function (data) {
+        if (currentOrder && currentOrder.id === data.order_id) {
+            hideOrder();
+            alert('Пассажир отменил заказ');
+        }
+    }
 });
 
-socket.on('order_timeout', (data) => {
-    if (currentOrder && currentOrder.id === data.order_id) {
-        hideOrder();
-        alert('Время на принятие заказа истекло');
-    }
+// Сервер снял водителя с линии (долго не было связи)
+socket.on('driver_status', function (d) {
+    if (!d || d.is_online) return;
+    const statusDot = document.querySelector('.status-dot');
+    const statusText = document.getElementById('status-text');
+    const btn = document.getElementById('toggle-status-btn');
+    const queueInfo = document.getElementById('queue-info');
+    if (statusDot) { statusDot.classList.remove('online'); statusDot.classList.add('offline'); }
+    if (statusText) statusText.textContent = 'Офлайн';
+    if (btn) btn.textContent = 'Выйти на линию';
+    if (queueInfo) queueInfo.style.display = 'none';
 });
 
-socket.on('queue_updated', (data) => {
-    try {
-        applyQueueUpdate(data);
-    } catch (e) {}
+// Очередь приходит адресно: drivers_count — всем, queue_position — только своя позиция.
+// seq нужен, чтобы не откатиться на устаревшее значение, если события пришли не по порядку.
+socket.on('queue_position', function (d) {
+    if (!d || d.seq < lastQueueSeq) return;
+    lastQueueSeq = d.seq;
+    applyQueueUpdate(d);
 });
 
-function applyQueueUpdate(data) {
-    var count = 0;
-    if (data && data.count != null) count = Number(data.count) || 0;
-    else if (data && Array.isArray(data.queue)) count = data.queue.length;
+socket.on('drivers_count', function (d) {
+    if (!d || d.seq < lastQueueSeq) return;
+    lastQueueSeq = d.seq;
+    applyDriversCount(d.count);
+});
 
+function applyDriversCount(count) {
+    count = Number(count) || 0;
     var countWrap = document.getElementById('drivers-count-wrap');
     var countEl = document.getElementById('drivers-online-count');
     if (countEl) countEl.textContent = String(count);
     if (countWrap) countWrap.style.display = count > 0 ? 'block' : 'none';
+}
 
-    // Очередь показываем тем, кто присутствует в positions (это и есть "на линии")
+// data: { count, position } — из queue_position или GET /api/queue
+function applyQueueUpdate(data) {
+    applyDriversCount(data && data.count);
+
+    // Очередь показываем, только если у водителя есть позиция (это и есть "на линии")
     var qi = document.getElementById('queue-info');
     var qp = document.getElementById('queue-position');
-    var pos = null;
-    if (data && data.positions && driverUserId) pos = data.positions[String(driverUserId)];
+    var pos = data ? data.position : null;
     if (pos != null) {
         if (qp) qp.textContent = String(pos);
         if (qi) qi.style.display = 'block';
@@ -659,15 +733,22 @@ document.addEventListener('DOMContentLoaded', () => {
         applyQueueUpdate(d);
     }).catch(function () {});
 
-    // Fallback: если socket-событие не дошло (телефон "уснул"/потерял websocket),
-    // периодически подтягиваем актуальное состояние.
+    // Fallback: если socket-событие не дошло (телефон "уснул"), периодически сверяем очередь —
+    // ответ без изменений приходит как 304 по ETag. Без WebSocket очередь ждем long-poll.
     setInterval(function () {
+        if (!socket.connected) return;
         fetch('/api/queue').then(function (r) { return r.json(); }).then(function (d) {
             applyQueueUpdate(d);
         }).catch(function () {});
     }, 3000);
+    longPollWhileOffline(socket, function () { return '/api/queue'; }, applyQueueUpdate);
     setInterval(() => {
         if (!currentOrder) checkCurrentOrder();
     }, 5000);
+    // Координаты стоящей машины тоже нужно обновлять, иначе сервер сочтет их устаревшими
+    setInterval(function () { reportLocation(); }, LOCATION_REPORT_INTERVAL_MS);
+    setInterval(function () {
+        if (socket.connected) socket.emit('heartbeat');
+    }, HEARTBEAT_INTERVAL_MS);
 });
 
@@ -3,6 +3,8 @@ const socket = io();
 const useYandex = !!(window.USE_YANDEX && typeof ymaps !== 'undefined');
 
 let currentOrderId = null;
+let currentOrderPoints = null; // { pickup: {lat, lng}, destination: {lat, lng} }
+let currentOrderStatus = null;
 let pickup = null;
 let destination = null;
 let selectStep = 'pickup';
@@ -38,16 +40,13 @@ function formatStreetAndHouse(street, house) {
     return parts.length ? parts.join(', ') : null;
 }
 
-// Обратный геокодинг — всегда Nominatim (как у водителя), карта может быть Яндекс
+// Обратный геокодинг — через сервер (как у водителя), карта может быть Яндекс
 function reverseGeocode(lat, lng, callback) {
     var fallback = lat.toFixed(6) + ', ' + lng.toFixed(6);
-    fetch('https://nominatim.openstreetmap.org/reverse?lat=' + lat + '&lon=' + lng + '&format=json', { headers: { 'Accept-Language': 'ru' } })
-        .then(function (r) { return r.json(); })
+    fetch('/api/geocode/reverse?lat=' + lat + '&lng=' + lng, { credentials: 'same-origin' })
+        .then(function (r) { if (!r.ok) throw new Error(r.status); return r.json(); })
         .then(function (data) {
-            var a = data.address || {};
-            var street = a.road || a.street || a.pedestrian || a.footway;
-            var house = a.house_number || a.house;
-            var addr = formatStreetAndHouse(street, house) || data.display_name || fallback;
+            var addr = formatStreetAndHouse(data.street, data.house) || data.display_name || fallback;
             callback(addr);
         })
         .catch(function () { callback(fallback); });
@@ -99,6 +98,7 @@ function setPickup(lat, lng) {
     });
     selectStep = 'destination';
     if (hintEl) hintEl.textContent = 'Выберите точку назначения на карте';
+    requestFareEstimate();
     updateConfirmButton();
     updateResetButtons();
 }
@@ -124,10 +124,38 @@ function setDestination(lat, lng) {
     });
     selectStep = 'ready';
     if (hintEl) hintEl.textContent = 'Проверьте адреса и нажмите «Подтвердить»';
+    requestFareEstimate();
     updateConfirmButton();
     updateResetButtons();
 }
 
+// --- Оценка стоимости: не чаще раза в FARE_DEBOUNCE_MS, ответ на устаревший маршрут отбрасывается ---
+const FARE_DEBOUNCE_MS = 300;
+const fareEl = document.getElementById('fare-estimate');
+var fareTimer = null;
+var fareSeq = 0;
+
+function formatPrice(price, currency) {
+    return Math.round(price) + ' ' + (currency === 'UAH' ? 'грн' : currency);
+}
+
+function requestFareEstimate() {
+    if (fareTimer) clearTimeout(fareTimer);
+    var seq = ++fareSeq;
+    if (!pickup || !destination) { if (fareEl) fareEl.textContent = ''; return; }
+    var route = { pickup_lat: pickup.lat, pickup_lng: pickup.lng, destination_lat: destination.lat, destination_lng: destination.lng };
+    fareTimer = setTimeout(function () {
+        fetch('/api/fare/estimate', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ routes: [route] }) })
+            .then(function (r) { if (!r.ok) throw new Error(r.status); return r.json(); })
+            .then(function (d) {
+                if (seq !== fareSeq || !fareEl) return;
+                var q = d.quotes[0];
+                fareEl.textContent = '≈ ' + formatPrice(q.price, d.currency) + ' · ' + q.distance_km.toFixed(1) + ' км' + (d.night ? ' (ночной тариф)' : '');
+            })
+            .catch(function () { if (seq === fareSeq && fareEl) fareEl.textContent = ''; });
+    }, FARE_DEBOUNCE_MS);
+}
+
 function updateConfirmButton() {
     var ok = pickup && pickup.address && destination && destination.address;
     if (confirmBtn) confirmBtn.disabled = !ok;
@@ -150,6 +178,7 @@ function clearPickup() {
     if (pickupInput) pickupInput.placeholder = 'Точка на карте';
     selectStep = destination ? 'destination' : 'pickup';
     if (hintEl) hintEl.textContent = selectStep === 'pickup' ? 'Выберите точку отправления на карте или «Моё местоположение»' : 'Выберите точку назначения на карте';
+    requestFareEstimate();
     updateConfirmButton();
     updateResetButtons();
 }
@@ -165,6 +194,7 @@ function clearDestination() {
     if (destInput) destInput.placeholder = 'Точка на карте';
     selectStep = pickup ? 'destination' : 'pickup';
     if (hintEl) hintEl.textContent = selectStep === 'pickup' ? 'Выберите точку отправления на карте или «Моё местоположение»' : 'Выберите точку назначения на карте';
+    requestFareEstimate();
     updateConfirmButton();
     updateResetButtons();
 }
@@ -272,6 +302,7 @@ function resetOrderForm() {
     if (destCoordsEl) destCoordsEl.textContent = '';
     if (hintEl) hintEl.textContent = 'Выберите точку отправления на карте или нажмите «Моё местоположение»';
     if (confirmBtn) confirmBtn.disabled = true;
+    requestFareEstimate();
     updateResetButtons();
     if (!useYandex && map) setTimeout(function () { map.invalidateSize(); }, 150);
 }
@@ -288,6 +319,7 @@ orderForm.addEventListener('submit', function (e) {
             if (data.order_id) {
                 currentOrderId = data.order_id;
                 showOrderStatus(data.order_id, pa, da, pickup.lat, pickup.lng, destination.lat, destination.lng);
+                showOrderPrice(data.price, data.currency);
                 document.getElementById('order-form-section').style.display = 'none';
             } else alert(data.error || 'Ошибка');
         })
@@ -295,6 +327,9 @@ orderForm.addEventListener('submit', function (e) {
 });
 
 function showOrderStatus(orderId, pa, da, pickupLat, pickupLng, destLat, destLng) {
+    currentOrderPoints = { pickup: { lat: pickupLat, lng: pickupLng }, destination: { lat: destLat, lng: destLng } };
+    currentOrderStatus = 'pending';
+    showDriverLocation(null);
     var pEl = document.getElementById('status-pickup');
     var dEl = document.getElementById('status-destination');
     resolveAddress(pEl, pickupLat, pickupLng, pa);
@@ -305,6 +340,35 @@ function showOrderStatus(orderId, pa, da, pickupLat, pickupLng, destLat, destLng
     var b = document.getElementById('cancel-order-btn'); if (b) b.style.display = 'block';
 }
 
+function showOrderPrice(price, currency) {
+    var row = document.getElementById('status-price-row');
+    if (!row) return;
+    if (price == null) { row.style.display = 'none'; return; }
+    document.getElementById('status-price').textContent = formatPrice(price, currency);
+    row.style.display = 'block';
+}
+
+// --- Где водитель: расстояние до точки подачи (после принятия) или до места назначения (в пути) ---
+function distanceKm(a, b) {
+    var r = Math.PI / 180;
+    var dLat = (b.lat - a.lat) * r, dLng = (b.lng - a.lng) * r;
+    var h = Math.sin(dLat / 2) * Math.sin(dLat / 2) + Math.cos(a.lat * r) * Math.cos(b.lat * r) * Math.sin(dLng / 2) * Math.sin(dLng / 2);
+    return 12742 * Math.asin(Math.min(1, Math.sqrt(h)));
+}
+
+function showDriverLocation(loc) {
+    var row = document.getElementById('status-driver-row');
+    if (!row) return;
+    var target = currentOrderPoints && (currentOrderStatus === 'in_progress' ? currentOrderPoints.destination : currentOrderPoints.pickup);
+    if (!loc || !target || target.lat == null || target.lng == null) { row.style.display = 'none'; return; }
+    var km = distanceKm(loc, target);
+    var dist = km < 1 ? Math.round(km * 1000) + ' м' : km.toFixed(1) + ' км';
+    var text = (currentOrderStatus === 'in_progress' ? 'до места назначения ' : 'до вас ') + dist;
+    if (loc.speed_kmh) text += ' · ' + Math.round(loc.speed_kmh) + ' км/ч';
+    document.getElementById('status-driver').textContent = text;
+    row.style.display = 'block';
+}
+
 function updateStatusStep(step, active) {
     var el = document.getElementById('step-' + step); if (!el) return;
     if (active) el.classList.add('active'); else el.classList.remove('active', 'completed');
@@ -320,47 +384,67 @@ document.getElementById('cancel-order-btn').addEventListener('click', function (
 });
 
 socket.on('connect', function () {});
-socket.on('queue_updated', function (d) {
+// Пассажиру приходит только счетчик водителей (комната passengers)
+socket.on('drivers_count', function (d) {
     applyDriversCount(d);
 });
 
 function applyDriversCount(d) {
     var count = 0;
     if (d && d.count != null) count = Number(d.count) || 0;
-    else if (d && Array.isArray(d.queue)) count = d.queue.length;
     var wrap = document.getElementById('drivers-count-wrap');
     var el = document.getElementById('drivers-online-count');
     if (el) el.textContent = String(count);
     if (wrap) wrap.style.display = count > 0 ? 'block' : 'none';
 }
-socket.on('order_assigned', function (d) { if (currentOrderId !== d.order_id) return; document.getElementById('status-text').textContent = 'Водитель назначен'; updateStatusStep('pending', false); updateStatusStep('assigned', true); });
-socket.on('order_accepted', function (d) { if (currentOrderId !== d.order_id) return; document.getElementById('status-text').textContent = 'Водитель принял'; updateStatusStep('assigned', false); updateStatusStep('accepted', true); document.getElementById('cancel-order-btn').style.display = 'none'; });
-socket.on('order_in_progress', function (d) { if (currentOrderId !== d.order_id) return; document.getElementById('status-text').textContent = 'В пути к месту назначения'; });
-socket.on('order_completed', function (d) {
+// События заказа (с seq; пропущенные за время обрыва связи догружаются, см. app.js)
+subscribeOrderEvents(socket, {
+    order_assigned: function (d) { if (currentOrderId !== d.order_id) return; document.getElementById('status-text').textContent = 'Водитель назначен'; updateStatusStep('pending', false); updateStatusStep('assigned', true); },
+    order_accepted: function (d) { if (currentOrderId !== d.order_id) return; currentOrderStatus = 'accepted'; document.getElementById('status-text').textContent = 'Водитель принял'; updateStatusStep('assigned', false); updateStatusStep('accepted', true); document.getElementById('cancel-order-btn').style.display = 'none'; },
+    order_in_progress: function (d) { if (currentOrderId !== d.order_id) return; currentOrderStatus = 'in_progress'; document.getElementById('status-text').textContent = 'В пути к месту назначения'; },
+    order_completed: function (d) {
+        if (currentOrderId !== d.order_id) return;
+        showDriverLocation(null);
+        document.getElementById('status-text').textContent = 'Завершено'; updateStatusStep('accepted', false); updateStatusStep('completed', true); document.getElementById('cancel-order-btn').style.display = 'none';
+        setTimeout(function () { currentOrderId = null; document.getElementById('order-status-section').style.display = 'none'; document.getElementById('order-form-section').style.display = 'block'; resetOrderForm(); }, 3000);
+    }
+});
+socket.on('driver_location', function (d) {
     if (currentOrderId !== d.order_id) return;
-    document.getElementById('status-text').textContent = 'Завершено'; updateStatusStep('accepted', false); updateStatusStep('completed', true); document.getElementById('cancel-order-btn').style.display = 'none';
-    setTimeout(function () { currentOrderId = null; document.getElementById('order-status-section').style.display = 'none'; document.getElementById('order-form-section').style.display = 'block'; resetOrderForm(); }, 3000);
+    showDriverLocation(d);
 });
 
+function applyOrderState(d) {
+    if (!d || currentOrderId !== d.order_id) return;
+    currentOrderStatus = d.status;
+    if (d.driver_location) showDriverLocation(d.driver_location);
+    else if (['accepted', 'in_progress'].indexOf(d.status) < 0) showDriverLocation(null);
+    document.getElementById('status-text').textContent = ({ pending: 'Ожидание водителя', assigned: 'Водитель назначен', accepted: 'Водитель принял', in_progress: 'В пути', completed: 'Завершено', cancelled: 'Отменено' })[d.status] || d.status;
+    updateStatusStep('pending', d.status === 'pending'); updateStatusStep('assigned', ['assigned','accepted','in_progress','completed'].indexOf(d.status) >= 0); updateStatusStep('accepted', ['accepted','in_progress','completed'].indexOf(d.status) >= 0); updateStatusStep('completed', d.status === 'completed');
+    if (['completed','cancelled'].indexOf(d.status) >= 0) document.getElementById('cancel-order-btn').style.display = 'none';
+}
+
+// Сверка заказа при живом WebSocket (без изменений — 304 по ETag); без него заказ ждем long-poll
 setInterval(function () {
-    if (!currentOrderId) return;
-    fetch('/api/passenger/orders/' + currentOrderId).then(function (r) { return r.json(); }).then(function (d) {
-        document.getElementById('status-text').textContent = ({ pending: 'Ожидание водителя', assigned: 'Водитель назначен', accepted: 'Водитель принял', in_progress: 'В пути', completed: 'Завершено', cancelled: 'Отменено' })[d.status] || d.status;
-        updateStatusStep('pending', d.status === 'pending'); updateStatusStep('assigned', ['assigned','accepted','in_progress','completed'].indexOf(d.status) >= 0); updateStatusStep('accepted', ['accepted','in_progress','completed'].indexOf(d.status) >= 0); updateStatusStep('completed', d.status === 'completed');
-        if (['completed','cancelled'].indexOf(d.status) >= 0) document.getElementById('cancel-order-btn').style.display = 'none';
-    }).catch(function () {});
+    if (!currentOrderId || !socket.connected) return;
+    fetch('/api/passenger/orders/' + currentOrderId).then(function (r) { return r.json(); }).then(applyOrderState).catch(function () {});
 }, 5000);
+longPollWhileOffline(socket, function () {
+    return currentOrderId ? '/api/passenger/orders/' + currentOrderId : null;
+}, applyOrderState);
 
 fetch('/api/drivers/online_count').then(function (r) { return r.json(); }).then(function (d) {
     applyDriversCount({ count: d && d.count != null ? d.count : 0 });
 }).catch(function () {});
 
-// Fallback: обновление счетчика, если socket-события пропали
+// Fallback: обновление счетчика, если socket-события пропали (без WebSocket — long-poll)
 setInterval(function () {
+    if (!socket.connected) return;
     fetch('/api/queue').then(function (r) { return r.json(); }).then(function (d) {
         applyDriversCount(d);
     }).catch(function () {});
 }, 3000);
+longPollWhileOffline(socket, function () { return '/api/queue'; }, applyDriversCount);
 
 var elSwitchDriver = document.getElementById('switch-to-driver');
 if (elSwitchDriver) elSwitchDriver.addEventListener('click', function (e) {
@@ -0,0 +1,155 @@
+"""Поток координат водителей: кольцевые буферы в памяти, пересылка пассажиру и прореженный трек.
+
+На каждую точку — только операции со словарями под одним Lock, без запросов к БД:
+- последние LOCATION_BUFFER_SIZE точек водителя лежат в deque(maxlen=...) — память на водителя ограничена;
+- водитель помечается «грязным», а пересылка раз в LOCATION_FORWARD_INTERVAL_SECONDS отдает пассажиру
+  только последнюю точку (сколько бы их ни пришло за интервал);
+- в трек попадает точка не чаще раза в LOCATION_TRACK_INTERVAL_SECONDS и только если водитель сдвинулся
+  на LOCATION_TRACK_MIN_DISTANCE_M; такие точки копятся и пишутся в БД пачкой.
+Какой заказ и какой пассажир у водителя, трекер знает сам (assign/start_forwarding/release).
+"""
+import math
+import threading
+from collections import deque, namedtuple
+
+from geo import haversine_km
+
+Fix = namedtuple('Fix', 'lat lng accuracy ts')
+
+
+class _Trip:
+    __slots__ = ('order_id', 'passenger_id', 'forward')
+
+    def __init__(self, order_id, passenger_id, forward):
+        self.order_id = order_id
+        self.passenger_id = passenger_id
+        self.forward = forward
+
+
+def _heading(a, b):
+    """Курс от точки a к точке b, градусы от севера (0..360)."""
+    p1, p2 = math.radians(a.lat), math.radians(b.lat)
+    dl = math.radians(b.lng - a.lng)
+    y = math.sin(dl) * math.cos(p2)
+    x = math.cos(p1) * math.sin(p2) - math.sin(p1) * math.cos(p2) * math.cos(dl)
+    return (math.degrees(math.atan2(y, x)) + 360) % 360
+
+
+class LocationTracker:
+    def __init__(self, buffer_size=32, track_interval=10.0, track_min_distance_m=25.0, max_pending=10000):
+        self.buffer_size = buffer_size
+        self.track_interval = track_interval
+        self.track_min_km = track_min_distance_m / 1000.0
+        self._lock = threading.Lock()
+        self._fixes = {}        # driver_id -> deque[Fix]
+        self._kept = {}         # driver_id -> последняя точка, попавшая в трек
+        self._trips = {}        # driver_id -> _Trip
+        self._dirty = set()     # водители с новой точкой для пассажира
+        # Точки трека, ждущие записи; при недоступной БД старые вытесняются
+        self._pending = deque(maxlen=max_pending)
+
+    def __len__(self):
+        return len(self._fixes)
+
+    # --- заказ водителя ---
+
+    def assign(self, driver_id, order_id, passenger_id, forward=False):
+        with self._lock:
+            self._trips[driver_id] = _Trip(order_id, passenger_id, forward)
+
+    def start_forwarding(self, driver_id, order_id):
+        """Заказ принят: точки водителя идут пассажиру."""
+        with self._lock:
+            trip = self._trips.get(driver_id)
+            if trip is not None and trip.order_id == order_id:
+                trip.forward = True
+                if driver_id in self._fixes:
+                    self._dirty.add(driver_id)
+
+    def release(self, driver_id):
+        with self._lock:
+            self._trips.pop(driver_id, None)
+            self._dirty.discard(driver_id)
+
+    def is_busy(self, driver_id):
+        return driver_id in self._trips
+
+    def forget(self, driver_id):
+        """Водитель ушел с линии: буфер точек больше не нужен (заказ, если есть, остается)."""
+        with self._lock:
+            self._fixes.pop(driver_id, None)
+            self._kept.pop(driver_id, None)
+            self._dirty.discard(driver_id)
+
+    # --- точки ---
+
+    def record(self, driver_id, lat, lng, accuracy, ts):
+        """Принять точку. True — если у водителя есть пассажир, которому ее надо переслать."""
+        fix = Fix(lat, lng, accuracy, ts)
+        with self._lock:
+            buf = self._fixes.get(driver_id)
+            if buf is None:
+                buf = self._fixes[driver_id] = deque(maxlen=self.buffer_size)
+            elif ts < buf[-1].ts:
+                return False  # Запоздавшая точка: последней она уже не станет
+            buf.append(fix)
+            trip = self._trips.get(driver_id)
+            kept = self._kept.get(driver_id)
+            if kept is None or (ts - kept.ts >= self.track_interval
+                                and haversine_km(kept.lat, kept.lng, lat, lng) >= self.track_min_km):
+                self._kept[driver_id] = fix
+                self._pending.append((driver_id, trip.order_id if trip else None, fix))
+            if trip is not None and trip.forward:
+                self._dirty.add(driver_id)
+                return True
+            return False
+
+    def latest(self, driver_id):
+        buf = self._fixes.get(driver_id)
+        return buf[-1] if buf else None
+
+    def _motion(self, buf):
+        """Курс и скорость по двум последним точкам буфера (None, если не посчитать)."""
+        if len(buf) < 2:
+            return None, None
+        a, b = buf[-2], buf[-1]
+        dt = b.ts - a.ts
+        km = haversine_km(a.lat, a.lng, b.lat, b.lng)
+        if dt <= 0:
+            return None, None
+        if km < 0.003:
+            return None, 0.0  # Стоит на месте: курс по шуму GPS не считаем
+        return round(_heading(a, b)), round(km / dt * 3600, 1)
+
+    def take_updates(self):
+        """Накопившиеся обновления для пассажиров: [(passenger_id, payload)], по одному на водителя."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            out = []
+            for driver_id in dirty:
+                trip = self._trips.get(driver_id)
+                buf = self._fixes.get(driver_id)
+                if trip is None or not trip.forward or not buf:
+                    continue
+                fix = buf[-1]
+                heading, speed = self._motion(buf)
+                out.append((trip.passenger_id, {
+                    'order_id': trip.order_id,
+                    'lat': fix.lat,
+                    'lng': fix.lng,
+                    'accuracy': fix.accuracy,
+                    'heading': heading,
+                    'speed_kmh': speed,
+                    'ts': fix.ts,
+                }))
+        return out
+
+    def take_track_points(self):
+        """Все точки трека, ждущие записи в БД: [(driver_id, order_id, Fix)]."""
+        with self._lock:
+            points = list(self._pending)
+            self._pending.clear()
+        return points
+
+    def pending_track_points(self):
+        return len(self._pending)
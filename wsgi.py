@@ -2,13 +2,22 @@
 WSGI entrypoint for production (gunicorn).
 
 Important: when running via gunicorn, the __main__ blocks in main.py/app.py are NOT executed,
-so we initialize the database and rebuild the in-memory driver queue here.
+so we initialize the database, rebuild the in-memory driver queue, repair assignments whose
+acceptance timers were lost with the previous process, rebuild the order backlog and publish
+order events the previous process committed but did not deliver here, and start moving
+old completed/cancelled orders to the archive table.
+With COORDINATION_URL set, every gunicorn worker runs this under the shared dispatch lock and
+adopts the existing shared queue instead of reseeding it.
 """
 
-from app import app, init_db, rebuild_driver_queue
+from app import app, init_db, rebuild_driver_queue, reconcile_assignments, rebuild_order_backlog, resume_order_events, start_order_archive
 
 init_db()
 rebuild_driver_queue()
+reconcile_assignments()
+rebuild_order_backlog()
+resume_order_events()
+start_order_archive()
 
 # gunicorn looks for `app` here: `wsgi:app`
 